@@ -0,0 +1,270 @@
+"""Resumable accuracy sweeps, with results stored in a sharded on-disk table.
+
+An accuracy sweep runs some benchmark function (like bench.bench_core, wrapped up
+by bench.CoreBench) on a long stream of cases, each of which produces one
+record of numbers. Here the stream is cut into fixed size chunks,
+by position: chunk k is cases k*chunk_size up to (k+1)*chunk_size.
+Chunks are evaluated on a process pool, and each one is written to its own shard
+of the table as soon as it comes back. Only a few chunks are in flight at once,
+so the stream can be much bigger than memory.
+
+Running the same sweep again on the same table directory skips every chunk
+that is already stored, so a crashed or interrupted sweep picks up where it left off,
+and extending the stream of cases (by appending to the end) only computes the new ones.
+The random number generator is seeded for each chunk from the sweep's seed
+and the chunk's position, so a chunk computes the same records whenever it runs.
+
+The table is a directory:
+  meta.json         chunk size, number of columns, a description of the sweep,
+                    and the number of cases in each stored chunk
+  chunk_<k>.npy     float64 array of shape (1 + columns, records): the case index
+                    of each record, then one row per column
+
+Cases for which the benchmark function returns None (such as arguments that can't satisfy
+a precondition) produce no record. Summaries read one column of one shard at a time,
+through memory maps, so they never need the whole table in memory.
+"""
+
+import os
+import json
+import math
+import random
+import itertools
+import collections
+import multiprocessing
+
+import numpy as np
+
+
+meta_name = 'meta.json'
+meta_version = 1
+
+
+# break arguments up into chunks manually.
+# thanks to:
+# https://stackoverflow.com/questions/8991506/iterate-an-iterator-by-chunks-of-n-in-python
+def grouper(n, iterable):
+    it = iter(iterable)
+    while True:
+       chunk = tuple(itertools.islice(it, n))
+       if not chunk:
+           return
+       yield chunk
+
+
+def _run_chunk(job):
+    fn, seed, k, start, cases = job
+    random.seed(f'{seed!s}:{k:d}')
+
+    idxs = []
+    records = []
+    for i, case in enumerate(cases):
+        record = fn(case)
+        if record is not None:
+            idxs.append(start + i)
+            records.append(record)
+
+    if records:
+        data = np.empty((1 + len(records[0]), len(records)), dtype=np.float64)
+        data[0] = idxs
+        data[1:] = np.array(records, dtype=np.float64).T
+    else:
+        data = None
+    return k, len(cases), data
+
+
+class SweepTable(object):
+    """A sharded table of sweep records, in a directory. Opening a directory
+    that doesn't have a table yet creates an empty one (when the first chunk is stored).
+    """
+
+    def __init__(self, path, description=None, chunk_size=None):
+        self.path = path
+        meta_path = os.path.join(path, meta_name)
+        if os.path.exists(meta_path):
+            with open(meta_path, 'rt') as f:
+                self.meta = json.load(f)
+            if self.meta.get('version') != meta_version:
+                raise ValueError(f'unsupported sweep table version {self.meta.get("version")!r} in {path!r}')
+            if description is not None and self.meta['description'] != description:
+                raise ValueError(f'sweep table in {path!r} is for a different sweep:\n'
+                                 f'  {self.meta["description"]!s}\n  not {description!s}')
+            if chunk_size is not None and self.meta['chunk_size'] != chunk_size:
+                raise ValueError(f'sweep table in {path!r} has chunks of size {self.meta["chunk_size"]:d}, not {chunk_size:d}')
+        else:
+            self.meta = {
+                'version': meta_version,
+                'description': description,
+                'chunk_size': chunk_size,
+                'columns': None,
+                'chunks': {},
+            }
+
+    def __repr__(self):
+        return f'<{type(self).__name__} object at {hex(id(self))} with {len(self):d} records in {self.path!r}>'
+
+    def __len__(self):
+        return sum(shard.shape[1] for shard in self.shards())
+
+    @property
+    def columns(self):
+        return self.meta['columns']
+
+    def chunk_cases(self, k):
+        """Number of cases that have been run for chunk k, or None if it hasn't been run."""
+        return self.meta['chunks'].get(str(k))
+
+    def _chunk_file(self, k):
+        return os.path.join(self.path, f'chunk_{k:08d}.npy')
+
+    def _write_meta(self):
+        tmp = os.path.join(self.path, meta_name + '.tmp')
+        with open(tmp, 'wt') as f:
+            json.dump(self.meta, f, indent=None, separators=(',', ':'))
+        os.replace(tmp, os.path.join(self.path, meta_name))
+
+    def store(self, k, ncases, data):
+        """Store the records for chunk k, which ran ncases cases; data can be None if none of them produced a record."""
+        os.makedirs(self.path, exist_ok=True)
+        if data is not None:
+            if self.meta['columns'] is None:
+                self.meta['columns'] = data.shape[0] - 1
+            elif self.meta['columns'] != data.shape[0] - 1:
+                raise ValueError(f'expecting records with {self.meta["columns"]:d} columns, got {data.shape[0] - 1:d}')
+            tmp = self._chunk_file(k) + '.tmp'
+            with open(tmp, 'wb') as f:
+                np.save(f, data)
+            os.replace(tmp, self._chunk_file(k))
+        elif os.path.exists(self._chunk_file(k)):
+            os.remove(self._chunk_file(k))
+        # the chunk only counts as done once the meta says so
+        self.meta['chunks'][str(k)] = ncases
+        self._write_meta()
+
+    def shards(self):
+        """Yield the stored chunks in order, as read-only memory-mapped arrays."""
+        for k in sorted(int(k) for k in self.meta['chunks']):
+            fname = self._chunk_file(k)
+            if os.path.exists(fname):
+                yield np.load(fname, mmap_mode='r')
+
+    def iter_column(self, idx):
+        """Yield the values of column idx (or 'index' for the case indices) one shard at a time."""
+        row = 0 if idx == 'index' else idx + 1
+        for shard in self.shards():
+            yield np.array(shard[row])
+
+    def column(self, idx):
+        parts = list(self.iter_column(idx))
+        if parts:
+            return np.concatenate(parts)
+        else:
+            return np.empty(0, dtype=np.float64)
+
+    def split_records(self, xidx, yidx):
+        """Two columns of the table, like bench.split_records on a list of records."""
+        return self.column(xidx), self.column(yidx)
+
+    def cdf(self, idx):
+        """Empirical CDF of one column, like bench.cdf."""
+        xs = np.sort(self.column(idx))
+        return xs, np.arange(len(xs)) / len(xs)
+
+    def hist_cdf(self, idx, bins):
+        """CDF of one column at fixed bin edges, accumulated one shard at a time."""
+        bins = np.asarray(bins, dtype=np.float64)
+        counts = np.zeros(len(bins) - 1, dtype=np.int64)
+        total = 0
+        for xs in self.iter_column(idx):
+            counts += np.histogram(xs, bins=bins)[0]
+            total += len(xs)
+        if total == 0:
+            return bins[1:], np.zeros(len(counts))
+        return bins[1:], np.cumsum(counts) / total
+
+    def split_xs(self, xidx, yidx):
+        """Group the values of column yidx by the value of column xidx, like bench.split_xs."""
+        groups = collections.defaultdict(list)
+        for xs, ys in zip(self.iter_column(xidx), self.iter_column(yidx)):
+            order = np.argsort(xs, kind='stable')
+            xs, ys = xs[order], ys[order]
+            keys, starts = np.unique(xs, return_index=True)
+            for x, part in zip(keys.tolist(), np.split(ys, starts[1:])):
+                groups[x].append(part)
+        return {x: np.concatenate(parts) for x, parts in groups.items()}
+
+    def summary(self, idx):
+        """Count, mean, min and max of the finite values in one column, and how many weren't finite."""
+        n = 0
+        total = 0.0
+        lo = math.inf
+        hi = -math.inf
+        nonfinite = 0
+        for xs in self.iter_column(idx):
+            finite = np.isfinite(xs)
+            nonfinite += int(len(xs) - np.count_nonzero(finite))
+            xs = xs[finite]
+            if len(xs) > 0:
+                n += len(xs)
+                total += math.fsum(xs)
+                lo = min(lo, float(xs.min()))
+                hi = max(hi, float(xs.max()))
+        return {
+            'count': n,
+            'mean': total / n if n > 0 else math.nan,
+            'min': lo,
+            'max': hi,
+            'nonfinite': nonfinite,
+        }
+
+
+def run(fn, cases, path, description=None, chunk_size=20000, nprocs=None, seed=0, verbosity=1):
+    """Run fn on every case, storing the records in the SweepTable at path, and return the table.
+
+    fn must be picklable (for the pool), and return a record (a sequence of numbers)
+    or None for each case. Chunks already stored in the table are skipped,
+    unless the last time they were run they were cut short by the end of the cases.
+    If description is given, it must match the description the table was made with.
+    """
+    if nprocs is None:
+        nprocs = max(multiprocessing.cpu_count() // 2, 1)
+
+    table = SweepTable(path, description=description, chunk_size=chunk_size)
+    if table.meta['chunk_size'] is None:
+        table.meta['chunk_size'] = chunk_size
+
+    def jobs():
+        for k, chunk in enumerate(grouper(chunk_size, cases)):
+            done = table.chunk_cases(k)
+            if done is not None and done >= len(chunk):
+                continue
+            yield fn, seed, k, k * chunk_size, chunk
+
+    skipped = len(table.meta['chunks'])
+    computed = 0
+    # only keep a few chunks in flight, so that the cases are consumed lazily
+    max_pending = 2 * nprocs
+    with multiprocessing.Pool(processes=nprocs) as pool:
+        pending = collections.deque()
+        job_iter = jobs()
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_pending:
+                job = next(job_iter, None)
+                if job is None:
+                    exhausted = True
+                else:
+                    pending.append(pool.apply_async(_run_chunk, (job,)))
+            if pending:
+                k, ncases, data = pending.popleft().get()
+                table.store(k, ncases, data)
+                computed += 1
+                if verbosity >= 1:
+                    print('.', end='', flush=True)
+
+    if verbosity >= 1:
+        if computed > 0:
+            print()
+        print(f'computed {computed:d} chunks ({skipped:d} stored before), table has {len(table):d} records', flush=True)
+
+    return table
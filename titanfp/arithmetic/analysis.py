@@ -1,7 +1,12 @@
 """Dynamic analysis for fpcore interpreters."""
 
+import sys
+import math
+import time
+import itertools
+import collections
 
-from ..titanic import utils
+from ..titanic import utils, digital
 from ..fpbench import fpcast as ast
 from ..fpbench import fpcparser
 
@@ -17,6 +22,197 @@ def bitcost(x):
         return 0
 
 
+# streaming primitives
+# these take constant memory no matter how many values they see,
+# and can be merged, so that analyses from separate runs (or separate worker processes)
+# can be combined afterwards
+
+
+class ContextInterner(object):
+    """Interned propstrs for evaluation contexts.
+
+    Formatting ctx.propstr() for every evaluation is expensive, but contexts made by let()
+    with only new bindings share their props dictionary, which is never modified
+    after it's made. So the propstr is cached by the type of the context and
+    the identity of its props, and the same string object is returned every time.
+    The cache holds on to the props (so that their ids can't be reused) and is
+    emptied when it gets full, as (! ...) expressions make new props on every evaluation.
+    """
+
+    def __init__(self, max_cached=256):
+        self.max_cached = max_cached
+        self.cache = {}
+        self.strings = {}
+
+    def propstr(self, ctx):
+        key = (type(ctx), id(ctx.props))
+        try:
+            return self.cache[key][1]
+        except KeyError:
+            s = ctx.propstr()
+            s = self.strings.setdefault(s, s)
+            if len(self.cache) >= self.max_cached:
+                self.cache.clear()
+            self.cache[key] = (ctx.props, s)
+            return s
+
+    def intern(self, s):
+        return self.strings.setdefault(s, s)
+
+
+class ExponentHistogram(object):
+    """Counts of the exponents (x.e) of digital values, with separate counts
+    for zeros, infinities, and NaNs. Exponents outside [lo, hi] are counted
+    at the nearest end, so there are never more than hi - lo + 1 bins.
+    The defaults cover every finite binary128 value.
+    """
+
+    def __init__(self, lo=-16494, hi=16383):
+        self.lo = lo
+        self.hi = hi
+        self.counts = {}
+        self.zeros = 0
+        self.infs = 0
+        self.nans = 0
+
+    def __len__(self):
+        return sum(self.counts.values()) + self.zeros + self.infs + self.nans
+
+    def record(self, x):
+        if x.isnan:
+            self.nans += 1
+        elif x.isinf:
+            self.infs += 1
+        elif x.is_zero():
+            self.zeros += 1
+        else:
+            e = min(max(x.e, self.lo), self.hi)
+            self.counts[e] = self.counts.get(e, 0) + 1
+
+    def merge(self, other):
+        if (self.lo, self.hi) != (other.lo, other.hi):
+            raise AnalysisError('cannot merge exponent histograms with bounds [{:d}, {:d}] and [{:d}, {:d}]'
+                                .format(self.lo, self.hi, other.lo, other.hi))
+        for e, count in other.counts.items():
+            self.counts[e] = self.counts.get(e, 0) + count
+        self.zeros += other.zeros
+        self.infs += other.infs
+        self.nans += other.nans
+        return self
+
+    def items(self):
+        """(exponent, count) pairs for the nonzero finite values, in order of exponent."""
+        return sorted(self.counts.items())
+
+    def range(self):
+        """Smallest and largest exponents seen, or None if there were no nonzero finite values."""
+        if self.counts:
+            return min(self.counts), max(self.counts)
+        else:
+            return None
+
+
+def digital_to_float(x):
+    """Approximate value of a digital number as a Python float (without gmpy2)."""
+    if x.isnan:
+        return math.nan
+    elif x.isinf:
+        return -math.inf if x.negative else math.inf
+    c, exp = x.c, x.exp
+    shift = c.bit_length() - 64
+    if shift > 0:
+        c >>= shift
+        exp += shift
+    try:
+        f = math.ldexp(c, exp)
+    except OverflowError:
+        f = math.inf
+    return -f if x.negative else f
+
+
+class ValueSketch(object):
+    """Count, minimum, maximum, mean, and variance of a stream of digital values.
+    The extremes are kept as the values themselves, the mean and variance are
+    accumulated in floating point (with Welford's method), over the finite values only.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.nonfinite = 0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def record(self, x):
+        if not x.is_finite_real():
+            self.nonfinite += 1
+            return
+        if self.count == 0:
+            self.min = x
+            self.max = x
+        elif x < self.min:
+            self.min = x
+        elif x > self.max:
+            self.max = x
+        self.count += 1
+        f = digital_to_float(x)
+        delta = f - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (f - self.mean)
+
+    @property
+    def variance(self):
+        if self.count > 1:
+            return self.m2 / (self.count - 1)
+        else:
+            return math.nan
+
+    def merge(self, other):
+        self.nonfinite += other.nonfinite
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.min, self.max, self.mean, self.m2 = other.count, other.min, other.max, other.mean, other.m2
+            return self
+        if other.min < self.min:
+            self.min = other.min
+        if other.max > self.max:
+            self.max = other.max
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        return self
+
+
+def merge_node_maps(node_map, other_map, merge_record):
+    """Merge the per-node records in other_map into node_map (both keyed by id).
+
+    Nodes that are in both maps are merged directly. Otherwise (say the other analysis
+    ran in a different process, on its own copy of the program) nodes are matched
+    by their text, and nodes with the same text by the order they were first evaluated.
+    Records with no match are added to node_map as they are.
+    """
+    by_text = collections.defaultdict(collections.deque)
+    for eid, record in node_map.items():
+        by_text[str(record.e)].append(eid)
+    for eid, record in other_map.items():
+        if eid in node_map and node_map[eid].e is record.e:
+            merge_record(node_map[eid], record)
+            by_text[str(record.e)].remove(eid)
+            continue
+        candidates = by_text[str(record.e)]
+        if candidates:
+            merge_record(node_map[candidates.popleft()], record)
+        else:
+            key = eid
+            while key in node_map:
+                key = ('merged', key)
+            node_map[key] = record
+
+
 class DefaultAnalysis(object):
     """FPCore default run-time analysis.
     Tracks execution counts and contexts per node of the AST.
@@ -26,13 +222,33 @@ class DefaultAnalysis(object):
 
     def __init__(self):
         self.node_map = {}
+        self.contexts = ContextInterner()
 
     def track(self, e, ctx, inputs, result):
         if not (isinstance(e, ast.ValueExpr) or isinstance(e, ast.Ctx)):
             eid = id(e)
             if eid not in self.node_map:
                 self.node_map[eid] = DefaultRecord(e)
-            self.node_map[eid].record(ctx)
+            self.node_map[eid].record(self.contexts.propstr(ctx))
+
+    def merge(self, other):
+        """Add the counts from another DefaultAnalysis to this one."""
+        def merge_record(record, other_record):
+            record.merge(other_record, intern=self.contexts.intern)
+        merge_node_maps(self.node_map, other.node_map, merge_record)
+        return self
+
+    def __getstate__(self):
+        # the context cache holds on to props by id, which is meaningless in another process
+        state = self.__dict__.copy()
+        state['contexts'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.contexts = ContextInterner()
+        for record in self.node_map.values():
+            record.ctxs = {self.contexts.intern(s): count for s, count in record.ctxs.items()}
 
     def report(self):
         s = 'Default titanic analysis:\n'
@@ -50,14 +266,21 @@ class DefaultRecord(object):
         self.ctxs = {}
         self.evals = 0
 
-    def record(self, ctx):
-        s = ctx.propstr()
-        if s in self.ctxs:
-            self.ctxs[s] += 1
-        else:
-            self.ctxs[s] = 1
+    def record(self, propstr):
+        """Count one evaluation in the context with this propstr,
+        which should be interned (see ContextInterner).
+        """
+        self.ctxs[propstr] = self.ctxs.get(propstr, 0) + 1
         self.evals += 1
 
+    def merge(self, other, intern=None):
+        for s, count in other.ctxs.items():
+            if intern is not None:
+                s = intern(s)
+            self.ctxs[s] = self.ctxs.get(s, 0) + count
+        self.evals += other.evals
+        return self
+
     def to_props(self):
         ctx_counts = ['(({:s}) {:d})'.format(propstr, count) for propstr, count in self.ctxs.items()]
         s = ':titanic-eval-count {:d} :titanic-eval-ctxs ({:s})'.format(self.evals, ' '.join(ctx_counts))
@@ -104,6 +327,16 @@ class BitcostAnalysis(object):
         else:
             pass
 
+    def merge(self, other):
+        """Add the bit counts from another BitcostAnalysis to this one."""
+        self.bits_constant += other.bits_constant
+        self.bits_variable += other.bits_variable
+        self.bits_requested += other.bits_requested
+        self.bits_computed += other.bits_computed
+        self.bits_referenced += other.bits_referenced
+        self.bits_quantized += other.bits_quantized
+        return self
+
     def report(self):
         s = 'Titanic bitcost analysis:\n'
         s += '  {:d} bits requested as inputs by operations\n'.format(self.bits_requested)
@@ -116,21 +349,39 @@ class BitcostAnalysis(object):
 
 
 class RangeAnalysis(object):
-    """FPCore analysis for dynamic range of values that come out of operations
+    """FPCore analysis for dynamic range of values that come out of operations.
+    Each node keeps a histogram of the exponents of its results, and a sketch
+    of their values, so memory doesn't grow with the number of evaluations.
+    Results that aren't digital numbers (booleans, tensors) are skipped.
     """
 
-    def __init__(self):
+    def __init__(self, lo=-16494, hi=16383):
+        self.lo = lo
+        self.hi = hi
         self.node_map = {}
         self.report_from = set()
 
     def track(self, e, ctx, inputs, result):
         eid = id(e)
         if eid not in self.node_map:
-            self.node_map[eid] = RangeRecord(e)
-        self.node_map[eid].record(result)
-        if isinstance(e, ast.Ctx):
-            if 'report' in e.props and e.props['report'] == 'here':
+            self.node_map[eid] = RangeRecord(e, self.lo, self.hi)
+            if isinstance(e, ast.Ctx):
+                if 'report' in e.props and e.props['report'] == 'here':
+                    self.report_from.add(eid)
+        if isinstance(result, digital.Digital):
+            self.node_map[eid].record(result)
+
+    def merge(self, other):
+        """Add the ranges from another RangeAnalysis to this one."""
+        report_nodes = [other.node_map[eid].e for eid in other.report_from]
+        def merge_record(record, other_record):
+            record.merge(other_record)
+        merge_node_maps(self.node_map, other.node_map, merge_record)
+        for eid, record in self.node_map.items():
+            if any(record.e is e for e in report_nodes) or (
+                    isinstance(record.e, ast.Ctx) and record.e.props.get('report') == 'here'):
                 self.report_from.add(eid)
+        return self
 
     def report(self):
         return [(str(self.node_map[eid].e.depth_limit(3)), self.node_map[eid].exponents) for eid in self.report_from]
@@ -138,9 +389,288 @@ class RangeAnalysis(object):
 class RangeRecord(object):
     """Analysis record for a single node in the ast."""
 
-    def __init__(self, e):
+    def __init__(self, e, lo=-16494, hi=16383):
         self.e = e
-        self.exponents = []
+        self.exponents = ExponentHistogram(lo, hi)
+        self.values = ValueSketch()
 
     def record(self, result):
-        self.exponents.append(result.e)
+        self.exponents.record(result)
+        self.values.record(result)
+
+    def merge(self, other):
+        self.exponents.merge(other.exponents)
+        self.values.merge(other.values)
+        return self
+
+
+class ProfileAnalysis(object):
+    """FPCore profiler.
+    Records inclusive and exclusive time, call counts, and net allocated blocks
+    per node of the AST, per opcode, and per core, aggregated over every run
+    of the interpreters it is attached to.
+
+    This isn't tracked like the other analyses, as it needs to see each node
+    both before and after it is evaluated. Instead, attach() shadows the
+    interpreter's evaluate (and interpret) methods with timed wrappers on that instance,
+    and detach() removes them again, so an interpreter that isn't being profiled
+    goes through exactly the same dispatch as before.
+
+    Times are measured with time.perf_counter_ns, and the profiler's own
+    bookkeeping for a node's children is not counted against the node.
+    Allocated blocks come from sys.getallocatedblocks, so they are the net
+    number of blocks still alive when the node returns (and include anything
+    the garbage collector decided to free in the meantime).
+    """
+
+    def __init__(self, allocations=True):
+        self.allocations = allocations
+        self.node_map = {}
+        self.arg_map = {}
+        self.core_map = {}
+        self.stacks = {}
+        self._stack = []
+        self._attached = {}
+
+    def _node_record(self, e):
+        record = self.node_map.get(id(e))
+        if record is None:
+            core = None
+            for frame in reversed(self._stack):
+                if isinstance(frame[0], ProfileCoreRecord):
+                    core = frame[0]
+                    break
+            if (isinstance(e, ast.ValueExpr) and self._stack and self._stack[-1][0] is core
+                and e is not core.e and e is not core.pre):
+                # arguments bound by interpret are usually made fresh for every call,
+                # so they are tracked by core and type rather than by identity
+                key = (id(core), type(e))
+                record = self.arg_map.get(key)
+                if record is None:
+                    record = ProfileRecord(e, len(self.node_map) + len(self.arg_map), core, argument=True)
+                    self.arg_map[key] = record
+            else:
+                record = ProfileRecord(e, len(self.node_map) + len(self.arg_map), core)
+                self.node_map[id(e)] = record
+        return record
+
+    def _core_record(self, core):
+        cid = id(core)
+        record = self.core_map.get(cid)
+        if record is None:
+            record = ProfileCoreRecord(core, len(self.core_map))
+            self.core_map[cid] = record
+        return record
+
+    def _wrap(self, method, get_record):
+        stack = self._stack
+        stacks = self.stacks
+        clock = time.perf_counter_ns
+        if self.allocations:
+            blocks = sys.getallocatedblocks
+        else:
+            def blocks():
+                return 0
+
+        def profiled(x, *args, **kwargs):
+            record = get_record(x)
+            if stack:
+                path = stack[-1][1] + (record,)
+            else:
+                path = (record,)
+            # frame: record, path, time in children, blocks allocated in children
+            frame = [record, path, 0, 0]
+            stack.append(frame)
+            record.active += 1
+            b0 = blocks()
+            t0 = clock()
+            try:
+                return method(x, *args, **kwargs)
+            finally:
+                elapsed = clock() - t0
+                allocated = blocks() - b0
+                stack.pop()
+                record.active -= 1
+                exclusive = elapsed - frame[2]
+                record.calls += 1
+                record.exclusive += exclusive
+                record.allocated += allocated - frame[3]
+                # only count inclusive time for the outermost active call of a recursive node
+                if record.active == 0:
+                    record.inclusive += elapsed
+                    record.allocated_inclusive += allocated
+                stacks[path] = stacks.get(path, 0) + exclusive
+                if stack:
+                    parent = stack[-1]
+                    parent[2] += clock() - t0
+                    parent[3] += allocated
+
+        return profiled
+
+    def attach(self, interpreter):
+        """Start profiling interpreter. Returns self."""
+        if id(interpreter) in self._attached:
+            raise AnalysisError('already profiling {}'.format(repr(interpreter)))
+        shadowed = {}
+        for name in ('evaluate', 'interpret', 'interpret_pre'):
+            if name in vars(interpreter):
+                raise AnalysisError('{}.{} is already shadowed, is another profiler attached?'
+                                    .format(repr(interpreter), name))
+            method = getattr(interpreter, name, None)
+            if method is not None:
+                shadowed[name] = method
+
+        if 'evaluate' not in shadowed:
+            raise AnalysisError('{} has no evaluate method to profile'.format(repr(interpreter)))
+        interpreter.evaluate = self._wrap(shadowed['evaluate'], self._node_record)
+        for name in ('interpret', 'interpret_pre'):
+            if name in shadowed:
+                setattr(interpreter, name, self._wrap(shadowed[name], self._core_record))
+
+        self._attached[id(interpreter)] = (interpreter, list(shadowed))
+        return self
+
+    def detach(self, interpreter=None):
+        """Stop profiling interpreter, or every interpreter if none is given.
+        The records are kept.
+        """
+        if interpreter is None:
+            targets = list(self._attached.values())
+        else:
+            try:
+                targets = [self._attached[id(interpreter)]]
+            except KeyError:
+                raise AnalysisError('not profiling {}'.format(repr(interpreter))) from None
+        for interpreter, names in targets:
+            for name in names:
+                delattr(interpreter, name)
+            del self._attached[id(interpreter)]
+
+    def clear(self):
+        """Forget everything recorded so far."""
+        self.node_map = {}
+        self.arg_map = {}
+        self.core_map = {}
+        self.stacks.clear()
+
+    def records(self, core=None):
+        """Node records, from the most exclusive time to the least,
+        optionally only those belonging to the core record core.
+        """
+        records = itertools.chain(self.node_map.values(), self.arg_map.values())
+        if core is not None:
+            records = [record for record in records if record.core is core]
+        return sorted(records, key=lambda record: record.exclusive, reverse=True)
+
+    def opcodes(self):
+        """Records aggregated by opcode, from the most exclusive time to the least."""
+        ops = {}
+        for record in itertools.chain(self.node_map.values(), self.arg_map.values()):
+            op = ops.get(record.op)
+            if op is None:
+                op = ProfileOpRecord(record.op)
+                ops[record.op] = op
+            op.add(record)
+        return sorted(ops.values(), key=lambda op: op.exclusive, reverse=True)
+
+    def folded_stacks(self):
+        """Lines of folded stack text, as read by flamegraph.pl, inferno, speedscope, etc.
+        Each line is a path of frames from the outermost core down to a node,
+        followed by the exclusive time in nanoseconds spent at that path.
+        """
+        for path, ns in self.stacks.items():
+            if ns > 0:
+                yield ';'.join(record.label for record in path) + ' ' + str(ns)
+
+    def write_folded(self, fname):
+        with open(fname, 'wt') as f:
+            for line in self.folded_stacks():
+                print(line, file=f)
+
+    def report(self, limit=20):
+        header = '  {:>12s} {:>12s} {:>10s} {:>10s}  {:s}'.format('excl (ms)', 'incl (ms)', 'calls', 'blocks', '')
+
+        def row(record, name):
+            return '  {:12.3f} {:12.3f} {:10d} {:10d}  {:s}'.format(
+                record.exclusive / 1e6, record.inclusive / 1e6, record.calls, record.allocated, name)
+
+        s = 'Titanic profile:\n'
+        cores = sorted(self.core_map.values(), key=lambda core: core.inclusive, reverse=True)
+        groups = [(core, core.label) for core in cores]
+        if any(record.core is None for record in self.records()):
+            groups.append((None, 'top level'))
+        for core, name in groups:
+            records = [record for record in self.records() if record.core is core]
+            if core is not None:
+                s += '\ncore {:s}: {:d} runs, {:.3f} ms\n'.format(name, core.calls, core.inclusive / 1e6)
+            else:
+                s += '\n{:s}:\n'.format(name)
+            s += header + 'node\n'
+            for record in records[:limit]:
+                if isinstance(record.e, ast.ValueExpr):
+                    s += row(record, record.label) + '\n'
+                else:
+                    s += row(record, record.label + ' ' + str(record.e.depth_limit(2))) + '\n'
+            if len(records) > limit:
+                s += '  ... {:d} more nodes\n'.format(len(records) - limit)
+
+        s += '\nby opcode:\n'
+        s += header + 'op\n'
+        for op in self.opcodes():
+            s += row(op, op.op) + '\n'
+        return s
+
+
+class ProfileRecord(object):
+    """Profile record for a single node in the ast."""
+
+    def __init__(self, e, index, core, argument=False):
+        self.e = e
+        self.core = core
+        if argument:
+            self.op = e.name
+            self.label = 'argument {}'.format(e.name)
+        elif isinstance(e, ast.ValueExpr):
+            self.op = e.name
+            # there are lots of these, name them by value
+            self.label = '{} {}'.format(e.name, str(e.value))
+        else:
+            self.op = str(e.name)
+            self.label = '{}#{:d}'.format(self.op, index)
+        # semicolons separate frames in folded stacks
+        self.label = self.label.replace(';', ',')
+        self.calls = 0
+        self.active = 0
+        self.inclusive = 0
+        self.exclusive = 0
+        self.allocated = 0
+        self.allocated_inclusive = 0
+
+
+class ProfileCoreRecord(ProfileRecord):
+    """Profile record for runs of a whole core."""
+
+    def __init__(self, core, index):
+        super().__init__(core.e, index, None)
+        self.pre = core.pre
+        self.op = 'FPCore'
+        name = core.ident or core.name or 'core#{:d}'.format(index)
+        self.label = str(name).replace(';', ',')
+
+class ProfileOpRecord(object):
+    """Profile records summed over all the nodes for one opcode."""
+
+    def __init__(self, op):
+        self.op = op
+        self.nodes = 0
+        self.calls = 0
+        self.inclusive = 0
+        self.exclusive = 0
+        self.allocated = 0
+
+    def add(self, record):
+        self.nodes += 1
+        self.calls += record.calls
+        self.inclusive += record.inclusive
+        self.exclusive += record.exclusive
+        self.allocated += record.allocated
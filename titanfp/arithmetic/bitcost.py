@@ -0,0 +1,473 @@
+"""Static bitcost estimation for annotated FPCores.
+
+The estimator walks a core the same way the MPMF interpreter would,
+but only tracks the rounding context of each value, not the value itself.
+Integer values that control loops and indexing (sizes, coordinates,
+counters in (# ...) contexts) are tracked exactly when they are known,
+so straight-line code and loops with static trip counts produce an exact count
+of the bits_requested that analysis.BitcostAnalysis would report.
+Anything that depends on floating-point values (conditionals, data dependent loops)
+produces a lower and upper bound instead.
+"""
+
+import math
+import operator
+
+from ..titanic import utils, digital
+from ..fpbench import fpcast as ast
+from . import evalctx
+from . import interpreter
+from . import mpmf
+from ..titanic import ndarray
+
+
+class StaticCostError(utils.TitanicError):
+    """Unable to statically estimate the cost of an FPCore."""
+
+
+def exact_in_ctx(i, ctx):
+    """Check if the integer i can be represented exactly in ctx."""
+    if i == 0:
+        return True
+    a = abs(i)
+    if isinstance(ctx, evalctx.IEEECtx):
+        return a.bit_length() <= ctx.p and a.bit_length() - 1 <= ctx.emax
+    elif isinstance(ctx, evalctx.PositCtx):
+        scale = a.bit_length() - 1
+        sig_bits = (a >> ((a & -a).bit_length() - 1)).bit_length() - 1
+        regime_bits = (scale >> ctx.es) + 2
+        frac_bits = ctx.nbits - 1 - regime_bits - ctx.es
+        return regime_bits < ctx.nbits and sig_bits <= frac_bits
+    elif isinstance(ctx, evalctx.FixedCtx):
+        if ctx.scale > 0:
+            if a & ((1 << ctx.scale) - 1):
+                return False
+            a >>= ctx.scale
+        return a.bit_length() < ctx.nbits
+    else:
+        return False
+
+
+class StaticValue(object):
+    """Abstract value used by the estimator.
+    Records the range of bitcosts the value could have (lo and hi),
+    and the value itself if it is a known integer or boolean, or else None.
+    """
+
+    __slots__ = ('lo', 'hi', 'value')
+
+    def __init__(self, lo, hi=None, value=None):
+        self.lo = lo
+        if hi is None:
+            self.hi = lo
+        else:
+            self.hi = hi
+        self.value = value
+
+    def __repr__(self):
+        return '{}(lo={}, hi={}, value={})'.format(type(self).__name__, repr(self.lo), repr(self.hi), repr(self.value))
+
+    def is_integer(self):
+        if self.value is None:
+            raise StaticCostError('value is not statically known')
+        return True
+
+    def __int__(self):
+        if self.value is None:
+            raise StaticCostError('value is not statically known')
+        return int(self.value)
+
+    def __bool__(self):
+        if self.value is None:
+            raise StaticCostError('condition is not statically known')
+        return bool(self.value)
+
+    def maybe(self):
+        """The same value, but with no minimum cost,
+        for when it may or may not have been computed.
+        """
+        return type(self)(0, self.hi, self.value)
+
+
+def in_ctx(ctx, value=None):
+    """Abstract value rounded to ctx; the value is only kept if it is exact."""
+    if value is not None and not exact_in_ctx(value, ctx):
+        value = None
+    return StaticValue(ctx.nbits, value=value)
+
+def merge_values(a, b):
+    """Abstract value that could be either a or b."""
+    if isinstance(a, StaticValue) and isinstance(b, StaticValue):
+        if a.value == b.value:
+            value = a.value
+        else:
+            value = None
+        return StaticValue(min(a.lo, b.lo), max(a.hi, b.hi), value)
+    elif isinstance(a, ndarray.NDArray) and isinstance(b, ndarray.NDArray):
+        if a.shape != b.shape:
+            raise StaticCostError('tensor shape depends on a condition: {} or {}'.format(repr(a.shape), repr(b.shape)))
+        return ndarray.NDArray(shape=a.shape, data=[merge_values(x, y) for x, y in zip(a.data, b.data)])
+    else:
+        raise StaticCostError('cannot merge values {} and {}'.format(repr(a), repr(b)))
+
+# coordinates bound by tensor and for loops have the interpreter's default context
+_index_bits = mpmf.MPMF._ctx.nbits
+
+def index_value(i):
+    return StaticValue(_index_bits, value=int(i))
+
+
+class BitcostEstimator(interpreter.BaseInterpreter):
+    """Static estimator for BitcostAnalysis.bits_requested.
+
+    Use like an interpreter: register functions,
+    then call estimate(core, args) to get a pair (lo, hi) of bounds.
+    If the arguments are not known (i.e. they are represented by a placeholder)
+    then any control flow that depends on them cannot be determined.
+    A loop whose condition can't be determined is followed for at most
+    max_unknown_iterations iterations, after which its upper bound is math.inf.
+    """
+
+    dtype = staticmethod(index_value)
+    ctype = staticmethod(mpmf.mpmf_ctype)
+
+    # operations we can compute exactly on known integers
+    _known_ops = {
+        ast.Add: operator.add,
+        ast.Sub: operator.sub,
+        ast.Mul: operator.mul,
+        ast.Neg: operator.neg,
+        ast.Fabs: abs,
+        ast.Fmax: max,
+        ast.Fmin: min,
+        ast.Ceil: int,
+        ast.Floor: int,
+        ast.Nearbyint: int,
+        ast.Round: int,
+        ast.Trunc: int,
+    }
+
+    _known_comparisons = {
+        ast.LT: operator.lt,
+        ast.GT: operator.gt,
+        ast.LEQ: operator.le,
+        ast.GEQ: operator.ge,
+        ast.EQ: operator.eq,
+    }
+
+    def __init__(self, max_iterations=1 << 20, max_unknown_iterations=64):
+        super().__init__()
+        self.max_iterations = max_iterations
+        self.max_unknown_iterations = max_unknown_iterations
+        self.bits_lo = 0
+        self.bits_hi = 0
+        # the estimator is its own analysis,
+        # so that titanic-analysis skip annotations are handled by the base evaluator
+        self.analyses = [self]
+
+    def track(self, e, ctx, inputs, result):
+        # same accounting as BitcostAnalysis.bits_requested
+        if isinstance(e, ast.NaryExpr):
+            if isinstance(e, (ast.Dim, ast.Size, ast.UnknownOperator, ast.Ref, ast.Cast)):
+                pass
+            elif inputs:
+                for arg in inputs:
+                    if isinstance(arg, StaticValue):
+                        self.bits_lo += arg.lo
+                        self.bits_hi += arg.hi
+
+    def _fork(self, e, ctx):
+        """Evaluate e with a fresh count of bits.
+        Returns the bounds for that evaluation, and the result,
+        without changing the current count.
+        """
+        saved = self.bits_lo, self.bits_hi
+        self.bits_lo, self.bits_hi = 0, 0
+        try:
+            result = self.evaluate(e, ctx)
+            return self.bits_lo, self.bits_hi, result
+        finally:
+            self.bits_lo, self.bits_hi = saved
+
+    def _maybe_evaluate(self, e, ctx):
+        """Evaluate e, which may or may not be evaluated by the real interpreter."""
+        lo, hi, result = self._fork(e, ctx)
+        self.bits_hi += hi
+        if isinstance(result, StaticValue):
+            return result.maybe()
+        else:
+            return result
+
+    def arg_to_digital(self, x, ctx):
+        if isinstance(x, StaticValue):
+            return x
+        elif isinstance(x, bool):
+            return StaticValue(0, value=x)
+        elif isinstance(x, int):
+            return in_ctx(ctx, x)
+        elif isinstance(x, digital.Digital) and x.is_finite_real() and x.is_integer():
+            return in_ctx(ctx, int(x))
+        else:
+            return in_ctx(ctx)
+
+    def round_to_context(self, x, ctx):
+        if isinstance(x, StaticValue):
+            return in_ctx(ctx, x.value)
+        else:
+            return self.arg_to_digital(x, ctx)
+
+    # values
+
+    def _eval_constant(self, e, ctx):
+        try:
+            return None, StaticValue(0, value=self.constants[e.value])
+        except KeyError:
+            return None, in_ctx(ctx)
+
+    def _eval_integer(self, e, ctx):
+        return None, in_ctx(ctx, e.i)
+
+    def _eval_rational(self, e, ctx):
+        if e.p % e.q == 0:
+            return None, in_ctx(ctx, e.p // e.q)
+        else:
+            return None, in_ctx(ctx)
+
+    def _eval_digits(self, e, ctx):
+        if e.e >= 0:
+            return None, in_ctx(ctx, e.m * (e.b ** e.e))
+        else:
+            return None, in_ctx(ctx)
+
+    def _eval_ctx(self, e, ctx):
+        return None, self.evaluate(e.body, evalctx.determine_ctx(ctx, e.props))
+
+    # operations
+
+    def _eval_op(self, e, ctx):
+        inputs = [self.evaluate(child, ctx) for child in e.children]
+        value = None
+        fn = self._known_ops.get(type(e))
+        if fn is not None and all(isinstance(x, StaticValue) and x.value is not None for x in inputs):
+            value = fn(*(x.value for x in inputs))
+        elif isinstance(e, ast.Div) and all(isinstance(x, StaticValue) and x.value is not None for x in inputs):
+            p, q = (x.value for x in inputs)
+            if q != 0 and p % q == 0:
+                value = p // q
+        return inputs, in_ctx(ctx, value)
+
+    def _eval_cast(self, e, ctx):
+        in0 = self.evaluate(e.children[0], ctx)
+        return [in0], self.round_to_context(in0, ctx)
+
+    def _eval_predicate(self, e, ctx):
+        in0 = self.evaluate(e.children[0], ctx)
+        return [in0], StaticValue(0)
+
+    _eval_isfinite = _eval_predicate
+    _eval_isinf = _eval_predicate
+    _eval_isnan = _eval_predicate
+    _eval_isnormal = _eval_predicate
+    _eval_signbit = _eval_predicate
+
+    def _eval_comparison(self, e, ctx):
+        # Comparisons short-circuit, so if any intermediate comparison is not known,
+        # the remaining arguments may or may not be evaluated.
+        cmp = self._known_comparisons[type(e)]
+        if len(e.children) < 2:
+            return [], StaticValue(0, value=True)
+
+        inputs = []
+        known = True
+        a = self.evaluate(e.children[0], ctx)
+        inputs.append(a)
+        for child in e.children[1:]:
+            if known:
+                b = self.evaluate(child, ctx)
+            else:
+                b = self._maybe_evaluate(child, ctx)
+            inputs.append(b)
+            if a.value is not None and b.value is not None:
+                if not cmp(a.value, b.value):
+                    if known:
+                        return inputs, StaticValue(0, value=False)
+            else:
+                known = False
+            a = b
+
+        if known:
+            return inputs, StaticValue(0, value=True)
+        else:
+            return inputs, StaticValue(0)
+
+    _eval_lt = _eval_comparison
+    _eval_gt = _eval_comparison
+    _eval_leq = _eval_comparison
+    _eval_geq = _eval_comparison
+    _eval_eq = _eval_comparison
+
+    def _eval_neq(self, e, ctx):
+        inputs = [self.evaluate(child, ctx) for child in e.children[:2]]
+        inputs.extend(self._maybe_evaluate(child, ctx) for child in e.children[2:])
+        if all(x.value is not None for x in inputs):
+            values = [x.value for x in inputs]
+            return inputs, StaticValue(0, value=(len(set(values)) == len(values)))
+        else:
+            return inputs, StaticValue(0)
+
+    def _eval_logical(self, e, ctx, stop_on):
+        # and stops on the first False, or on the first True
+        known = True
+        for child in e.children:
+            if known:
+                x = self.evaluate(child, ctx)
+            else:
+                x = self._maybe_evaluate(child, ctx)
+            if x.value is None:
+                known = False
+            elif x.value == stop_on:
+                # whether or not we got here, the result is the same
+                return None, StaticValue(0, value=stop_on)
+        if known:
+            return None, StaticValue(0, value=(not stop_on))
+        else:
+            return None, StaticValue(0)
+
+    def _eval_and(self, e, ctx):
+        return self._eval_logical(e, ctx, False)
+
+    def _eval_or(self, e, ctx):
+        return self._eval_logical(e, ctx, True)
+
+    def _eval_not(self, e, ctx):
+        x = self.evaluate(e.children[0], ctx)
+        if x.value is None:
+            return None, StaticValue(0)
+        else:
+            return None, StaticValue(0, value=(not x.value))
+
+    # control flow
+
+    def _eval_if(self, e, ctx):
+        cond = self.evaluate(e.cond, ctx)
+        if cond.value is None:
+            then_lo, then_hi, then_result = self._fork(e.then_body, ctx)
+            else_lo, else_hi, else_result = self._fork(e.else_body, ctx)
+            self.bits_lo += min(then_lo, else_lo)
+            self.bits_hi += max(then_hi, else_hi)
+            return None, merge_values(then_result, else_result)
+        elif cond.value:
+            return None, self.evaluate(e.then_body, ctx)
+        else:
+            return None, self.evaluate(e.else_body, ctx)
+
+    def _loop(self, e, ctx, sequential):
+        if sequential:
+            for name, init_expr, update_expr in e.while_bindings:
+                ctx = ctx.let(bindings=[(name, self.evaluate(init_expr, ctx))])
+        else:
+            ctx = ctx.let(bindings=[(name, self.evaluate(init_expr, ctx))
+                                    for name, init_expr, update_expr in e.while_bindings])
+
+        # every place the loop might exit, as (lo, hi, result)
+        exits = []
+        iterations = 0
+        while True:
+            cond = self.evaluate(e.cond, ctx)
+            if cond.value is None:
+                lo, hi, result = self._fork(e.body, ctx)
+                exits.append((self.bits_lo + lo, self.bits_hi + hi, result))
+            elif not cond.value:
+                result = self.evaluate(e.body, ctx)
+                exits.append((self.bits_lo, self.bits_hi, result))
+                break
+
+            iterations += 1
+            if iterations > self.max_iterations:
+                if not exits:
+                    raise StaticCostError('loop does not terminate within {:d} iterations'.format(self.max_iterations))
+                exits.append((math.inf, math.inf, exits[-1][2]))
+                break
+            elif len(exits) > self.max_unknown_iterations:
+                # the loop could exit at any of the next iterations too, and every one costs
+                # at least as much as the ones so far, so give up on an upper bound
+                exits.append((math.inf, math.inf, exits[-1][2]))
+                break
+
+            if sequential:
+                for name, init_expr, update_expr in e.while_bindings:
+                    ctx = ctx.let(bindings=[(name, self.evaluate(update_expr, ctx))])
+            else:
+                ctx = ctx.let(bindings=[(name, self.evaluate(update_expr, ctx))
+                                        for name, init_expr, update_expr in e.while_bindings])
+
+        self.bits_lo = min(lo for lo, hi, result in exits)
+        self.bits_hi = max(hi for lo, hi, result in exits)
+        result = exits[0][2]
+        for lo, hi, other in exits[1:]:
+            result = merge_values(result, other)
+        return result
+
+    def _eval_while(self, e, ctx):
+        return None, self._loop(e, ctx, False)
+
+    def _eval_whilestar(self, e, ctx):
+        return None, self._loop(e, ctx, True)
+
+    # interpreter interface
+
+    def arg_ctx(self, core, args, ctx=None, override=True):
+        if len(core.inputs) != len(args):
+            raise ValueError('incorrect number of arguments: got {}, expecting {} ({})'.format(
+                len(args), len(core.inputs), ' '.join((name for name, props, shape in core.inputs))))
+
+        if ctx is None:
+            ctx = self.ctype(props=core.props)
+        elif override:
+            allprops = {}
+            allprops.update(core.props)
+            allprops.update(ctx.props)
+            ctx = evalctx.determine_ctx(ctx, allprops)
+        else:
+            ctx = evalctx.determine_ctx(ctx, core.props)
+
+        arg_bindings = []
+
+        for arg, (name, props, shape) in zip(args, core.inputs):
+            local_ctx = evalctx.determine_ctx(ctx, props)
+
+            if isinstance(arg, ast.Expr):
+                argval = self.evaluate(arg, local_ctx)
+            elif isinstance(arg, ndarray.NDArray):
+                argval = ndarray.NDArray(shape=arg.shape, data=[self.round_to_context(d, local_ctx) for d in arg.data])
+            elif isinstance(arg, list):
+                nd_unrounded = ndarray.NDArray(shape=None, data=arg)
+                argval = ndarray.NDArray(shape=nd_unrounded.shape,
+                                         data=[self.round_to_context(d, local_ctx) for d in nd_unrounded.data])
+            else:
+                argval = self.round_to_context(arg, local_ctx)
+
+            if isinstance(argval, ndarray.NDArray):
+                if not shape:
+                    raise interpreter.EvaluatorError('not expecting a tensor, got shape {}'.format(repr(argval.shape)))
+                if len(shape) != len(argval.shape):
+                    raise interpreter.EvaluatorError('tensor input has wrong shape: expecting {}, got {}'.format(repr(shape), repr(argval.shape)))
+                for dim, argdim in zip(shape, argval.shape):
+                    if isinstance(dim, int) and dim != argdim:
+                        raise interpreter.EvaluatorError('tensor input has wrong shape: expecting {}, got {}'.format(repr(shape), repr(argval.shape)))
+                    elif isinstance(dim, str):
+                        arg_bindings.append((dim, self.dtype(argdim)))
+
+            arg_bindings.append((name, argval))
+
+        return ctx.let(bindings=arg_bindings)
+
+    def estimate(self, core, args, ctx=None):
+        """Estimate bits_requested for interpreting core on args.
+        Returns a pair (lo, hi); if the cost is fully determined, lo == hi.
+        hi may be math.inf if a loop has no static bound.
+        """
+        self.bits_lo = 0
+        self.bits_hi = 0
+        self.interpret(core, args, ctx=ctx)
+        return self.bits_lo, self.bits_hi
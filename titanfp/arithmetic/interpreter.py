@@ -177,25 +177,27 @@ class Evaluator(object):
         self.enable_analysis = True
         self.analyses = []
 
+    def _dispatch(self, e):
+        """Find the method to evaluate expressions of the same type as e, and cache it."""
+        # initialize the cache for this class if it hasn't been initialized already
+        if isinstance(self._evaluator_cache, utils.ImmutableDict):
+            self._evaluator_cache = {}
+        # walk up the mro and assign the evaluator for the first subtype to this type
+        ecls = type(e)
+        for superclass in ecls.__mro__:
+            method_name = self._evaluator_dispatch.get(superclass, None)
+            if method_name is not None and hasattr(self, method_name):
+                method = getattr(self, method_name)
+                self._evaluator_cache[ecls] = method
+                return method
+        raise EvaluatorError('Evaluator: unable to dispatch for expression {} with mro {}'
+                             .format(repr(e), repr(ecls.__mro__)))
+
     def evaluate(self, e, ctx):
         try:
             method = self._evaluator_cache[type(e)]
         except KeyError:
-            # initialize the cache for this class if it hasn't been initialized already
-            if isinstance(self._evaluator_cache, utils.ImmutableDict):
-                self._evaluator_cache = {}
-            # walk up the mro and assign the evaluator for the first subtype to this type
-            method = None
-            ecls = type(e)
-            for superclass in ecls.__mro__:
-                method_name = self._evaluator_dispatch.get(superclass, None)
-                if method_name is not None and hasattr(self, method_name):
-                    method = getattr(self, method_name)
-                    self._evaluator_cache[ecls] = method
-                    break
-            if method is None:
-                raise EvaluatorError('Evaluator: unable to dispatch for expression {} with mro {}'
-                                     .format(repr(e), repr(ecls.__mro__)))
+            method = self._dispatch(e)
 
         inputs, result = method(e, ctx)
 
@@ -454,6 +456,33 @@ class BaseInterpreter(Evaluator):
 
     # interpreter interface
 
+    def round_tensor_data(self, data, ctx):
+        """Round the elements of a tensor argument to ctx.
+        Big tensors (like images) repeat the same numbers over and over,
+        so each distinct int, float, or string is only converted once.
+        """
+        converted = {}
+        rounded_data = []
+        for d in data:
+            if type(d) is float:
+                # keep -0.0 apart from 0.0
+                key = d.hex()
+            elif type(d) is int or type(d) is str:
+                key = (type(d), d)
+            else:
+                key = None
+
+            if key is None:
+                x = None
+            else:
+                x = converted.get(key)
+            if x is None:
+                x = self.arg_to_digital(d, ctx)
+                if key is not None:
+                    converted[key] = x
+            rounded_data.append(x)
+        return rounded_data
+
     def arg_ctx(self, core, args, ctx=None, override=True):
         if len(core.inputs) != len(args):
             raise ValueError('incorrect number of arguments: got {}, expecting {} ({})'.format(
@@ -479,17 +508,11 @@ class BaseInterpreter(Evaluator):
             elif isinstance(arg, ast.Expr):
                 argval = self.evaluate(arg, local_ctx)
             elif isinstance(arg, ndarray.NDArray):
-                rounded_data = [
-                    self.round_to_context(d, ctx=local_ctx) if isinstance(arg, self.dtype) else self.arg_to_digital(d, local_ctx)
-                    for d in arg.data
-                ]
+                rounded_data = self.round_tensor_data(arg.data, local_ctx)
                 argval = ndarray.NDArray(shape=arg.shape, data=rounded_data)
             elif isinstance(arg, list):
                 nd_unrounded = ndarray.NDArray(shape=None, data=arg)
-                rounded_data = [
-                    self.round_to_context(d, ctx=local_ctx) if isinstance(arg, self.dtype) else self.arg_to_digital(d, local_ctx)
-                    for d in nd_unrounded.data
-                ]
+                rounded_data = self.round_tensor_data(nd_unrounded.data, local_ctx)
                 argval = ndarray.NDArray(shape=nd_unrounded.shape, data=rounded_data)
             else:
                 argval = self.arg_to_digital(arg, local_ctx)
@@ -193,17 +193,11 @@ class Interpreter(interpreter.StandardInterpreter):
             elif isinstance(arg, ast.Expr):
                 argval = self.evaluate(arg, local_ctx)
             elif isinstance(arg, ndarray.NDArray):
-                rounded_data = [
-                    self.round_to_context(d, ctx=local_ctx) if isinstance(arg, self.dtype) else self.arg_to_digital(d, local_ctx)
-                    for d in arg.data
-                ]
+                rounded_data = self.round_tensor_data(arg.data, local_ctx)
                 argval = ndarray.NDArray(shape=arg.shape, data=rounded_data)
             elif isinstance(arg, list):
                 nd_unrounded = ndarray.NDArray(shape=None, data=arg)
-                rounded_data = [
-                    self.round_to_context(d, ctx=local_ctx) if isinstance(arg, self.dtype) else self.arg_to_digital(d, local_ctx)
-                    for d in nd_unrounded.data
-                ]
+                rounded_data = self.round_tensor_data(nd_unrounded.data, local_ctx)
                 argval = ndarray.NDArray(shape=nd_unrounded.shape, data=rounded_data)
             else:
                 argval = self.arg_to_digital(arg, local_ctx)
@@ -0,0 +1,169 @@
+"""Correctly rounded arithmetic on NumPy float64 arrays, for Titanic contexts.
+
+Every value in a context with at most 53 bits of precision (and a modest exponent range)
+is exactly representable as a float64. Each operation here computes the float64 result
+along with the sign of its rounding error (with the usual error-free transformations),
+which is exactly enough information to round the true result once to the target context.
+The results are the same, bit for bit, as the MPMF interpreter,
+which computes each operation with MPFR and rounds it with Float._round_to_context
+or Posit._round_to_context.
+
+Only round-to-nearest-even IEEE 754 contexts and posit contexts are supported.
+If some value can't be handled (it is too large or small for the error-free
+transformations to be exact, or it is a posit that would need its exponent rounded),
+VectorRoundingError is raised, and the caller should fall back to the interpreter.
+"""
+
+import numpy as np
+
+from ..titanic import utils
+from ..titanic.ops import RM
+from . import evalctx
+
+
+class VectorRoundingError(utils.TitanicError):
+    """Unable to round some values correctly with float64 arithmetic."""
+
+
+# keep well away from the float64 overflow and underflow thresholds,
+# so that products and their errors are always exact
+_max_magnitude = 2.0 ** 480
+_min_magnitude = 2.0 ** -480
+
+# Dekker's splitting constant for float64, 2**27 + 1
+_splitter = 134217729.0
+
+
+def supported(ctx):
+    """Check if values in ctx can be computed with this module."""
+    if isinstance(ctx, evalctx.IEEECtx):
+        return ctx.rm == RM.RNE and ctx.p <= 53 and ctx.emax < 480 and ctx.n > -480
+    elif isinstance(ctx, evalctx.PositCtx):
+        return ctx.p <= 53 and ctx.emax < 480
+    else:
+        return False
+
+def _check_range(*arrays):
+    for a in arrays:
+        mag = np.abs(a[np.isfinite(a) & (a != 0)])
+        if mag.size > 0 and (mag.max() >= _max_magnitude or mag.min() <= _min_magnitude):
+            raise VectorRoundingError('values are out of range for exact float64 error terms')
+
+def _posit_sbits(e, ctx):
+    regime = np.floor_divide(e, ctx.u)
+    rbits = np.where(regime < 0, 1 - regime, regime + 2)
+    return ctx.nbits - 1 - rbits - ctx.es
+
+
+def round_to_ctx(hi, lo, ctx):
+    """Round the exact values hi + lo to ctx, elementwise.
+    hi should be the float64 rounding of the exact value, and only the sign of lo is used:
+    it says which side of hi the exact value is on (or 0 if hi is exact).
+    """
+    hi = np.asarray(hi, dtype=np.float64)
+    lo = np.asarray(lo, dtype=np.float64)
+    is_posit = isinstance(ctx, evalctx.PositCtx)
+    if not supported(ctx):
+        raise VectorRoundingError(f'unsupported context {ctx!r}')
+
+    if np.any((hi == 0) & (lo != 0)):
+        raise VectorRoundingError('exact result underflowed')
+
+    result = hi.copy()
+    if is_posit:
+        # all non-real values go to NaR
+        result[~np.isfinite(hi)] = np.nan
+
+    nz = np.isfinite(hi) & (hi != 0)
+    h = hi[nz]
+    if h.size == 0:
+        return result
+
+    a = np.abs(h)
+    # +1 if the exact magnitude is above a, -1 if below
+    side = np.sign(lo[nz]) * np.sign(h)
+
+    m, e = np.frexp(a)
+    e = e.astype(np.int64) - 1
+    # a power of two with the exact value just under it is really in the binade below
+    e -= ((m == 0.5) & (side < 0))
+
+    if is_posit:
+        sbits = _posit_sbits(e, ctx)
+        if np.any(sbits < 1):
+            raise VectorRoundingError('posit exponent would need to be rounded')
+        qexp = e - sbits
+    else:
+        qexp = np.maximum(e - ctx.p + 1, ctx.n + 1)
+
+    r = np.ldexp(a, -qexp)
+    f = np.floor(r)
+    frac = r - f
+    # ties go to even, but like utils.is_even_for_rounding,
+    # a significand with fewer than two bits is even if its exponent is
+    odd = np.where(f < 2, (qexp & 1) == 1, np.fmod(f, 2) == 1)
+    up = (frac > 0.5) | ((frac == 0.5) & ((side > 0) | ((side == 0) & odd)))
+    mag = np.ldexp(f + up, qexp)
+
+    if is_posit:
+        _, e2 = np.frexp(mag)
+        if np.any(_posit_sbits(e2.astype(np.int64) - 1, ctx) < 1):
+            raise VectorRoundingError('posit exponent would need to be rounded')
+    else:
+        mag[mag >= 2.0 ** (ctx.emax + 1)] = np.inf
+
+    result[nz] = np.copysign(mag, h)
+    return result
+
+
+# error-free transformations
+
+def two_sum(a, b):
+    s = a + b
+    bb = s - a
+    err = (a - (s - bb)) + (b - bb)
+    return s, err
+
+def _split(a):
+    t = _splitter * a
+    hi = t - (t - a)
+    return hi, a - hi
+
+def two_prod(a, b):
+    p = a * b
+    ah, al = _split(a)
+    bh, bl = _split(b)
+    err = ((ah * bh - p) + ah * bl + al * bh) + al * bl
+    return p, err
+
+
+# operations; the inputs should already be values in some supported context
+
+def add(a, b, ctx):
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    _check_range(a, b)
+    with np.errstate(all='ignore'):
+        s, err = two_sum(a, b)
+    return round_to_ctx(s, np.where(np.isfinite(err), err, 0.0), ctx)
+
+def sub(a, b, ctx):
+    return add(a, -np.asarray(b, dtype=np.float64), ctx)
+
+def mul(a, b, ctx):
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    _check_range(a, b)
+    with np.errstate(all='ignore'):
+        p, err = two_prod(a, b)
+    return round_to_ctx(p, np.where(np.isfinite(err), err, 0.0), ctx)
+
+def div(a, b, ctx):
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    _check_range(a, b)
+    with np.errstate(all='ignore'):
+        q = a / b
+        _check_range(q)
+        # the remainder a - q*b is exactly representable, and so is this computation of it
+        p, err = two_prod(q, b)
+        r = (a - p) - err
+        side = np.sign(r) * np.sign(b)
+    return round_to_ctx(q, np.where(np.isfinite(side), side, 0.0), ctx)
@@ -0,0 +1,389 @@
+"""Shadow execution: evaluate in a working context and a reference context at once.
+
+The usual way to measure the error of a core is to run it twice, once in the
+context of interest and once in some very high precision context, and compare
+the results. The ShadowInterpreter does both in one traversal: every operation
+computes its result in the working context as normal, and also a shadow result
+in a reference context, from the shadow results of its inputs.
+
+Control flow follows the working results. When a condition would have gone the other way
+with the shadow values, the node is counted as diverged, and the shadows carry on
+down the working path (so after a divergence they are no longer really
+the reference answer).
+
+Each node gets a ShadowRecord with the bits of agreement (gmpmath.geo_sim) between its
+working and shadow results, and, like the local error in Herbie, between the
+shadow result and the result of doing just this one operation in the working context
+on the correctly rounded shadow inputs. So nodes that are inaccurate themselves
+can be told apart from nodes that are only passing on error from their inputs.
+
+Shadow values are attached to the working values, as an extra attribute,
+so that they follow bindings, tensors, and function calls for free.
+"""
+
+import math
+
+from ..titanic import gmpmath
+from ..titanic import digital
+from ..titanic import ndarray
+from ..fpbench import fpcast as ast
+
+from . import evalctx
+from . import mpnum
+from . import mpmf
+from . import analysis
+
+
+def shadow_of(x):
+    """The shadow of a working value, or the value itself if it doesn't have one."""
+    return getattr(x, '_shadow', x)
+
+
+def agreement(shadow, x):
+    """Bits of agreement between a shadow value and a working value."""
+    if not (isinstance(shadow, digital.Digital) and isinstance(x, digital.Digital)):
+        return math.nan
+    if shadow.isnan and x.isnan:
+        return math.inf
+    if shadow.isinf or x.isinf:
+        if shadow.isinf and x.isinf and shadow.negative == x.negative:
+            return math.inf
+        else:
+            return -math.inf
+    if shadow == x:
+        return math.inf
+    return gmpmath.geo_sim(shadow, x)
+
+
+# nodes that don't compute anything themselves:
+# their results are (or contain) values that already have shadows
+passthrough_exprs = (
+    ast.Var,
+    ast.UnknownOperator,
+    ast.Array,
+    ast.Dim,
+    ast.Size,
+    ast.Ref,
+    ast.Ctx,
+    ast.ControlExpr,
+)
+
+
+class ShadowRecord(object):
+    """Shadow execution record for a single node in the ast."""
+
+    def __init__(self, e):
+        self.e = e
+        self.evals = 0
+        self.bits = BitsSummary()
+        self.local_bits = BitsSummary()
+        self.divergences = 0
+
+    def merge(self, other):
+        self.evals += other.evals
+        self.bits.merge(other.bits)
+        self.local_bits.merge(other.local_bits)
+        self.divergences += other.divergences
+        return self
+
+class BitsSummary(object):
+    """Streaming summary of bits of agreement: exact matches, total failures
+    (different signs or classes, reported as -inf), and the mean and worst of the rest.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.exact = 0
+        self.failed = 0
+        self.nans = 0
+        self.total = 0.0
+        self.worst = math.inf
+
+    def record(self, bits):
+        self.count += 1
+        if math.isnan(bits):
+            self.nans += 1
+        elif bits == math.inf:
+            self.exact += 1
+        elif bits == -math.inf:
+            self.failed += 1
+            self.worst = bits
+        else:
+            self.total += bits
+            if bits < self.worst:
+                self.worst = bits
+
+    @property
+    def mean(self):
+        n = self.count - self.exact - self.failed - self.nans
+        if n > 0:
+            return self.total / n
+        else:
+            return math.nan
+
+    def merge(self, other):
+        self.count += other.count
+        self.exact += other.exact
+        self.failed += other.failed
+        self.nans += other.nans
+        self.total += other.total
+        self.worst = min(self.worst, other.worst)
+        return self
+
+
+class _Replay(mpmf.Interpreter):
+    """Re-runs the evaluation method for a single node on given values for its children,
+    by handing them out one at a time whenever it asks to evaluate a child.
+    """
+
+    class Exhausted(Exception):
+        """The method asked for more children than the working evaluation did."""
+
+    def __init__(self, constants):
+        super().__init__()
+        self.constants = constants
+        self.values = iter(())
+
+    def evaluate(self, e, ctx):
+        try:
+            return next(self.values)
+        except StopIteration:
+            raise self.Exhausted() from None
+
+    def replay(self, method, e, ctx, values):
+        self.values = iter(values)
+        return method.__func__(self, e, ctx)[1]
+
+
+class ShadowInterpreter(mpmf.Interpreter):
+    """MPMF interpreter that shadows every operation in ref_ctx.
+
+    After interpret(), the result has its shadow attached (see shadow_of),
+    last_bits is the agreement between them, and node_map has a ShadowRecord
+    for each node that was evaluated. With local_error=False,
+    the extra per-operation evaluation for local error is skipped,
+    and with node_error=False, no records are kept at all
+    (only the error of the final result is measured).
+    """
+
+    def __init__(self, ref_ctx=None, local_error=True, node_error=True):
+        super().__init__()
+        if ref_ctx is None:
+            ref_ctx = evalctx.IEEECtx(es=20, nbits=532)
+        self.ref_ctx = ref_ctx
+        self.local_error = local_error and node_error
+        self.node_error = node_error
+        self.node_map = {}
+        self.divergences = 0
+        self.last_bits = math.nan
+        self._last_shadow = None
+        self._replay = _Replay(self.constants)
+
+    def _record(self, e):
+        eid = id(e)
+        record = self.node_map.get(eid)
+        if record is None:
+            record = ShadowRecord(e)
+            self.node_map[eid] = record
+        return record
+
+    def _dispatch(self, e):
+        method = super()._dispatch(e)
+        ecls = type(e)
+
+        if issubclass(ecls, passthrough_exprs) or ecls is ast.ValueExpr:
+            def shadowed(e, ctx):
+                inputs, result = method(e, ctx)
+                self._last_shadow = shadow_of(result)
+                return inputs, result
+
+        elif issubclass(ecls, ast.ValueExpr):
+            # constants and literals are just computed again in the reference context
+            def shadowed(e, ctx):
+                inputs, result = method(e, ctx)
+                shadow = method(e, self.ref_ctx)[1]
+                return inputs, self._attach(e, ctx, result, shadow, None)
+
+        elif issubclass(ecls, (ast.And, ast.Or, ast.Not)):
+            shadowed = method
+
+        else:
+            def shadowed(e, ctx):
+                inputs, result = method(e, ctx)
+                if inputs is None:
+                    self._last_shadow = shadow_of(result)
+                    return inputs, result
+                shadow_inputs = [shadow_of(x) for x in inputs]
+                try:
+                    shadow = self._replay.replay(method, e, self.ref_ctx, shadow_inputs)
+                except _Replay.Exhausted:
+                    shadow = result
+                local = None
+                if self.local_error and isinstance(result, digital.Digital):
+                    rounded_inputs = [self.round_to_context(x, ctx) if isinstance(x, digital.Digital) else x
+                                      for x in shadow_inputs]
+                    try:
+                        local = self._replay.replay(method, e, ctx, rounded_inputs)
+                    except _Replay.Exhausted:
+                        local = None
+                return inputs, self._attach(e, ctx, result, shadow, local)
+
+        self._evaluator_cache[ecls] = shadowed
+        return shadowed
+
+    def _attach(self, e, ctx, result, shadow, local):
+        self._last_shadow = shadow
+        if isinstance(result, mpnum.MPNum):
+            if hasattr(result, '_shadow'):
+                # the operation handed back one of its inputs (or a shared constant),
+                # which might already have a different shadow
+                result = type(result)(result, ctx=result.ctx)
+            result._shadow = shadow
+            if self.node_error and str(ctx.props.get('titanic-analysis')) != 'skip':
+                record = self._record(e)
+                record.evals += 1
+                record.bits.record(agreement(shadow, result))
+                if local is not None:
+                    record.local_bits.record(agreement(shadow, local))
+        return result
+
+    def _diverged(self, e, working, shadow):
+        if bool(working) != bool(shadow):
+            self.divergences += 1
+            self._record(e).divergences += 1
+
+    # bindings
+
+    def arg_ctx(self, core, args, ctx=None, override=True):
+        ctx = super().arg_ctx(core, args, ctx=ctx, override=override)
+        # arguments given as exact values get shadows of their own,
+        # rather than inheriting the rounding of the working context
+        for arg, (name, props, shape) in zip(args, core.inputs):
+            argval = ctx.bindings[name]
+            if isinstance(argval, ndarray.NDArray):
+                if isinstance(arg, ndarray.NDArray):
+                    arg_data = arg.data
+                elif isinstance(arg, list):
+                    arg_data = ndarray.NDArray(shape=None, data=arg).data
+                else:
+                    continue
+                for x, a in zip(argval.data, arg_data):
+                    self._attach_arg(x, a)
+            else:
+                self._attach_arg(argval, arg)
+        return ctx
+
+    def _attach_arg(self, x, arg):
+        if not isinstance(x, mpnum.MPNum) or hasattr(x, '_shadow') or isinstance(arg, ast.Expr):
+            return
+        if isinstance(arg, digital.Digital):
+            x._shadow = self.round_to_context(shadow_of(arg), self.ref_ctx)
+        else:
+            x._shadow = self.arg_to_digital(arg, self.ref_ctx)
+
+    # control flow follows the working values, but notes where the shadows disagree
+
+    def _eval_if(self, e, ctx):
+        cond = self.evaluate(e.cond, ctx)
+        self._diverged(e, cond, self._last_shadow)
+        if cond:
+            result = self.evaluate(e.then_body, ctx)
+        else:
+            result = self.evaluate(e.else_body, ctx)
+        return None, result
+
+    def _eval_while(self, e, ctx):
+        bindings = [(name, self.evaluate(init_expr, ctx)) for name, init_expr, update_expr in e.while_bindings]
+        ctx = ctx.let(bindings=bindings)
+        while self._eval_cond(e, ctx):
+            bindings = [(name, self.evaluate(update_expr, ctx)) for name, init_expr, update_expr in e.while_bindings]
+            ctx = ctx.let(bindings=bindings)
+        return None, self.evaluate(e.body, ctx)
+
+    def _eval_whilestar(self, e, ctx):
+        for name, init_expr, update_expr in e.while_bindings:
+            new_binding = (name, self.evaluate(init_expr, ctx))
+            ctx = ctx.let(bindings=[new_binding])
+        while self._eval_cond(e, ctx):
+            for name, init_expr, update_expr in e.while_bindings:
+                new_binding = (name, self.evaluate(update_expr, ctx))
+                ctx = ctx.let(bindings=[new_binding])
+        return None, self.evaluate(e.body, ctx)
+
+    def _eval_cond(self, e, ctx):
+        cond = self.evaluate(e.cond, ctx)
+        self._diverged(e, cond, self._last_shadow)
+        return cond
+
+    def _eval_and(self, e, ctx):
+        result = True
+        shadow = True
+        for child in e.children:
+            if not self.evaluate(child, ctx):
+                result = False
+            shadow = shadow and bool(self._last_shadow)
+            if not result:
+                break
+        self._last_shadow = shadow
+        return None, result
+
+    def _eval_or(self, e, ctx):
+        result = False
+        shadow = False
+        for child in e.children:
+            if self.evaluate(child, ctx):
+                result = True
+            shadow = shadow or bool(self._last_shadow)
+            if result:
+                break
+        self._last_shadow = shadow
+        return None, result
+
+    def _eval_not(self, e, ctx):
+        result = not self.evaluate(e.children[0], ctx)
+        self._last_shadow = not self._last_shadow
+        return None, result
+
+    # interpreter interface
+
+    def interpret(self, core, args, ctx=None, override=True):
+        result = super().interpret(core, args, ctx=ctx, override=override)
+        self.last_bits = agreement(shadow_of(result), result)
+        return result
+
+    def interpret_shadow(self, core, args, ctx=None, override=True):
+        """Interpret core, and return the working result, its shadow, and the bits of agreement."""
+        result = self.interpret(core, args, ctx=ctx, override=override)
+        return result, shadow_of(result), self.last_bits
+
+    def merge(self, other):
+        """Add the records from another ShadowInterpreter (say, from another process) to this one."""
+        analysis.merge_node_maps(self.node_map, other.node_map, lambda record, other_record: record.merge(other_record))
+        self.divergences += other.divergences
+        return self
+
+    def records(self):
+        """Records for the nodes, those that diverged first, then from the worst local error to the best."""
+        def key(record):
+            worst = record.local_bits.worst if record.local_bits.count > 0 else record.bits.worst
+            return -record.divergences, worst
+        return sorted(self.node_map.values(), key=key)
+
+    def report(self, limit=20):
+        s = 'Titanic shadow execution against {}:\n'.format(self.ref_ctx.propstr())
+        s += '  final result: {} bits of agreement\n'.format(self.last_bits)
+        s += '  {:d} control flow divergences\n'.format(self.divergences)
+        s += '  {:>10s} {:>10s} {:>10s} {:>10s} {:>8s} {:>6s}  {:s}\n'.format(
+            'evals', 'worst', 'mean', 'local', 'exact', 'div', 'node')
+        records = self.records()
+        for record in records[:limit]:
+            if record.local_bits.count > 0:
+                local = '{:10.2f}'.format(record.local_bits.worst)
+            else:
+                local = '{:>10s}'.format('-')
+            s += '  {:10d} {:10.2f} {:10.2f} {} {:8d} {:6d}  {}\n'.format(
+                record.evals, record.bits.worst, record.bits.mean, local,
+                record.bits.exact, record.divergences, str(record.e.depth_limit(3)))
+        if len(records) > limit:
+            s += '  ... {:d} more nodes\n'.format(len(records) - limit)
+        return s
@@ -0,0 +1,393 @@
+"""Tiled evaluation of image kernels, with bounded memory.
+
+Interpreting an FPCore over a whole image needs the image as an NDArray of
+number objects, which takes tens of times more memory than the pixels,
+and another one just as big for the output. For stencil kernels,
+where each output pixel only depends on a fixed neighborhood of input pixels,
+the image can be cut into tiles instead: each tile is read from a (memory-mapped)
+input array along with a halo of surrounding pixels, evaluated on its own,
+and the interior of the result is written to a memory-mapped output array.
+Only a few tiles are ever in memory at once, no matter how big the image is.
+
+stencil_halo finds the halo a core needs by looking at how it indexes the image,
+which must be by the output coordinates plus bounded offsets, like (ref img (+ y dy) (+ x dx) c).
+The kernel must also not otherwise depend on the absolute position of the pixel
+or the size of the image, since each tile only knows its own, apart from checking
+whether an index is in bounds (a tile's halo stops at the edge of the image, so as long as
+it reaches as far as the check looks, those come out the same as for the whole image).
+stencil_halo raises TilingError for kernels that use them any other way.
+"""
+
+import os
+import multiprocessing
+
+import numpy as np
+
+from ..fpbench import fpcast as ast
+from ..titanic import utils, ndarray
+
+
+class TilingError(utils.TitanicError):
+    """Unable to evaluate a core tile by tile."""
+
+
+# abstract values for finding the stencil:
+#   ('coord', k, lo, hi) is output coordinate k (the image's dimension k) plus an offset in [lo, hi]
+#   ('size', k, lo, hi) is the size of the image's dimension k plus an offset in [lo, hi]
+#   ('int', lo, hi) is an integer in [lo, hi]
+#   ('pos',) is anything else that depends on where the pixel is, or how big the image is
+#   None is anything else
+# Each tile has its own coordinates and sizes, so positional values can only be used
+# to index the image, or to check whether an index is in bounds.
+
+_pos = ('pos',)
+
+def _positional(a):
+    return a is not None and a[0] != 'int'
+
+def _add(a, b, sign=1):
+    if a is None or b is None:
+        return _pos if _positional(a) or _positional(b) else None
+    if sign < 0:
+        if b[0] != 'int':
+            if a[0] == b[0] and a[0] in ('coord', 'size') and a[1] == b[1]:
+                return ('int', a[2] - b[3], a[3] - b[2])
+            return _pos
+        b = ('int', -b[2], -b[1])
+    if a[0] == 'int' and b[0] == 'int':
+        return ('int', a[1] + b[1], a[2] + b[2])
+    elif a[0] in ('coord', 'size') and b[0] == 'int':
+        return (a[0], a[1], a[2] + b[1], a[3] + b[2])
+    elif a[0] == 'int' and b[0] in ('coord', 'size'):
+        return (b[0], b[1], b[2] + a[1], b[3] + a[2])
+    else:
+        return _pos
+
+def _join(a, b):
+    if a is None or b is None or a[0] != b[0]:
+        return _pos if _positional(a) or _positional(b) else None
+    if a[0] == 'int':
+        return ('int', min(a[1], b[1]), max(a[2], b[2]))
+    elif a[0] in ('coord', 'size') and a[1] == b[1]:
+        return (a[0], a[1], min(a[2], b[2]), max(a[3], b[3]))
+    else:
+        return _pos
+
+_flipped = {ast.LT: ast.GT, ast.GT: ast.LT, ast.LEQ: ast.GEQ, ast.GEQ: ast.LEQ, ast.EQ: ast.EQ, ast.NEQ: ast.NEQ}
+
+
+class _StencilFinder(object):
+
+    # passes over a loop before giving up on its variables settling down
+    loop_passes = 8
+
+    def __init__(self, img_name, dim_names):
+        self.img_name = img_name
+        self.dim_names = dim_names
+        self.offsets = [None] * len(dim_names)
+
+    def extend(self, k, lo, hi):
+        if self.offsets[k] is None:
+            self.offsets[k] = (lo, hi)
+        else:
+            self.offsets[k] = (min(lo, self.offsets[k][0]), max(hi, self.offsets[k][1]))
+
+    def use(self, v, e):
+        """v is the value of e, which is used for something other than an index."""
+        if _positional(v):
+            raise TilingError(f'cannot find a stencil: {e!s} depends on the position of the pixel or the size of the image')
+
+    def record_ref(self, e, vals):
+        for k, (idx, v) in enumerate(zip(e.children[1:], vals)):
+            if v is None or v[0] != 'coord' or v[1] != k:
+                raise TilingError(f'cannot find a stencil for {e!s}: index {idx!s} is not the output coordinate plus an offset')
+            self.extend(k, v[2], v[3])
+
+    def compare(self, e, vals):
+        """Comparisons of an output coordinate with a constant or with the size of the image
+        are bounds checks. They come out the same in a tile as for the whole image if the halo
+        reaches as far as the offset they check, so that is recorded like an index.
+        """
+        for a, b in zip(vals, vals[1:]):
+            op = type(e)
+            if not (_positional(a) or _positional(b)):
+                continue
+            if b is not None and b[0] == 'coord' and (a is None or a[0] != 'coord'):
+                a, b, op = b, a, _flipped[op]
+            if a is not None and b is not None and a[0] in ('coord', 'size') and b[0] in ('coord', 'size', 'int'):
+                k, lo, hi = a[1:]
+                if b[0] == a[0] and b[1] == k:
+                    # the difference between two coordinates (or sizes) is the same everywhere
+                    continue
+                elif a[0] == 'coord' and b[0] == 'int':
+                    # a lower bound check, coord + lo >= c, which is only true near the top of the image
+                    margin = 0 if op in (ast.GEQ, ast.LT) else 1
+                    self.extend(k, lo - b[2] - margin, 0)
+                    continue
+                elif a[0] == 'coord' and b[0] == 'size' and b[1] == k:
+                    # an upper bound check, coord + hi < size, which is only false near the bottom
+                    margin = 1 if op in (ast.LEQ, ast.GT) else 0
+                    self.extend(k, 0, hi - b[2] - margin)
+                    continue
+            raise TilingError(f'cannot find a stencil: {e!s} compares the position of the pixel with something other than the edge of the image')
+
+    def loop(self, bindings, env, sequential):
+        """Walk the updates of a loop, and return the environment for its body.
+        After each pass, a variable could have its initial or its updated value,
+        so the two are joined; a stencil offset like y* = y + dy survives this only
+        in a sequential loop, where it is updated before it is used.
+        Variables that don't settle down in loop_passes passes become unknown.
+        """
+        inits = {name: self.walk(init, env) for name, init, update in bindings}
+        state = dict(env)
+        state.update(inits)
+        for i in range(self.loop_passes + 1):
+            new_state = dict(state)
+            for name, init, update in bindings:
+                new_state[name] = self.walk(update, new_state if sequential else state)
+            for name in inits:
+                new_state[name] = _join(inits[name], new_state[name])
+            if new_state == state:
+                break
+            elif i == self.loop_passes - 1:
+                for name in inits:
+                    if new_state[name] != state[name]:
+                        new_state[name] = _pos if _positional(new_state[name]) else None
+            state = new_state
+        return state
+
+    def walk(self, e, env):
+        """Walk an expression, recording image references, and return its abstract value."""
+        if isinstance(e, ast.Var):
+            if e.value == self.img_name:
+                raise TilingError(f'image {self.img_name} is used as a whole, not just indexed')
+            return env.get(e.value)
+        elif isinstance(e, ast.Integer):
+            return ('int', e.i, e.i)
+        elif (isinstance(e, (ast.Ref, ast.Size, ast.Dim))
+              and isinstance(e.children[0], ast.Var) and e.children[0].value == self.img_name):
+            vals = [self.walk(child, env) for child in e.children[1:]]
+            others = list(zip(e.children[1:], vals))
+            if isinstance(e, ast.Ref):
+                self.record_ref(e, vals[:len(self.dim_names)])
+                others = others[len(self.dim_names):]
+            for child, v in others:
+                self.use(v, child)
+            if isinstance(e, ast.Size):
+                v = vals[0]
+                if v is None or v[1] != v[2]:
+                    return _pos
+                elif v[1] < len(self.dim_names):
+                    return ('size', v[1], 0, 0)
+            # other dimensions are the same size in every tile
+            return None
+        elif isinstance(e, ast.Ctx):
+            return self.walk(e.body, env)
+        elif isinstance(e, ast.If):
+            self.use(self.walk(e.cond, env), e.cond)
+            return _join(self.walk(e.then_body, env), self.walk(e.else_body, env))
+        elif isinstance(e, ast.Let):
+            inner = dict(env)
+            for name, be in e.let_bindings:
+                inner[name] = self.walk(be, inner if isinstance(e, ast.LetStar) else env)
+            return self.walk(e.body, inner)
+        elif isinstance(e, ast.While):
+            inner = self.loop(e.while_bindings, env, isinstance(e, ast.WhileStar))
+            self.use(self.walk(e.cond, inner), e.cond)
+            return self.walk(e.body, inner)
+        elif isinstance(e, ast.Tensor):
+            inner = dict(env)
+            for name, size in e.dim_bindings:
+                inner[name] = self.dim_value(size, self.walk(size, env))
+            if isinstance(e, ast.TensorStar):
+                inner = self.loop(e.while_bindings, inner, True)
+            self.use(self.walk(e.body, inner), e.body)
+            return None
+        elif isinstance(e, ast.For):
+            inner = dict(env)
+            for name, size in e.dim_bindings:
+                inner[name] = self.dim_value(size, self.walk(size, env))
+            inner = self.loop(e.while_bindings, inner, isinstance(e, ast.ForStar))
+            return self.walk(e.body, inner)
+        elif isinstance(e, ast.NaryExpr):
+            vals = [self.walk(child, env) for child in e.children]
+            if isinstance(e, ast.Add):
+                return _add(*vals)
+            elif isinstance(e, ast.Sub):
+                return _add(*vals, sign=-1)
+            elif type(e) in _flipped:
+                self.compare(e, vals)
+                return None
+            for child, v in zip(e.children, vals):
+                self.use(v, child)
+            return None
+        else:
+            return None
+
+    def dim_value(self, size, v):
+        # a tensor dimension over one of the image's dimensions is an output coordinate
+        if v is not None and v[0] == 'size' and v[2] == v[3] == 0:
+            return ('coord', v[1], 0, 0)
+        self.use(v, size)
+        if v is not None and v[1] >= 1:
+            return ('int', 0, v[2] - 1)
+        return None
+
+
+def stencil_halo(core, tiled_dims=2):
+    """Find the halo needed to evaluate core tile by tile.
+    The image is the core's first input, and is tiled over its first tiled_dims dimensions,
+    which must be given by size variables, e.g. (img rows cols channels).
+    Returns a list of (before, after) pairs, the number of extra input pixels needed
+    on each side of a tile in each tiled dimension.
+    Raises TilingError if the core doesn't access the image as a stencil.
+    """
+    if not core.inputs:
+        raise TilingError('core has no inputs')
+    img_name, props, shape = core.inputs[0]
+    if not shape or len(shape) < tiled_dims or not all(isinstance(d, str) for d in shape[:tiled_dims]):
+        raise TilingError(f'first input {img_name} must be a tensor with named dimensions')
+
+    finder = _StencilFinder(img_name, list(shape[:tiled_dims]))
+    env = {name: ('size', k, 0, 0) for k, name in enumerate(shape[:tiled_dims])}
+    for name, props, shape in core.inputs[1:]:
+        env[name] = None
+    finder.walk(core.e, env)
+
+    halo = []
+    for offset in finder.offsets:
+        if offset is None:
+            halo.append((0, 0))
+        else:
+            lo, hi = offset
+            halo.append((max(0, -lo), max(0, hi)))
+    return halo
+
+
+def plan_tiles(shape, tile_shape, halo):
+    """List of (out_box, in_box) for each tile, where each box is a tuple of (start, stop) pairs.
+    in_box is out_box extended by the halo, but never past the edge of the image.
+    """
+    (rows, cols), (tile_rows, tile_cols) = shape[:2], tile_shape
+    (y_before, y_after), (x_before, x_after) = halo
+    tiles = []
+    for y0 in range(0, rows, tile_rows):
+        y1 = min(rows, y0 + tile_rows)
+        for x0 in range(0, cols, tile_cols):
+            x1 = min(cols, x0 + tile_cols)
+            out_box = ((y0, y1), (x0, x1))
+            in_box = ((max(0, y0 - y_before), min(rows, y1 + y_after)),
+                      (max(0, x0 - x_before), min(cols, x1 + x_after)))
+            tiles.append((out_box, in_box))
+    return tiles
+
+
+class InterpreterTiles(object):
+    """Evaluate a core on one tile at a time with a Titanic interpreter.
+    Calling this on a tile (a NumPy array of integers) returns the result as a float64 array,
+    and the number of expressions the interpreter evaluated.
+    The other arguments to the core are passed along unchanged.
+    """
+
+    def __init__(self, backend, cores, main, args=(), ctx=None, override=True):
+        self.backend = backend
+        self.cores = cores
+        self.main = main
+        self.args = list(args)
+        self.ctx = ctx
+        self.override = override
+
+    def __call__(self, tile):
+        interp = self.backend()
+        for core in self.cores:
+            interp.register_function(core)
+        img = ndarray.NDArray(shape=tile.shape, data=tile.reshape(-1).tolist())
+        result = interp.interpret(self.main, [img] + self.args, ctx=self.ctx, override=self.override)
+        if not isinstance(result, ndarray.NDArray):
+            raise TilingError(f'expecting a tensor result, got {result!s}')
+        data = np.array([np.nan if getattr(x, 'isnan', False) else float(x) for x in result.data],
+                        dtype=np.float64)
+        return data.reshape(result.shape), interp.evals
+
+
+def _open_input(src):
+    if isinstance(src, (str, os.PathLike)):
+        return np.load(src, mmap_mode='r')
+    else:
+        return src
+
+def _evaluate_tile(evaluate, src, out_box, in_box, convert):
+    (iy0, iy1), (ix0, ix1) = in_box
+    (oy0, oy1), (ox0, ox1) = out_box
+    tile = np.array(src[iy0:iy1, ix0:ix1])
+    result = evaluate(tile)
+    if isinstance(result, tuple):
+        result, evals = result
+    else:
+        evals = 0
+    if result.shape[:2] != tile.shape[:2]:
+        raise TilingError(f'tile of shape {tile.shape!r} produced a result of shape {result.shape!r}')
+    interior = result[oy0 - iy0:oy1 - iy0, ox0 - ix0:ox1 - ix0]
+    if convert is not None:
+        interior = convert(interior)
+    return interior, evals
+
+def _tile_worker(job):
+    evaluate, src, dst, out_box, in_box, convert = job
+    values, evals = _evaluate_tile(evaluate, _open_input(src), out_box, in_box, convert)
+    out = np.load(dst, mmap_mode='r+')
+    (oy0, oy1), (ox0, ox1) = out_box
+    out[oy0:oy1, ox0:ox1] = values
+    out.flush()
+    del out
+    return evals
+
+
+def run_tiled(evaluate, src, dst, halo, tile_shape=(256, 256), processes=None, convert=None, verbosity=0):
+    """Evaluate an image kernel tile by tile.
+
+    evaluate is called on each tile (with its halo), and returns the result for the tile,
+    or the result and an evaluation count; an InterpreterTiles will do,
+    and so will anything else that maps an image array to an array with the same first two dimensions.
+    src is the input image, either an array or the path to a .npy file (which will be memory-mapped).
+    dst is the path of the .npy file to write the output to.
+    convert is None to store the results as they are, or a function to apply to the results for each tile
+    before storing them, like imgkernel.to_pixels.
+    If processes is given, the tiles are evaluated in a pool of that many processes;
+    then src must be a path, and evaluate and convert must be picklable.
+
+    Returns the output (as a read-only memory-mapped array) and the total evaluation count.
+    """
+    if processes is not None and not isinstance(src, (str, os.PathLike)):
+        raise ValueError('src must be the path to a .npy file to use a process pool')
+
+    img = _open_input(src)
+    tiles = plan_tiles(img.shape, tile_shape, halo)
+
+    # the first tile tells us the shape and type of the output
+    (out_box, in_box), *rest = tiles
+    values, total_evals = _evaluate_tile(evaluate, img, out_box, in_box, convert)
+    out_shape = tuple(img.shape[:2]) + values.shape[2:]
+    out = np.lib.format.open_memmap(dst, mode='w+', dtype=values.dtype, shape=out_shape)
+    (oy0, oy1), (ox0, ox1) = out_box
+    out[oy0:oy1, ox0:ox1] = values
+    out.flush()
+    del out
+
+    jobs = [(evaluate, src, dst, out_box, in_box, convert) for out_box, in_box in rest]
+    if processes is None:
+        for i, job in enumerate(jobs):
+            total_evals += _tile_worker(job)
+            if verbosity >= 2:
+                print(f'  tile {i + 2} of {len(tiles)}')
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            for i, evals in enumerate(pool.imap_unordered(_tile_worker, jobs)):
+                total_evals += evals
+                if verbosity >= 2:
+                    print(f'  tile {i + 2} of {len(tiles)}')
+
+    if verbosity >= 1:
+        print(f'evaluated {len(tiles)} tiles of {tile_shape!r} with halo {halo!r}')
+
+    return np.load(dst, mmap_mode='r'), total_evals
@@ -0,0 +1,348 @@
+"""Binary evaluation traces, recorded once and analyzed offline.
+
+A TraceRecorder is attached to an interpreter like any other analysis
+(interpreter.analyses = [recorder]), and writes one record to a file for every
+evaluation it is told about: which node of the AST was evaluated, in which context,
+the inputs (for operations), and the result, with digital numbers encoded exactly
+as their significand, exponent and flags. Records are buffered in memory up to
+a fixed size, then written out, so tracing a long run doesn't hold the whole trace.
+Evaluations can also be sampled, to make smaller traces of very long runs.
+
+Afterwards, replay() reads the trace back and feeds the same (e, ctx, inputs, result)
+calls to any number of analyses with a track() method, such as
+analysis.DefaultAnalysis, BitcostAnalysis, and RangeAnalysis.
+The contexts given to the analyses have the same properties as the original ones,
+but no variable bindings.
+
+The file is laid out as:
+  header     magic, version, sample rate
+  records    node id, context id, number of inputs (or none), the inputs, and the result
+  tables     a pickle of the nodes, contexts, and value types that records refer to
+  footer     offset of the tables, magic
+The tables are only written when the recorder is closed, so a trace that
+was never closed can't be read.
+"""
+
+import mmap
+import pickle
+import random
+import struct
+
+from ..titanic import utils, digital, ndarray
+from ..fpbench import fpcast as ast
+from . import mpnum
+from . import analysis
+
+
+class TraceError(utils.TitanicError):
+    """Titanic evaluation trace error."""
+
+
+trace_magic = b'TTNTRACE'
+trace_end_magic = b'TTNTREND'
+trace_version = 1
+
+header_struct = struct.Struct('<8sHd')
+footer_struct = struct.Struct('<Q8s')
+# node id, context id, number of inputs
+record_struct = struct.Struct('<IIB')
+no_inputs = 0xff
+tag_struct = struct.Struct('<B')
+# value type id, flags, interval size, exponent, number of bytes in the significand
+digital_struct = struct.Struct('<IBhqH')
+count_struct = struct.Struct('<I')
+
+TAG_NONE = 0
+TAG_FALSE = 1
+TAG_TRUE = 2
+TAG_DIGITAL = 3
+TAG_ARRAY = 4
+
+FLAG_NEGATIVE = 1
+FLAG_ISINF = 2
+FLAG_ISNAN = 4
+FLAG_INEXACT = 8
+FLAG_ROUNDED = 16
+FLAG_INTERVAL_DOWN = 32
+FLAG_INTERVAL_CLOSED = 64
+
+
+def strip_ctx(ctx):
+    """A copy of ctx with the same properties and no bindings."""
+    cls = type(ctx)
+    stripped = cls.__new__(cls)
+    stripped._import_fields(ctx)
+    stripped.bindings = {}
+    stripped.props = ctx.props
+    return stripped
+
+
+class TraceRecorder(object):
+    """Analysis that writes every evaluation it tracks to a binary trace file.
+
+    buffer_size is the number of bytes to hold before writing them out,
+    and sample is the fraction of evaluations to record (chosen at random,
+    with a generator seeded by seed). Call close() when done
+    (or use the recorder in a with statement), or the trace won't be readable.
+    """
+
+    def __init__(self, fname, buffer_size=1 << 20, sample=None, seed=0):
+        if sample is not None and not 0.0 < sample <= 1.0:
+            raise ValueError('sample rate must be in (0, 1], got {}'.format(repr(sample)))
+        self.fname = fname
+        self.buffer_size = buffer_size
+        self.sample = sample
+        self.rng = random.Random(seed)
+
+        self.nodes = []
+        self.node_ids = {}
+        self.contexts = []
+        self.ctx_ids = {}
+        self.interner = analysis.ContextInterner()
+        self.value_types = []
+        self.value_type_ids = {}
+
+        self.evals = 0
+        self.records = 0
+        self.buf = bytearray()
+        self.f = open(fname, 'wb')
+        self.f.write(header_struct.pack(trace_magic, trace_version, sample if sample is not None else 1.0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def node_id(self, e):
+        # constants (and the values that get wrapped up as arguments) are often made fresh,
+        # so they are interned by value to keep the node table from growing forever
+        if isinstance(e, ast.Val):
+            key = (type(e), e.value)
+        elif type(e) is ast.ValueExpr:
+            key = ast.ValueExpr
+            e = ast.ValueExpr('argument')
+        else:
+            key = id(e)
+        try:
+            return self.node_ids[key]
+        except KeyError:
+            i = len(self.nodes)
+            self.nodes.append(e)
+            self.node_ids[key] = i
+            return i
+
+    def ctx_id(self, ctx):
+        key = (type(ctx), self.interner.propstr(ctx))
+        try:
+            return self.ctx_ids[key]
+        except KeyError:
+            i = len(self.contexts)
+            self.contexts.append(strip_ctx(ctx))
+            self.ctx_ids[key] = i
+            return i
+
+    def value_type_id(self, x):
+        if isinstance(x, mpnum.MPNum):
+            key = (type(x), self.ctx_id(x.ctx))
+        else:
+            # other digital numbers are recorded as plain digital numbers
+            key = (digital.Digital, None)
+        try:
+            return self.value_type_ids[key]
+        except KeyError:
+            i = len(self.value_types)
+            self.value_types.append(key)
+            self.value_type_ids[key] = i
+            return i
+
+    def encode(self, x):
+        buf = self.buf
+        if isinstance(x, digital.Digital):
+            flags = (
+                (FLAG_NEGATIVE if x._negative else 0)
+                | (FLAG_ISINF if x._isinf else 0)
+                | (FLAG_ISNAN if x._isnan else 0)
+                | (FLAG_INEXACT if x._inexact else 0)
+                | (FLAG_ROUNDED if x._rounded else 0)
+                | (FLAG_INTERVAL_DOWN if x._interval_down else 0)
+                | (FLAG_INTERVAL_CLOSED if x._interval_closed else 0)
+            )
+            c = x._c
+            nbytes = (c.bit_length() + 7) // 8
+            buf += tag_struct.pack(TAG_DIGITAL)
+            buf += digital_struct.pack(self.value_type_id(x), flags, x._interval_size, x._exp, nbytes)
+            buf += c.to_bytes(nbytes, 'little')
+        elif x is True:
+            buf += tag_struct.pack(TAG_TRUE)
+        elif x is False:
+            buf += tag_struct.pack(TAG_FALSE)
+        elif isinstance(x, ndarray.NDArray):
+            buf += tag_struct.pack(TAG_ARRAY)
+            buf += tag_struct.pack(len(x.shape))
+            for dim in x.shape:
+                buf += count_struct.pack(dim)
+            for elt in x.data:
+                self.encode(elt)
+        else:
+            buf += tag_struct.pack(TAG_NONE)
+
+    def track(self, e, ctx, inputs, result):
+        self.evals += 1
+        if self.sample is not None and self.rng.random() >= self.sample:
+            return
+        if isinstance(e, ast.NaryExpr) and inputs is not None and len(inputs) < no_inputs:
+            ninputs = len(inputs)
+        else:
+            ninputs = no_inputs
+        self.buf += record_struct.pack(self.node_id(e), self.ctx_id(ctx), ninputs)
+        if ninputs != no_inputs:
+            for x in inputs:
+                self.encode(x)
+        self.encode(result)
+        self.records += 1
+        if len(self.buf) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.f.write(self.buf)
+        self.buf = bytearray()
+
+    def close(self):
+        if self.f is None:
+            return
+        self.flush()
+        offset = self.f.tell()
+        tables = {
+            'nodes': self.nodes,
+            'contexts': self.contexts,
+            'value_types': self.value_types,
+            'evals': self.evals,
+            'records': self.records,
+        }
+        pickle.dump(tables, self.f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.f.write(footer_struct.pack(offset, trace_end_magic))
+        self.f.close()
+        self.f = None
+
+    def report(self):
+        s = 'Titanic evaluation trace:\n'
+        s += '  {:d} of {:d} evaluations recorded to {}\n'.format(self.records, self.evals, self.fname)
+        s += '  {:d} nodes, {:d} contexts\n'.format(len(self.nodes), len(self.contexts))
+        return s
+
+
+class TraceReader(object):
+    """A trace file written by TraceRecorder.
+    The records are read through a memory map, one at a time.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        with open(fname, 'rb') as f:
+            magic, version, sample = header_struct.unpack(f.read(header_struct.size))
+            if magic != trace_magic:
+                raise TraceError('{} is not a titanic trace'.format(repr(fname)))
+            if version != trace_version:
+                raise TraceError('unsupported trace version {:d} in {}'.format(version, repr(fname)))
+            f.seek(-footer_struct.size, 2)
+            offset, end_magic = footer_struct.unpack(f.read(footer_struct.size))
+            if end_magic != trace_end_magic:
+                raise TraceError('trace {} was not closed'.format(repr(fname)))
+            f.seek(offset)
+            tables = pickle.load(f)
+
+        self.sample = sample
+        self.start = header_struct.size
+        self.end = offset
+        self.nodes = tables['nodes']
+        self.contexts = tables['contexts']
+        self.evals = tables['evals']
+        self.n_records = tables['records']
+        self.value_types = [(cls, self.contexts[ctx_id] if ctx_id is not None else None)
+                            for cls, ctx_id in tables['value_types']]
+
+    def __len__(self):
+        return self.n_records
+
+    def decode(self, buf, pos):
+        tag = buf[pos]
+        pos += 1
+        if tag == TAG_DIGITAL:
+            vt, flags, interval_size, exp, nbytes = digital_struct.unpack_from(buf, pos)
+            pos += digital_struct.size
+            c = int.from_bytes(buf[pos:pos+nbytes], 'little')
+            pos += nbytes
+            cls, ctx = self.value_types[vt]
+            kwargs = dict(
+                c=c,
+                exp=exp,
+                negative=bool(flags & FLAG_NEGATIVE),
+                isinf=bool(flags & FLAG_ISINF),
+                isnan=bool(flags & FLAG_ISNAN),
+                inexact=bool(flags & FLAG_INEXACT),
+                rounded=bool(flags & FLAG_ROUNDED),
+                interval_size=interval_size,
+                interval_down=bool(flags & FLAG_INTERVAL_DOWN),
+                interval_closed=bool(flags & FLAG_INTERVAL_CLOSED),
+            )
+            if ctx is not None:
+                return cls(ctx=ctx, **kwargs), pos
+            else:
+                return cls(**kwargs), pos
+        elif tag == TAG_TRUE:
+            return True, pos
+        elif tag == TAG_FALSE:
+            return False, pos
+        elif tag == TAG_ARRAY:
+            ndim = buf[pos]
+            pos += 1
+            shape = []
+            for _ in range(ndim):
+                shape.append(count_struct.unpack_from(buf, pos)[0])
+                pos += count_struct.size
+            size = 1
+            for dim in shape:
+                size *= dim
+            data = []
+            for _ in range(size):
+                x, pos = self.decode(buf, pos)
+                data.append(x)
+            return ndarray.NDArray(shape=tuple(shape), data=data), pos
+        elif tag == TAG_NONE:
+            return None, pos
+        else:
+            raise TraceError('bad value tag {:d} at offset {:d} in {}'.format(tag, pos - 1, repr(self.fname)))
+
+    def records(self):
+        """Yield (e, ctx, inputs, result) for each record, in the order they were tracked."""
+        if self.end <= self.start:
+            return
+        with open(self.fname, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                pos = self.start
+                while pos < self.end:
+                    node_id, ctx_id, ninputs = record_struct.unpack_from(buf, pos)
+                    pos += record_struct.size
+                    if ninputs == no_inputs:
+                        inputs = None
+                    else:
+                        inputs = []
+                        for _ in range(ninputs):
+                            x, pos = self.decode(buf, pos)
+                            inputs.append(x)
+                    result, pos = self.decode(buf, pos)
+                    yield self.nodes[node_id], self.contexts[ctx_id], inputs, result
+
+    def replay(self, *analyses):
+        """Feed every record to each of the analyses. Returns the analyses."""
+        tracks = [als.track for als in analyses]
+        for e, ctx, inputs, result in self.records():
+            for track in tracks:
+                track(e, ctx, inputs, result)
+        return analyses
+
+
+def replay(fname, *analyses):
+    """Replay the trace in fname into the analyses, and return them."""
+    return TraceReader(fname).replay(*analyses)
@@ -0,0 +1,630 @@
+"""Exhaustive verification of basic operations on small number formats.
+
+A format with at most 16 bits has at most 2**16 encodings, so every unary operation
+can be checked on every input, and every binary operation on every pair of inputs
+(2**32 of them, for a 16 bit format). Each encoding is identified with an integer code:
+  - IEEE 754 and posit formats use the bit pattern itself.
+  - Fixed-point formats (sign-magnitude integers c, for the value c * 2**scale)
+    use c + (2**nbits - 1), so the finite values are codes 0 to 2**(nbits+1) - 2,
+    followed by codes for +inf, -inf and NaN. Only the finite codes are used as inputs.
+
+The verifier computes each operation on every input with two backends,
+a candidate and a reference, and compares the codes of the results
+(any two NaNs are considered the same). The backends are:
+  titanic     the Titanic number types (Float, Posit, Fixed), one element at a time
+  table       independent float64 reference: the exact result is computed with
+              error-free transformations, and rounded by looking it up
+              in the sorted table of the format's values. Ties are broken towards
+              the even bit pattern, and the midpoints between neighboring values
+              are the odd bit patterns of the same format with one more bit,
+              which is how IEEE 754 and posit rounding are specified.
+  nprounding  vectorized rounding from nprounding (add, sub, mul and div only);
+              posit results that would need their exponent rounded are skipped
+  numpy       hardware float16 arithmetic, for IEEE binary16
+  softfloat   the sfpy wrapper of the Berkeley SoftFloat library, for binary16
+  softposit   the sfpy wrapper of the SoftPosit library, for posit8 and posit16
+The vectorized backends check a whole 16 bit format in minutes;
+titanic (being the thing under test) runs at roughly the speed of the interpreter,
+so on 16 bit binary operations it needs a lot of cores or a lot of patience.
+
+Inputs are enumerated in fixed size blocks, which run on a process pool.
+If a checkpoint path is given, the completed blocks and the mismatches found so far
+are saved there (as JSON) every few seconds, and running the same verification again
+with the same checkpoint skips everything that was already checked.
+The report for each operation counts the inputs checked, any skipped (because a backend
+had no answer for them), and the mismatches, with the first few mismatching inputs
+kept as examples.
+"""
+
+import os
+import math
+import json
+import time
+import multiprocessing
+
+import numpy as np
+
+from ..titanic import utils
+from ..titanic.integral import bitmask
+from ..titanic.ops import RM
+from . import evalctx
+from . import ieee754
+from . import posit
+from . import fixed
+from . import nprounding
+
+
+class VerificationError(utils.TitanicError):
+    """Unable to verify some operation on some format."""
+
+
+unary_ops = ('neg', 'sqrt')
+binary_ops = ('add', 'sub', 'mul', 'div')
+
+def arity(op):
+    if op in unary_ops:
+        return 1
+    elif op in binary_ops:
+        return 2
+    else:
+        raise ValueError(f'unsupported operation {op!r}')
+
+
+# the table backend's error-free transformations need the products of any two values
+# to stay well clear of float64 underflow and overflow
+_max_magnitude = 2.0 ** 240
+_min_magnitude = 2.0 ** -240
+
+# result codes from backends that aren't the code of any value
+no_code = -1
+skipped_code = -2
+
+
+def _sign_of(x):
+    return np.where(np.isnan(x), 0.0, np.sign(x))
+
+
+class CodeFormat(object):
+    """The encodings of one small format, and vectorized conversions between codes and float64 values.
+
+    values[code] is the value of each input code (NaN for NaNs).
+    """
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.values = None
+        self.ncodes = None
+        self.nan_code = None
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.ctx!r})'
+
+    def _check_range(self):
+        mag = np.abs(self.values[np.isfinite(self.values) & (self.values != 0)])
+        if mag.size > 0 and (mag.max() >= _max_magnitude or mag.min() <= _min_magnitude):
+            raise VerificationError(f'values of {self.ctx!s} are out of range for float64 references')
+
+    def decode(self, codes):
+        return self.values[codes]
+
+    def canonical(self, codes):
+        """Map every NaN code to the same one."""
+        codes = np.asarray(codes, dtype=np.int64)
+        valid = (codes >= 0) & (codes < len(self.values))
+        isnan = np.zeros(codes.shape, dtype=bool)
+        isnan[valid] = np.isnan(self.values[codes[valid]])
+        return np.where(isnan, self.nan_code, codes)
+
+    def to_titanic(self, code):
+        raise ValueError('virtual method: unimplemented')
+
+    def from_titanic(self, x):
+        raise ValueError('virtual method: unimplemented')
+
+    def encode(self, values):
+        """Codes of float64 values that are exactly representable, or no_code."""
+        raise ValueError('virtual method: unimplemented')
+
+    def round(self, hi, lo):
+        """Codes of the exact results hi + lo, correctly rounded to the format.
+        hi is the float64 rounding of the exact result, and only the sign of lo is used.
+        """
+        raise ValueError('virtual method: unimplemented')
+
+
+class PatternFormat(CodeFormat):
+    """Formats where the code is the bit pattern, and the nonnegative
+    values are the codes from 0 up to top, in increasing order.
+    """
+
+    saturate = False
+
+    def __init__(self, ctx, nbits, top, ext_ctx):
+        super().__init__(ctx)
+        self.nbits = nbits
+        self.ncodes = 1 << nbits
+        self.top = top
+        self.values = np.array([self._decode_float(self._bits_to_digital(i, ctx)) for i in range(self.ncodes)],
+                               dtype=np.float64)
+        self._check_range()
+        # nonnegative magnitudes, and the midpoints between them
+        self.mags = self.values[:top + 1]
+        self.mids = np.array([self._decode_float(self._bits_to_digital(2 * i + 1, ext_ctx)) for i in range(top)],
+                             dtype=np.float64)
+
+    @staticmethod
+    def _decode_float(x):
+        if x.isnan:
+            return math.nan
+        elif x.isinf:
+            return -math.inf if x.negative else math.inf
+        elif x.c == 0:
+            return -0.0 if x.negative else 0.0
+        else:
+            return math.ldexp(-x.c if x.negative else x.c, x.exp)
+
+    def to_titanic(self, code):
+        return self._bits_to_digital(int(code), self.ctx)
+
+    def from_titanic(self, x):
+        return self._digital_to_bits(x, self.ctx)
+
+    def _apply_sign(self, mag_codes, negative):
+        raise ValueError('virtual method: unimplemented')
+
+    def encode(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        a = np.abs(values)
+        k = np.minimum(np.searchsorted(self.mags, a), self.top)
+        found = self.mags[k] == a
+        codes = np.where(found, self._apply_sign(k, np.signbit(values)), no_code)
+        return np.where(np.isnan(values), self.nan_code, codes)
+
+    def round(self, hi, lo):
+        hi = np.asarray(hi, dtype=np.float64)
+        lo = np.asarray(lo, dtype=np.float64)
+        a = np.abs(hi)
+        negative = np.signbit(hi)
+        # +1 if the exact magnitude is above a, -1 if below
+        side = _sign_of(lo) * np.where(negative, -1.0, 1.0)
+
+        k = np.searchsorted(self.mags, a)
+        kc = np.minimum(k, self.top)
+        at = self.mags[kc] == a
+        exact = at & (side == 0)
+        # the largest representable magnitude below the exact one
+        j = np.where(at & (side > 0), kc, k - 1)
+        jc = np.clip(j, 0, self.top - 1)
+        mid = self.mids[jc]
+        up = (a > mid) | ((a == mid) & ((side > 0) | ((side == 0) & ((jc & 1) == 1))))
+        mag_codes = np.where(exact, kc, jc + up)
+        if self.saturate:
+            # never round to zero, or past the largest value
+            mag_codes = np.where(~exact & (j == 0), 1, mag_codes)
+            mag_codes = np.where(j >= self.top, self.top, mag_codes)
+
+        codes = self._apply_sign(mag_codes, negative)
+        if self.saturate:
+            # all non-real values go to the single non-real value
+            return np.where(np.isfinite(hi), codes, self.nan_code)
+        else:
+            return np.where(np.isnan(hi), self.nan_code, codes)
+
+
+class IEEEFormat(PatternFormat):
+
+    _bits_to_digital = staticmethod(ieee754.bits_to_digital)
+    _digital_to_bits = staticmethod(ieee754.digital_to_bits)
+
+    def __init__(self, ctx):
+        if ctx.rm != RM.RNE:
+            raise VerificationError(f'only round-to-nearest-even IEEE 754 formats are supported, not {ctx!s}')
+        pbits = ctx.p - 1
+        super().__init__(ctx, ctx.nbits, bitmask(ctx.es) << pbits, ieee754.ieee_ctx(ctx.es, ctx.nbits + 1))
+        self.nan_code = (bitmask(ctx.es) << pbits) | (1 << (pbits - 1))
+
+    def _apply_sign(self, mag_codes, negative):
+        return np.where(negative, mag_codes | (1 << (self.nbits - 1)), mag_codes)
+
+
+class PositFormat(PatternFormat):
+
+    _bits_to_digital = staticmethod(posit.bits_to_digital)
+    _digital_to_bits = staticmethod(posit.digital_to_bits)
+    saturate = True
+
+    def __init__(self, ctx):
+        super().__init__(ctx, ctx.nbits, bitmask(ctx.nbits - 1), posit.posit_ctx(ctx.es, ctx.nbits + 1))
+        self.nan_code = 1 << (ctx.nbits - 1)
+
+    def _apply_sign(self, mag_codes, negative):
+        return np.where(negative, -mag_codes & bitmask(self.nbits), mag_codes)
+
+
+class FixedFormat(CodeFormat):
+
+    def __init__(self, ctx):
+        super().__init__(ctx)
+        self.bias = bitmask(ctx.nbits)
+        self.ncodes = 2 * self.bias + 1
+        self.inf_code = self.ncodes
+        self.ninf_code = self.ncodes + 1
+        self.nan_code = self.ncodes + 2
+        cs = np.arange(self.ncodes, dtype=np.int64) - self.bias
+        self.values = np.concatenate([np.ldexp(cs.astype(np.float64), ctx.scale),
+                                      np.array([math.inf, -math.inf, math.nan])])
+        self._check_range()
+
+    def to_titanic(self, code):
+        c = int(code) - self.bias
+        return fixed.Fixed(negative=c < 0, c=abs(c), exp=self.ctx.scale, ctx=self.ctx)
+
+    def from_titanic(self, x):
+        if x.isnan:
+            return self.nan_code
+        elif x.isinf:
+            return self.ninf_code if x.negative else self.inf_code
+        shift = x.exp - self.ctx.scale
+        if shift >= 0:
+            c = x.c << shift
+        elif x.c & bitmask(-shift) == 0:
+            c = x.c >> -shift
+        else:
+            return no_code
+        if c > self.bias:
+            return no_code
+        return self.bias - c if x.negative else self.bias + c
+
+    def _codes_of_ints(self, cs, negative):
+        codes = cs + self.bias
+        overflow = np.abs(cs) > self.bias
+        return np.where(overflow, np.where(negative, self.ninf_code, self.inf_code), codes)
+
+    def encode(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        with np.errstate(invalid='ignore'):
+            q = np.ldexp(values, -self.ctx.scale)
+            cs = np.where(np.isfinite(q), q, 0.0)
+            integral = (np.floor(cs) == cs) & (np.abs(cs) <= self.bias)
+        codes = np.where(integral, cs.astype(np.int64) + self.bias, no_code)
+        codes = np.where(np.isinf(values), np.where(values < 0, self.ninf_code, self.inf_code), codes)
+        return np.where(np.isnan(values), self.nan_code, codes)
+
+    def round(self, hi, lo):
+        hi = np.asarray(hi, dtype=np.float64)
+        lo = np.asarray(lo, dtype=np.float64)
+        side = _sign_of(lo)
+        rm = self.ctx.rm
+        finite = np.isfinite(hi)
+        q = np.ldexp(np.where(finite, hi, 0.0), -self.ctx.scale)
+        f = np.floor(q)
+        # the integers below and above the exact value, and whether it is one of them
+        exact = (q == f) & (side == 0)
+        lower = np.where((q == f) & (side < 0), f - 1, f)
+        half = lower + 0.5
+        above = (q > half) | ((q == half) & (side > 0))
+        tie = (q == half) & (side == 0)
+        negative = np.signbit(hi)
+        if rm == RM.RNE:
+            up = above | (tie & (np.fmod(lower, 2) != 0))
+        elif rm == RM.RNA:
+            up = above | (tie & ~negative)
+        elif rm == RM.RTP:
+            up = np.ones(q.shape, dtype=bool)
+        elif rm == RM.RTN:
+            up = np.zeros(q.shape, dtype=bool)
+        elif rm == RM.RTZ:
+            up = negative
+        elif rm == RM.RAZ:
+            up = ~negative
+        else:
+            raise VerificationError(f'unsupported rounding mode {rm!s}')
+        cs = np.where(exact, f, lower + up).astype(np.int64)
+        codes = self._codes_of_ints(cs, negative)
+        codes = np.where(np.isinf(hi), np.where(hi < 0, self.ninf_code, self.inf_code), codes)
+        return np.where(np.isnan(hi), self.nan_code, codes)
+
+
+_formats = {}
+def code_format(ctx):
+    """The CodeFormat for ctx (built once per process, as the tables take a moment)."""
+    key = ctx.propstr()
+    try:
+        return _formats[key]
+    except KeyError:
+        if isinstance(ctx, evalctx.IEEECtx):
+            fmt = IEEEFormat(ctx)
+        elif isinstance(ctx, evalctx.PositCtx):
+            fmt = PositFormat(ctx)
+        elif isinstance(ctx, evalctx.FixedCtx):
+            fmt = FixedFormat(ctx)
+        else:
+            raise VerificationError(f'unsupported context {ctx!r}')
+        _formats[key] = fmt
+        return fmt
+
+
+# backends: each one takes a format, an operation, and the arrays of argument codes,
+# and returns the array of result codes
+
+def titanic_backend(fmt, op, *codes):
+    ctx = fmt.ctx
+    objs = {}
+    def arg(code):
+        try:
+            return objs[code]
+        except KeyError:
+            x = fmt.to_titanic(code)
+            objs[code] = x
+            return x
+
+    method = getattr(type(arg(int(codes[0][0]))), op)
+    results = np.empty(len(codes[0]), dtype=np.int64)
+    for i, args in enumerate(zip(*(c.tolist() for c in codes))):
+        x = arg(args[0])
+        result = method(x, *(arg(code) for code in args[1:]), ctx=ctx)
+        results[i] = fmt.from_titanic(result)
+    return results
+
+
+def _exact_op(op, a, b=None):
+    """float64 result, and the error term (or something with its sign), of op on exact values."""
+    with np.errstate(all='ignore'):
+        if op == 'neg':
+            hi, lo = -a, np.zeros(a.shape)
+        elif op == 'sqrt':
+            hi = np.sqrt(a)
+            p, err = nprounding.two_prod(hi, hi)
+            # a - p is exact, as p is within a factor of two of a
+            lo = (a - p) - err
+        elif op == 'add':
+            hi, lo = nprounding.two_sum(a, b)
+        elif op == 'sub':
+            hi, lo = nprounding.two_sum(a, -b)
+        elif op == 'mul':
+            hi, lo = nprounding.two_prod(a, b)
+        elif op == 'div':
+            hi = a / b
+            p, err = nprounding.two_prod(hi, b)
+            lo = ((a - p) - err) * np.sign(b)
+        else:
+            raise ValueError(f'unsupported operation {op!r}')
+    return hi, np.where(np.isfinite(hi) & np.isfinite(lo), lo, 0.0)
+
+def table_backend(fmt, op, *codes):
+    return fmt.round(*_exact_op(op, *(fmt.decode(c) for c in codes)))
+
+
+_nprounding_ops = {
+    'add': nprounding.add,
+    'sub': nprounding.sub,
+    'mul': nprounding.mul,
+    'div': nprounding.div,
+}
+
+def nprounding_backend(fmt, op, *codes):
+    if not nprounding.supported(fmt.ctx):
+        raise VerificationError(f'nprounding does not support {fmt.ctx!s}')
+    try:
+        fn = _nprounding_ops[op]
+    except KeyError:
+        raise VerificationError(f'nprounding does not support {op!r}') from None
+    args = [fmt.decode(c) for c in codes]
+    try:
+        return fmt.encode(fn(*args, fmt.ctx))
+    except nprounding.VectorRoundingError:
+        pass
+    # some results can't be rounded; find out which ones
+    results = np.empty(len(codes[0]), dtype=np.int64)
+    for i in range(len(results)):
+        try:
+            results[i] = fmt.encode(fn(*(a[i:i+1] for a in args), fmt.ctx))[0]
+        except nprounding.VectorRoundingError:
+            results[i] = skipped_code
+    return results
+
+
+def numpy_backend(fmt, op, *codes):
+    ctx = fmt.ctx
+    if not (isinstance(ctx, evalctx.IEEECtx) and ctx.es == 5 and ctx.nbits == 16 and ctx.rm == RM.RNE):
+        raise VerificationError(f'numpy only has hardware arithmetic for binary16, not {ctx!s}')
+    args = [fmt.decode(c).astype(np.float16) for c in codes]
+    with np.errstate(all='ignore'):
+        if op == 'neg':
+            result = np.negative(*args)
+        else:
+            result = getattr(np, {'sqrt': 'sqrt', 'add': 'add', 'sub': 'subtract',
+                                  'mul': 'multiply', 'div': 'divide'}[op])(*args)
+    return fmt.encode(result.astype(np.float64))
+
+
+def _sfpy_type(ctx):
+    import sfpy
+    if isinstance(ctx, evalctx.IEEECtx) and ctx.rm == RM.RNE and (ctx.es, ctx.nbits) == (5, 16):
+        return sfpy.Float16
+    elif isinstance(ctx, evalctx.PositCtx) and (ctx.es, ctx.nbits) == (0, 8):
+        return sfpy.Posit8
+    elif isinstance(ctx, evalctx.PositCtx) and (ctx.es, ctx.nbits) == (1, 16):
+        return sfpy.Posit16
+    else:
+        raise VerificationError(f'sfpy does not support {ctx!s}')
+
+def sfpy_backend(fmt, op, *codes):
+    cls = _sfpy_type(fmt.ctx)
+    objs = [cls(float(x)) for x in fmt.values[:fmt.ncodes]]
+    results = np.empty(len(codes[0]), dtype=np.float64)
+    for i, args in enumerate(zip(*(c.tolist() for c in codes))):
+        if op == 'neg':
+            result = -objs[args[0]]
+        elif op == 'sqrt':
+            result = objs[args[0]].sqrt()
+        elif op == 'add':
+            result = objs[args[0]] + objs[args[1]]
+        elif op == 'sub':
+            result = objs[args[0]] - objs[args[1]]
+        elif op == 'mul':
+            result = objs[args[0]] * objs[args[1]]
+        elif op == 'div':
+            result = objs[args[0]] / objs[args[1]]
+        else:
+            raise ValueError(f'unsupported operation {op!r}')
+        results[i] = float(result)
+    return fmt.encode(results)
+
+
+backends = {
+    'titanic': titanic_backend,
+    'table': table_backend,
+    'nprounding': nprounding_backend,
+    'numpy': numpy_backend,
+    'softfloat': sfpy_backend,
+    'softposit': sfpy_backend,
+}
+
+
+# checking one block of inputs
+
+def block_args(fmt, op, start, stop):
+    """Argument code arrays for inputs start to stop of op, in enumeration order."""
+    idx = np.arange(start, stop, dtype=np.int64)
+    if arity(op) == 1:
+        return (idx,)
+    else:
+        a, b = np.divmod(idx, fmt.ncodes)
+        return a, b
+
+def check_block(fmt, op, start, stop, candidate, reference, max_examples=16):
+    """Check inputs start to stop of op; returns (checked, skipped, mismatches, examples)."""
+    args = block_args(fmt, op, start, stop)
+    got = fmt.canonical(backends[candidate](fmt, op, *args))
+    expected = fmt.canonical(backends[reference](fmt, op, *args))
+    skipped = (got == skipped_code) | (expected == skipped_code)
+    bad = np.nonzero((got != expected) & ~skipped)[0]
+    examples = [[int(c[i]) for c in args] + [int(expected[i]), int(got[i])] for i in bad[:max_examples]]
+    nskipped = int(np.count_nonzero(skipped))
+    return stop - start - nskipped, nskipped, len(bad), examples
+
+
+_worker_cfg = None
+
+def _init_worker(ctx, candidate, reference, max_examples):
+    global _worker_cfg
+    _worker_cfg = code_format(ctx), candidate, reference, max_examples
+
+def _run_block(job):
+    op, k, start, stop = job
+    fmt, candidate, reference, max_examples = _worker_cfg
+    return (op, k) + check_block(fmt, op, start, stop, candidate, reference, max_examples=max_examples)
+
+
+checkpoint_version = 1
+
+def _load_checkpoint(path, description):
+    if path is None or not os.path.exists(path):
+        return {'version': checkpoint_version, 'description': description, 'ops': {}}
+    with open(path, 'rt') as f:
+        state = json.load(f)
+    if state.get('version') != checkpoint_version:
+        raise ValueError(f'unsupported checkpoint version {state.get("version")!r} in {path!r}')
+    if state['description'] != description:
+        raise ValueError(f'checkpoint {path!r} is for a different verification:\n'
+                         f'  {state["description"]!s}\n  not {description!s}')
+    return state
+
+def _save_checkpoint(path, state):
+    tmp = path + '.tmp'
+    with open(tmp, 'wt') as f:
+        json.dump(state, f, indent=None, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def verify(ctx, ops=unary_ops + binary_ops, candidate='titanic', reference='table',
+           checkpoint=None, block_size=1 << 16, nprocs=None, max_examples=16,
+           checkpoint_interval=10.0, verbosity=1):
+    """Check ops on every input in ctx, comparing the candidate backend to the reference.
+
+    Returns a dict with a report for each op: the numbers of inputs checked,
+    skipped and mismatched, and a list of example mismatches as [*arg_codes, expected, got].
+    """
+    for name in (candidate, reference):
+        if name not in backends:
+            raise ValueError(f'unknown backend {name!r}, expecting one of {", ".join(backends)}')
+    fmt = code_format(ctx)
+    if fmt.ncodes > 1 << 16 and any(arity(op) == 2 for op in ops):
+        raise VerificationError(f'{ctx!s} has too many encodings to check every pair')
+    if nprocs is None:
+        nprocs = max(multiprocessing.cpu_count() // 2, 1)
+
+    description = f'{ctx.propstr()} {candidate} vs {reference} in blocks of {block_size:d}'
+    state = _load_checkpoint(checkpoint, description)
+
+    jobs = []
+    for op in ops:
+        total = fmt.ncodes ** arity(op)
+        nblocks = -(-total // block_size)
+        report = state['ops'].setdefault(op, {
+            'inputs': total, 'checked': 0, 'skipped': 0, 'mismatches': 0, 'examples': [], 'done': [],
+        })
+        done = set(report['done'])
+        for k in range(nblocks):
+            if k not in done:
+                jobs.append((op, k, k * block_size, min((k + 1) * block_size, total)))
+
+    if verbosity >= 1:
+        print(f'verifying {", ".join(ops)} on {ctx!s}: {candidate} vs {reference}, {len(jobs):d} blocks to check', flush=True)
+
+    def record(result):
+        op, k, checked, skipped, mismatches, examples = result
+        report = state['ops'][op]
+        report['checked'] += checked
+        report['skipped'] += skipped
+        report['mismatches'] += mismatches
+        report['examples'].extend(examples[:max(max_examples - len(report['examples']), 0)])
+        report['done'].append(k)
+
+    last_save = time.time()
+    if nprocs == 1:
+        _init_worker(ctx, candidate, reference, max_examples)
+        results = map(_run_block, jobs)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes=nprocs, initializer=_init_worker,
+                                    initargs=(ctx, candidate, reference, max_examples))
+        results = pool.imap_unordered(_run_block, jobs)
+    try:
+        for i, result in enumerate(results):
+            record(result)
+            if checkpoint is not None and time.time() - last_save >= checkpoint_interval:
+                _save_checkpoint(checkpoint, state)
+                last_save = time.time()
+            if verbosity >= 2:
+                print(f'  {i + 1:d}/{len(jobs):d} blocks', flush=True)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if checkpoint is not None:
+            _save_checkpoint(checkpoint, state)
+
+    reports = {}
+    for op in ops:
+        report = dict(state['ops'][op])
+        report['done'] = sorted(report['done'])
+        reports[op] = report
+        if verbosity >= 1:
+            print(f'  {op}: {report["checked"]:d} checked, {report["skipped"]:d} skipped, {report["mismatches"]:d} mismatches', flush=True)
+            if verbosity >= 2 or report['mismatches'] > 0:
+                for example in report['examples']:
+                    print('    ' + describe_mismatch(fmt, op, example))
+    return reports
+
+
+def describe_mismatch(fmt, op, example):
+    """One line describing an example mismatch from a report."""
+    *args, expected, got = example
+    def show(code):
+        if 0 <= code < len(fmt.values):
+            return f'{code:#x} ({fmt.values[code]!r})'
+        else:
+            return f'{code:d} (not a value)'
+    return f'{op}({", ".join(show(c) for c in args)}): expected {show(expected)}, got {show(got)}'
@@ -1,9 +1,9 @@
 import random
 import math
-import itertools
 import multiprocessing
 import subprocess
 import os
+import tempfile
 
 import numpy as np
 
@@ -16,6 +16,9 @@ from .arithmetic import evalctx
 from .titanic import digital
 
 from .titanic import gmpmath
+from . import accsweep
+from . import oracle
+from . import sampler
 #from .titanic import wolfmath
 
 
@@ -196,46 +199,162 @@ def sweep_single(core, cases, nbits, ctx):
     return records
 
 
-# break arguments up into chunks manually.
-# thanks to:
-# https://stackoverflow.com/questions/8991506/iterate-an-iterator-by-chunks-of-n-in-python
-def grouper(n, iterable):
-    it = iter(iterable)
-    while True:
-       chunk = tuple(itertools.islice(it, n))
-       if not chunk:
-           return
-       yield chunk
+class CoreBench(object):
+    """bench_core on one case (a pair es, ps, as from iter_1arg or iter_2arg),
+    for accsweep.run. Cases whose arguments can't meet the precondition produce no record.
+    """
 
-def sweep_multi(core, cases, nbits, ctx, nprocs=None):
+    def __init__(self, core, nbits, ctx):
+        self.core = core
+        self.nbits = nbits
+        self.ctx = ctx
+
+    def __call__(self, case):
+        es, ps = case
+        try:
+            hi_args, lo_args = gen_core_arguments(self.core, es, ps, self.nbits, self.ctx)
+        except Exception as e:
+            return None
+        return bench_core(self.core, hi_args, lo_args, self.ctx)
+
+def sweep_table(core, cases, nbits, ctx, table_dir, nprocs=None, seed=0):
+    """Run bench_core on the cases in parallel, storing the records in a table in table_dir.
+    Rerunning with the same table_dir resumes the sweep, and only runs cases that aren't stored yet.
+    """
     if nprocs is None:
         nprocs = max(multiprocessing.cpu_count() // 2, 1)
 
     print('{:s}\nrunning with {:d} total bits on {:d} processes'.format(str(core), nbits, nprocs), flush=True)
 
-    pool = multiprocessing.Pool(processes=nprocs)
-    arg_iter = ([core, chunk, nbits, ctx] for chunk in grouper(batchsize, cases))
-
-    all_records = []
-    map_invocations = 0
-    for records in pool.starmap(sweep, arg_iter):
-        map_invocations += 1
-        if records is not None:
-            all_records += records
+    description = '{:s} with {:d} total bits in {:s}'.format(str(core), nbits, repr(ctx))
+    return accsweep.run(CoreBench(core, nbits, ctx), cases, table_dir, description=description,
+                        chunk_size=batchsize, nprocs=nprocs, seed=seed,
+                        verbosity=1 if progress_update > 0 else 0)
 
-    if progress_update > 0:
-        print('\nstarmap finished with {:d} invocations'.format(map_invocations), flush=True)
-    else:
-        print('starmap finished with {:d} invocations'.format(map_invocations), flush=True)
-
-    pool.close()
-    pool.join()
+def sweep_multi(core, cases, nbits, ctx, nprocs=None):
+    with tempfile.TemporaryDirectory() as table_dir:
+        table = sweep_table(core, cases, nbits, ctx, table_dir, nprocs=nprocs)
+        all_records = [record.tolist() for shard in table.shards() for record in shard[1:].T]
 
     print('generated {:d} records'.format(len(all_records)), flush=True)
 
     return all_records
 
 
+# Exhaustive evaluation: for cores whose inputs are small IEEE 754 or posit formats,
+# there are few enough inputs to just try all of them. Each case is the index
+# of one combination of input bit patterns (with the first input's pattern most significant),
+# and its record is the bits of accuracy of the result compared to a high precision reference.
+
+exhaustive_max_inputs = 1 << 16
+exhaustive_chunk_size = 1024
+
+def bits_to_mpmf(i, ctx):
+    if isinstance(ctx, evalctx.IEEECtx):
+        x = ieee754.bits_to_digital(i, ctx)
+    elif isinstance(ctx, evalctx.PositCtx):
+        x = posit.bits_to_digital(i, ctx)
+    else:
+        raise ValueError('can only enumerate the bit patterns of IEEE 754 or posit formats, not {}'.format(repr(ctx)))
+    return mpmf.MPMF(x, ctx=ctx)
+
+def exhaustive_bits(result, reference, p):
+    """Bits of accuracy of result, capped at p: p if the two are identical (even if they aren't real),
+    nan if they aren't both real, otherwise gmpmath.geo_sim.
+    """
+    if result.isnan or reference.isnan:
+        return p if result.isnan and reference.isnan else math.nan
+    elif result.isinf or reference.isinf:
+        return p if result.isinf and reference.isinf and result.negative == reference.negative else math.nan
+    else:
+        return min(gmpmath.geo_sim(result, reference), p)
+
+class CoreExhaustive(object):
+    """Evaluate a core on one combination of input bit patterns (given by its index),
+    in ctx and in ref_ctx, for accsweep.run. Inputs that don't meet the precondition produce no record.
+    """
+
+    def __init__(self, core, ctx, ref_ctx=ctx128):
+        self.core = core
+        self.ctx = ctx
+        self.ref_ctx = ref_ctx
+        self.ncodes = 1 << ctx.nbits
+        self.evaltor = mpmf.Interpreter()
+
+    def args(self, idx):
+        codes = []
+        for _ in self.core.inputs:
+            idx, code = divmod(idx, self.ncodes)
+            codes.append(code)
+        return [bits_to_mpmf(code, self.ctx) for code in reversed(codes)]
+
+    def __call__(self, idx):
+        args = self.args(idx)
+        if not self.evaltor.interpret_pre(self.core, args, ctx=self.ref_ctx):
+            return None
+        result = self.evaltor.interpret(self.core, args, ctx=self.ctx)
+        reference = self.evaltor.interpret(self.core, args, ctx=self.ref_ctx)
+        return [exhaustive_bits(result, reference, self.ctx.p)]
+
+def exhaustive_table(core, ctx, table_dir, ref_ctx=ctx128, nprocs=None):
+    """Evaluate core on every combination of input bit patterns in ctx, in parallel,
+    storing the bits of accuracy of each in a table in table_dir (which is resumable, like sweep_table).
+    """
+    ninputs = (1 << ctx.nbits) ** len(core.inputs)
+    if ninputs > exhaustive_max_inputs:
+        raise ValueError('{:d} inputs in {} is too many to evaluate exhaustively'.format(ninputs, repr(ctx)))
+    if nprocs is None:
+        nprocs = max(multiprocessing.cpu_count() // 2, 1)
+
+    print('{:s}\nevaluating on all {:d} inputs on {:d} processes'.format(str(core), ninputs, nprocs), flush=True)
+
+    description = '{:s} on every input in {:s}, against {:s}'.format(str(core), repr(ctx), repr(ref_ctx))
+    return accsweep.run(CoreExhaustive(core, ctx, ref_ctx=ref_ctx), range(ninputs), table_dir,
+                        description=description, chunk_size=exhaustive_chunk_size,
+                        nprocs=nprocs, verbosity=1 if progress_update > 0 else 0)
+
+def exhaustive_map(table, ctx, ninputs):
+    """The bits of accuracy from an exhaustive table as an array, indexed by the bit patterns of each input.
+    Inputs that didn't meet the precondition are nan, as are results that couldn't be compared.
+    """
+    ncodes = 1 << ctx.nbits
+    error_map = np.full(ncodes ** ninputs, math.nan)
+    for idxs, bits in zip(table.iter_column('index'), table.iter_column(0)):
+        error_map[idxs.astype(np.int64)] = bits
+    return error_map.reshape((ncodes,) * ninputs)
+
+def exhaustive_hist(error_map, bins=None):
+    """Histogram of the bits of accuracy in an error map, with unit bins by default;
+    returns the counts, the bin edges, and the number of values that were nan or -inf.
+    """
+    bits = error_map[np.isfinite(error_map)]
+    if bins is None:
+        hi = math.ceil(bits.max()) if len(bits) > 0 else 0
+        lo = math.floor(bits.min()) if len(bits) > 0 else 0
+        bins = np.arange(lo, hi + 2)
+    counts, edges = np.histogram(bits, bins=bins)
+    return counts, edges, int(error_map.size - len(bits))
+
+def exhaustive_sweep(core, ctx, table_dir=None, ref_ctx=ctx128, nprocs=None):
+    """Evaluate core on every input in ctx; returns the error map and its histogram."""
+    if table_dir is None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            return exhaustive_sweep(core, ctx, table_dir=tmp_dir, ref_ctx=ref_ctx, nprocs=nprocs)
+
+    table = exhaustive_table(core, ctx, table_dir, ref_ctx=ref_ctx, nprocs=nprocs)
+    error_map = exhaustive_map(table, ctx, len(core.inputs))
+    counts, edges, nonfinite = exhaustive_hist(error_map)
+
+    print('bits of accuracy over {:d} inputs: {:d} not comparable or wrong sign'.format(error_map.size, nonfinite))
+    for lo, count in zip(edges, counts):
+        if count > 0:
+            print('  {:>6}  {:d}'.format(str(lo), count))
+    worst = np.argmin(np.where(np.isnan(error_map), np.inf, error_map))
+    print('worst input: {}'.format(', '.join(hex(int(i)) for i in np.unravel_index(worst, error_map.shape))), flush=True)
+
+    return error_map, (counts, edges)
+
+
 benchmarks = {
     'nop' : '(FPCore (x) x)',
 
@@ -477,8 +596,8 @@ def make_figs():
         else:
             line2 = False
 
-        data = sweep_multi(core, argiter, nbits, ctx)
-        xs, ys = split_records(data, 0, 1)
+        table = sweep_table(core, argiter, nbits, ctx, 'fig/' + corename + '_table')
+        xs, ys = table.split_records(0, 1)
 
         do_scatter(xs, ys, 'accuracy for ' + corename, 'fig/' + corename + '_scatter.png')
         do_cdf(xs, ys, 'excess precision for ' + corename, 'fig/' + corename + '_cdf.png', line2)
@@ -516,23 +635,42 @@ corenames += ['herbified_' + name for name in corenames]
 
 
 #repl = wolfmath.MathRepl()
-def get_exact_answer(corename, args):
-    mathfn = maths[corename][1]
-
-    expr = 'Block[{}, ' + mathfn + '; ex0[' + ', '.join([wolfmath.digital_to_math(ieee754.Float(arg)) for arg in args]) + ']]'
-
-    text_result = repl.evaluate_to_digits(expr)
-
-    return wolfmath.math_to_digital(text_result)
-
-
-def gen_random_double_arguments(core):
-    rargs = [random_float64() for arg in core.inputs]
-
-    while not ieee754.Interpreter.interpret_pre(core, rargs, ctx=ctx512):
-        rargs = [random_float64() for arg in core.inputs]
-
-    return rargs
+#def get_exact_answer(corename, args):
+#    mathfn = maths[corename][1]
+#
+#    expr = 'Block[{}, ' + mathfn + '; ex0[' + ', '.join([wolfmath.digital_to_math(ieee754.Float(arg)) for arg in args]) + ']]'
+#
+#    text_result = repl.evaluate_to_digits(expr)
+#
+#    return wolfmath.math_to_digital(text_result)
+
+exact_dir = '.oracle'
+exact_oracle = oracle.Oracle(cache_dir=exact_dir)
+
+def get_exact_answer(corename, args, ctx=ctx_double):
+    """Correctly rounded answer for one of the cores, from the adaptive precision oracle
+    (and its cache in exact_dir, shared by every sweep of the same benchmark).
+    """
+    return exact_oracle.answer(cores[corename], args, ctx)
+
+
+double_samplers = {}
+
+def gen_random_double_arguments(core, seed=None):
+    """Random doubles for the inputs of core that satisfy its precondition,
+    drawn in batches (with the precondition narrowing the ranges) by a sampler kept per core.
+
+    Encodings are drawn uniformly, including the infinities, like random_float64,
+    except that NaN is never drawn (random_float64 produced one about once in 2000 draws).
+    A core's sampler is seeded from the random module when it is created,
+    so random.seed makes the arguments reproducible; giving seed starts it over from that seed.
+    """
+    key = id(core)
+    if seed is not None or key not in double_samplers:
+        if seed is None:
+            seed = random.getrandbits(64)
+        double_samplers[key] = sampler.InputSampler(core, ctx_double, finite=False, seed=seed, pre_ctx=ctx512)
+    return double_samplers[key].draw()
 
 
 def run_example(corename, n):
@@ -0,0 +1,203 @@
+"""Adaptive precision reference answers, cached on disk.
+
+Accuracy measurements need a reference answer for each input, and the usual way
+to get one is to evaluate the core again at some fixed high precision.
+That either wastes time on bits that make no difference, or, for nasty inputs,
+silently isn't precise enough.
+
+An Oracle evaluates the core at increasing precisions instead, Ziv style,
+doubling the precision each time, until the result rounded to the target context
+comes out the same at two precisions in a row. The rounded answer (and the precision
+that was needed to get it) is cached in memory, and in a directory on disk if one is given,
+keyed by a hash of the core, the exact encodings of the arguments, and the target context.
+So every accuracy sweep of the same benchmark reuses the same answers.
+
+The cache has one file per core, oracle_<hash>.jsonl, with one answer per line,
+appended with a single write, so several processes can share a cache directory.
+"""
+
+import os
+import json
+import hashlib
+
+from .fpbench import fpcast as ast
+from .titanic import digital
+from .titanic import ndarray
+from .arithmetic import ieee754
+from .arithmetic import mpmf
+
+
+def encode_value(x):
+    """Exact, normalized encoding of a result, as something JSON can store."""
+    if isinstance(x, bool) or x is None:
+        return x
+    elif isinstance(x, ndarray.NDArray):
+        return {'shape': list(x.shape), 'data': [encode_value(elt) for elt in x.data]}
+    elif isinstance(x, digital.Digital):
+        c, exp = x.c, x.exp
+        if x.isinf or x.isnan or c == 0:
+            c, exp = 0, 0
+        else:
+            tz = (c & -c).bit_length() - 1
+            c >>= tz
+            exp += tz
+        return [bool(x.negative), c, exp, bool(x.isinf), bool(x.isnan)]
+    else:
+        raise ValueError(f'cannot encode result {x!r}')
+
+def decode_value(enc, ctx):
+    if isinstance(enc, bool) or enc is None:
+        return enc
+    elif isinstance(enc, dict):
+        return ndarray.NDArray(shape=tuple(enc['shape']), data=[decode_value(elt, ctx) for elt in enc['data']])
+    else:
+        negative, c, exp, isinf, isnan = enc
+        return mpmf.MPMF(negative=negative, c=c, exp=exp, isinf=isinf, isnan=isnan, inexact=False, ctx=ctx)
+
+def arg_key(arg):
+    """Exact encoding of an argument as a string."""
+    if isinstance(arg, digital.Digital):
+        return 'd' + json.dumps(encode_value(arg))
+    elif isinstance(arg, ast.Expr):
+        return 'e' + str(arg)
+    elif isinstance(arg, ndarray.NDArray):
+        return f'a{list(arg.shape)!r}[' + ','.join(arg_key(elt) for elt in arg.data) + ']'
+    elif isinstance(arg, (list, tuple)):
+        return '[' + ','.join(arg_key(elt) for elt in arg) + ']'
+    else:
+        return 'r' + repr(arg)
+
+def core_digest(core):
+    return hashlib.sha1(str(core).encode('utf-8')).hexdigest()[:16]
+
+
+def exact_arg(arg):
+    """Digital arguments are taken as exact values, so they can be widened to any precision."""
+    if isinstance(arg, digital.Digital):
+        return digital.Digital(arg, inexact=False, rounded=False)
+    elif isinstance(arg, ndarray.NDArray):
+        return ndarray.NDArray(shape=arg.shape, data=[exact_arg(elt) for elt in arg.data])
+    elif isinstance(arg, list):
+        return [exact_arg(elt) for elt in arg]
+    else:
+        return arg
+
+def round_result(x, ctx):
+    if isinstance(x, ndarray.NDArray):
+        return ndarray.NDArray(shape=x.shape, data=[round_result(elt, ctx) for elt in x.data])
+    elif isinstance(x, digital.Digital):
+        return mpmf.MPMF._round_to_context(x, ctx=ctx)
+    else:
+        return x
+
+
+class Oracle(object):
+    """Correctly rounded (as far as Ziv's strategy can tell) answers for cores.
+
+    Reference evaluations use IEEE 754-like contexts with es exponent bits,
+    starting with 64 more bits of precision than the target (or start_prec),
+    and giving up at max_prec, in which case the answer is marked as not stable.
+    """
+
+    def __init__(self, cache_dir=None, es=20, start_prec=None, max_prec=1 << 16, verbosity=0):
+        self.cache_dir = cache_dir
+        self.es = es
+        self.start_prec = start_prec
+        self.max_prec = max_prec
+        self.verbosity = verbosity
+        self.tables = {}
+
+    def _fname(self, digest):
+        return os.path.join(self.cache_dir, f'oracle_{digest}.jsonl')
+
+    def _table(self, digest):
+        table = self.tables.get(digest)
+        if table is None:
+            table = {}
+            if self.cache_dir is not None and os.path.exists(self._fname(digest)):
+                with open(self._fname(digest), 'rt') as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            # a line cut short by a crash
+                            continue
+                        table[(record['args'], record['ctx'])] = record
+            self.tables[digest] = table
+        return table
+
+    def _store(self, digest, record):
+        self._table(digest)[(record['args'], record['ctx'])] = record
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            line = (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+            fd = os.open(self._fname(digest), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+
+    def ref_ctx(self, prec):
+        return ieee754.ieee_ctx(self.es, self.es + prec)
+
+    def evaluate(self, core, args, prec):
+        evaltor = mpmf.Interpreter()
+        return evaltor.interpret(core, exact_arg(list(args)), ctx=self.ref_ctx(prec))
+
+    def search(self, core, args, ctx):
+        """Evaluate core on args at increasing precision, until the result rounded to ctx
+        is the same at two precisions in a row.
+        Returns the rounded result, the precision it took, and whether it was stable;
+        or None if the arguments don't satisfy the precondition.
+        """
+        target_p = getattr(ctx, 'p', ctx.nbits)
+        if self.start_prec is None:
+            prec = target_p + 64
+        else:
+            prec = self.start_prec
+
+        if core.pre is not None:
+            evaltor = mpmf.Interpreter()
+            if not evaltor.interpret_pre(core, exact_arg(list(args)), ctx=self.ref_ctx(prec)):
+                return None
+
+        prev = None
+        while True:
+            result = round_result(self.evaluate(core, args, prec), ctx)
+            enc = encode_value(result)
+            if prev is not None and enc == prev:
+                return result, prec, True
+            if prec >= self.max_prec:
+                if self.verbosity >= 1:
+                    print(f'oracle: no stable answer up to {prec:d} bits for {core.name or core.ident!s} on {arg_key(args)}')
+                return result, prec, False
+            prev = enc
+            prec = min(prec * 2, self.max_prec)
+
+    def answer_info(self, core, args, ctx):
+        """The rounded answer, the precision it needed, and whether it was stable,
+        from the cache if possible. None if the arguments don't satisfy the precondition.
+        """
+        digest = core_digest(core)
+        key = (arg_key(args), ctx.propstr())
+        record = self._table(digest).get(key)
+        if record is None:
+            found = self.search(core, args, ctx)
+            record = {'args': key[0], 'ctx': key[1]}
+            if found is None:
+                record['pre'] = False
+            else:
+                result, prec, stable = found
+                record.update(pre=True, answer=encode_value(result), prec=prec, stable=stable)
+            self._store(digest, record)
+
+        if not record['pre']:
+            return None
+        return decode_value(record['answer'], ctx), record['prec'], record['stable']
+
+    def answer(self, core, args, ctx):
+        """Answer for core on args, rounded to ctx, or None if the precondition fails."""
+        info = self.answer_info(core, args, ctx)
+        if info is None:
+            return None
+        return info[0]
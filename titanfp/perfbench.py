@@ -0,0 +1,436 @@
+"""Performance benchmarks for Titanic's hot paths, with regression tracking.
+
+Each benchmark is a setup function, registered with @benchmark, that builds
+its inputs and returns a callable to time. The timings follow timeit:
+the number of loops is chosen so that one repeat takes at least min_time seconds,
+garbage collection is off while timing, and each repeat is reported as seconds per call.
+
+Micro-benchmarks cover rounding (Digital.round_new and each number system's
+_round_to_context), gmpmath.compute for each opcode, EvalCtx.let and NDArray views;
+macro-benchmarks cover parsing FPCores, evaluating a few representative cores
+with each interpreter, and one generation of a small QuantiFind search.
+
+Results are written as JSON, along with enough about the environment
+(Python, gmpy2, MPFR and NumPy versions, the machine, the git commit)
+to tell whether two result files are comparable. compare() lines up two
+result files, and flags benchmarks that got slower by more than a threshold.
+
+  python -m titanfp.perfbench list
+  python -m titanfp.perfbench run -o before.json
+  python -m titanfp.perfbench run -o after.json -k compute
+  python -m titanfp.perfbench compare before.json after.json --threshold 0.1
+"""
+
+import os
+import sys
+import re
+import gc
+import json
+import math
+import time
+import random
+import timeit
+import operator
+import platform
+import argparse
+import statistics
+import subprocess
+import collections
+
+import numpy
+import gmpy2
+
+from .titanic import digital, gmpmath, ndarray
+from .titanic.ops import OP, RM
+from .fpbench import fpcparser
+from .arithmetic import evalctx, ieee754, posit, fixed, mpmf
+
+
+results_version = 1
+
+# name -> (group, setup function)
+benchmarks = collections.OrderedDict()
+
+def benchmark(name, group='micro'):
+    """Register a benchmark: the decorated function takes no arguments,
+    does any setup, and returns the callable to time.
+    """
+    def register(setup):
+        if name in benchmarks:
+            raise ValueError(f'duplicate benchmark {name!r}')
+        benchmarks[name] = (group, setup)
+        return setup
+    return register
+
+
+# rounding
+
+_ctx64 = ieee754.ieee_ctx(11, 64)
+_ctx32 = ieee754.ieee_ctx(8, 32)
+_posit32 = posit.posit_ctx(2, 32)
+_fixed32 = fixed.fixed_ctx(-16, 32)
+
+def _unrounded_values(n=64, seed=0):
+    """Results of gmpmath.compute with the extra bit and result code set, ready to round."""
+    rng = random.Random(seed)
+    values = []
+    for _ in range(n):
+        a = digital.Digital(m=rng.randrange(-(1 << 53), 1 << 53), exp=rng.randint(-60, 0))
+        b = digital.Digital(m=rng.randrange(1, 1 << 53), exp=rng.randint(-60, 0))
+        values.append(gmpmath.compute(OP.div, a, b, prec=64))
+    return values
+
+@benchmark('digital.round_new')
+def bench_round_new():
+    values = _unrounded_values()
+    def run():
+        for x in values:
+            x.round_new(max_p=24, rm=RM.RNE)
+    return run
+
+def _round_to_context_bench(cls, ctx):
+    def setup():
+        values = _unrounded_values()
+        def run():
+            for x in values:
+                cls._round_to_context(x, ctx=ctx, strict=False)
+        return run
+    return setup
+
+benchmark('ieee754.round_to_context')(_round_to_context_bench(ieee754.Float, _ctx32))
+benchmark('posit.round_to_context')(_round_to_context_bench(posit.Posit, _posit32))
+benchmark('fixed.round_to_context')(_round_to_context_bench(fixed.Fixed, _fixed32))
+
+
+# gmpmath.compute, for each opcode
+
+_compute_ops = {
+    OP.neg: 1, OP.fabs: 1, OP.sqrt: 1, OP.cbrt: 1,
+    OP.add: 2, OP.sub: 2, OP.mul: 2, OP.div: 2, OP.fmod: 2, OP.pow: 2, OP.hypot: 2, OP.atan2: 2,
+    OP.fma: 3,
+    OP.exp: 1, OP.exp2: 1, OP.expm1: 1, OP.log: 1, OP.log2: 1, OP.log1p: 1,
+    OP.sin: 1, OP.cos: 1, OP.tan: 1, OP.asin: 1, OP.acos: 1, OP.atan: 1,
+    OP.sinh: 1, OP.cosh: 1, OP.tanh: 1, OP.erf: 1, OP.lgamma: 1,
+}
+
+def _compute_args(nargs, n=32, seed=0):
+    rng = random.Random(seed)
+    # in (0, 1), so every opcode has real results
+    return [tuple(digital.Digital(m=rng.randrange(1, 1 << 53), exp=-53) for _ in range(nargs))
+            for _ in range(n)]
+
+def _compute_bench(op, nargs):
+    def setup():
+        args = _compute_args(nargs)
+        def run():
+            for a in args:
+                gmpmath.compute(op, *a, prec=53)
+        return run
+    return setup
+
+for _op, _nargs in _compute_ops.items():
+    benchmark(f'gmpmath.compute.{_op.name}')(_compute_bench(_op, _nargs))
+
+
+# contexts and arrays
+
+@benchmark('evalctx.let.props')
+def bench_let_props():
+    ctx = evalctx.IEEECtx(es=11, nbits=64)
+    props = {'precision': 'binary32', 'round': 'toZero'}
+    def run():
+        ctx.let(props=props)
+    return run
+
+@benchmark('evalctx.let.bindings')
+def bench_let_bindings():
+    ctx = evalctx.IEEECtx(es=11, nbits=64)
+    bindings = [(f'x{i:d}', ieee754.Float(i, ctx=ctx)) for i in range(8)]
+    def run():
+        ctx.let(bindings=bindings)
+    return run
+
+@benchmark('ndarray.reify')
+def bench_reify():
+    a = ndarray.NDArray(shape=(32, 32, 4), data=range(32 * 32 * 4))
+    def run():
+        for i in range(32):
+            a[i].reify()
+    return run
+
+@benchmark('ndarray.from_nested')
+def bench_from_nested():
+    nested = [[[k + 4 * (j + 32 * i) for k in range(4)] for j in range(32)] for i in range(32)]
+    def run():
+        ndarray.NDArray(nested)
+    return run
+
+
+# whole cores
+
+core_texts = collections.OrderedDict([
+    ('sqrt_diff', '(FPCore (x) :pre (>= x 0) (- (sqrt (+ x 1)) (sqrt x)))'),
+    ('quadratic', '(FPCore (a b c) (/ (+ (- b) (sqrt (- (* b b) (* 4 (* a c))))) (* 2 a)))'),
+    ('sin_diff', '(FPCore (x eps) (- (sin (+ x eps)) (sin x)))'),
+    ('harmonic', '(FPCore (n) (while (< i n) ([i 1 (+ i 1)] [s 0 (+ s (/ 1 i))]) s))'),
+])
+
+core_args = {
+    'sqrt_diff': [3.5],
+    'quadratic': [1.5, 1e4, 0.75],
+    'sin_diff': [0.5, 1e-9],
+    'harmonic': [64],
+}
+
+# interpreter, and the context to run it in
+backends = collections.OrderedDict([
+    ('ieee754', (ieee754.Interpreter, _ctx64)),
+    ('posit', (posit.Interpreter, _posit32)),
+    ('mpmf', (mpmf.Interpreter, _ctx64)),
+])
+
+@benchmark('fpcparser.compile', group='macro')
+def bench_compile():
+    texts = list(core_texts.values())
+    def run():
+        for text in texts:
+            fpcparser.compile1(text)
+    return run
+
+def _evaluate_bench(backend, name):
+    def setup():
+        interpreter_cls, ctx = backends[backend]
+        evaltor = interpreter_cls()
+        core = fpcparser.compile1(core_texts[name])
+        args = core_args[name]
+        def run():
+            evaltor.interpret(core, args, ctx=ctx)
+        return run
+    return setup
+
+for _backend in backends:
+    for _name in core_texts:
+        benchmark(f'evaluate.{_backend}.{_name}', group='macro')(_evaluate_bench(_backend, _name))
+
+
+# one generation of a small search, with evaluations run in process,
+# so that this measures the search driver rather than the pool
+
+def _qf_eval(a, b):
+    return a + b, abs(a - b) * b
+
+class _DoneResult(object):
+    def __init__(self, value):
+        self.value = value
+
+    def get(self, timeout=None):
+        return self.value
+
+class _InlineExecutor(object):
+    workers = 1
+
+    def apply_async(self, fn, args):
+        return _DoneResult(fn(*args))
+
+@benchmark('quantifind.generation', group='macro')
+def bench_qf_generation():
+    from .quantifind import search, utils
+    inits, neighbors = zip(*[utils.integer_neighborhood(0, 255, 2) for _ in range(2)])
+    executor = _InlineExecutor()
+    def run():
+        random.seed(0)
+        sweep = search.Sweep(_qf_eval, inits, neighbors, (operator.lt, operator.gt),
+                             settings=search.SearchSettings(profile='balanced'), verbosity=-1)
+        sweep.explore_randomly(64)
+        sweep.run_generation(pool=executor)
+        sweep.expand_horizon()
+        sweep.run_generation(pool=executor)
+    return run
+
+
+# running
+
+def environment():
+    """Metadata about where the benchmarks ran."""
+    env = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'hostname': platform.node(),
+        'gmpy2': gmpy2.version(),
+        'mpfr': gmpy2.mpfr_version(),
+        'numpy': numpy.__version__,
+        'argv': sys.argv,
+    }
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        env['git_commit'] = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=here, capture_output=True,
+                                           text=True, check=True).stdout.strip()
+        env['git_dirty'] = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=here,
+                                               capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        env['git_commit'] = None
+        env['git_dirty'] = None
+    return env
+
+def time_benchmark(name, min_time=0.2, repeat=5):
+    group, setup = benchmarks[name]
+    fn = setup()
+    timer = timeit.Timer(fn)
+    # like timeit.Timer.autorange, but with our own target time
+    loops = 1
+    while True:
+        if timer.timeit(loops) >= min_time:
+            break
+        loops *= 2 if loops < 8 else 10
+    times = [t / loops for t in timer.repeat(repeat=repeat, number=loops)]
+    return {
+        'group': group,
+        'loops': loops,
+        'times': times,
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+        'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+    }
+
+def select(pattern=None, groups=None):
+    names = []
+    for name, (group, setup) in benchmarks.items():
+        if groups is not None and group not in groups:
+            continue
+        if pattern is not None and not re.search(pattern, name):
+            continue
+        names.append(name)
+    return names
+
+def run(names=None, min_time=0.2, repeat=5, verbosity=1):
+    """Time the named benchmarks (or all of them), and return the results as a JSON-able dict."""
+    if names is None:
+        names = list(benchmarks)
+    results = collections.OrderedDict()
+    for name in names:
+        try:
+            results[name] = time_benchmark(name, min_time=min_time, repeat=repeat)
+        except Exception as e:
+            results[name] = {'group': benchmarks[name][0], 'error': f'{type(e).__name__}: {e!s}'}
+        if verbosity >= 1:
+            print(f'{name:40s} {describe_result(results[name])}', flush=True)
+        gc.collect()
+    return {
+        'version': results_version,
+        'environment': environment(),
+        'settings': {'min_time': min_time, 'repeat': repeat},
+        'results': results,
+    }
+
+def describe_time(t):
+    for unit, scale in (('s', 1.0), ('ms', 1e-3), ('us', 1e-6)):
+        if t >= scale:
+            return f'{t / scale:.3f} {unit}'
+    return f'{t / 1e-9:.1f} ns'
+
+def describe_result(result):
+    if 'error' in result:
+        return 'error: ' + result['error']
+    rel = result['stdev'] / result['mean'] if result['mean'] > 0 else 0.0
+    return f'{describe_time(result["median"]):>12s} +- {rel:.1%}  (min {describe_time(result["min"])}, {result["loops"]:d} loops)'
+
+
+# comparing
+
+def load(fname):
+    with open(fname, 'rt') as f:
+        data = json.load(f)
+    if data.get('version') != results_version:
+        raise ValueError(f'unsupported benchmark results version {data.get("version")!r} in {fname!r}')
+    return data
+
+env_keys = ('python', 'implementation', 'machine', 'processor', 'gmpy2', 'mpfr', 'numpy')
+
+def compare(old, new, threshold=0.1, stat='median', verbosity=1):
+    """Compare two result dicts (from run or load), benchmark by benchmark.
+
+    A benchmark is a regression if its time (the given statistic) grew by more than threshold,
+    relative to the old time, and also by more than the larger of the two standard deviations,
+    so noisy benchmarks have to move further to count. Returns the list of regressions,
+    as (name, old time, new time).
+    """
+    if verbosity >= 1:
+        for key in env_keys:
+            a = old['environment'].get(key)
+            b = new['environment'].get(key)
+            if a != b:
+                print(f'warning: environments differ in {key}: {a!r} vs {b!r}')
+        print(f'comparing {old["environment"].get("git_commit")} to {new["environment"].get("git_commit")}, by {stat}:')
+
+    regressions = []
+    for name, new_result in new['results'].items():
+        old_result = old['results'].get(name)
+        if old_result is None or 'error' in old_result or 'error' in new_result:
+            if verbosity >= 1:
+                print(f'  {name:40s} (not comparable)')
+            continue
+
+        old_t = old_result[stat]
+        new_t = new_result[stat]
+        ratio = new_t / old_t if old_t > 0 else math.inf
+        noise = max(old_result['stdev'], new_result['stdev'])
+        if ratio > 1 + threshold and new_t - old_t > noise:
+            verdict = 'REGRESSION'
+            regressions.append((name, old_t, new_t))
+        elif ratio < 1 / (1 + threshold) and old_t - new_t > noise:
+            verdict = 'faster'
+        else:
+            verdict = ''
+        if verbosity >= 1:
+            print(f'  {name:40s} {describe_time(old_t):>12s} -> {describe_time(new_t):>12s}  {ratio:6.2f}x  {verdict}')
+
+    if verbosity >= 1:
+        print(f'{len(regressions):d} regressions')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Titanic, and compare benchmark results.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = subparsers.add_parser('list', help='list the benchmarks')
+    list_parser.add_argument('-k', dest='pattern', default=None, help='only benchmarks whose names match this regex')
+
+    run_parser = subparsers.add_parser('run', help='run benchmarks')
+    run_parser.add_argument('-o', '--output', default=None, help='write results to this JSON file')
+    run_parser.add_argument('-k', dest='pattern', default=None, help='only benchmarks whose names match this regex')
+    run_parser.add_argument('--group', action='append', choices=['micro', 'macro'], default=None)
+    run_parser.add_argument('--min-time', type=float, default=0.2, help='minimum seconds per repeat')
+    run_parser.add_argument('--repeat', type=int, default=5)
+
+    compare_parser = subparsers.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='relative slowdown that counts as a regression')
+    compare_parser.add_argument('--stat', choices=['min', 'median', 'mean'], default='median')
+
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for name in select(args.pattern):
+            print(f'{name:40s} {benchmarks[name][0]}')
+    elif args.command == 'run':
+        data = run(select(args.pattern, args.group), min_time=args.min_time, repeat=args.repeat)
+        if args.output is not None:
+            with open(args.output, 'wt') as f:
+                json.dump(data, f, indent=1)
+                print(file=f)
+    elif args.command == 'compare':
+        regressions = compare(load(args.old), load(args.new), threshold=args.threshold, stat=args.stat)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""Vectorized accuracy metrics, over whole arrays of results at once.
+
+Comparing results one element at a time with gmpmath.geo_sim costs an MPFR context
+and a few arbitrary precision operations per element. When every value involved
+fits exactly in a float64 (which is the case for the results of any context
+with at most 53 bits of precision and an 11 bit exponent), the same measures
+can be computed with NumPy over the whole array:
+
+  - geo_sim computes the difference a - b with an error-free transformation,
+    so the log of the ratio a / b is accurate even when a and b are very close.
+    The results are within about 1e-14 (relative) of the exact similarity;
+    gmpmath.geo_sim rounds the ratio first, so for very close values
+    these results are actually a little more accurate.
+  - linear_ulps works on integer significand and exponent arrays (from encode),
+    exactly like utils.linear_ulps; abs_ulps does the encoding for lists of values.
+
+to_float_array returns None for values that don't fit, so callers can fall back
+to the scalar functions.
+"""
+
+import math
+
+import numpy as np
+
+from ..arithmetic import nprounding
+
+
+def to_float_array(values):
+    """Exact float64 array of Titanic values, or None if some value can't be represented exactly."""
+    out = np.empty(len(values), dtype=np.float64)
+    for i, x in enumerate(values):
+        if x.isnan:
+            out[i] = math.nan
+        elif x.isinf:
+            out[i] = -math.inf if x.negative else math.inf
+        else:
+            c, exp = x.c, x.exp
+            if c == 0:
+                out[i] = -0.0 if x.negative else 0.0
+                continue
+            p = c.bit_length()
+            if p > 53 or exp + p > 1024 or exp < -1074:
+                return None
+            out[i] = math.ldexp(-c if x.negative else c, exp)
+    return out
+
+def encode(values):
+    """Signed integer significands and exponents of finite Titanic values, as int64 arrays,
+    such that each value is exactly m * 2**exp.
+    """
+    m = np.empty(len(values), dtype=np.int64)
+    exp = np.empty(len(values), dtype=np.int64)
+    for i, x in enumerate(values):
+        if not x.is_finite_real():
+            raise ValueError(f'cannot encode non-real value {x!s}')
+        if x.c.bit_length() > 62:
+            raise ValueError(f'significand of {x!s} is too wide to encode')
+        m[i] = x.m
+        exp[i] = x.exp
+    return m, exp
+
+
+def geo_sim(a, b):
+    """Geometric bit similarity (see gmpmath.geo_sim) of two float64 arrays, elementwise."""
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    a, b = np.broadcast_arrays(a, b)
+
+    with np.errstate(all='ignore'):
+        diff, _ = nprounding.two_sum(a, -b)
+        rel = diff / b
+        # near 1, log2(a / b) is computed from the (accurately rounded) relative difference;
+        # further away, the logs of the magnitudes are plenty accurate
+        near = np.abs(rel) <= 0.5
+        log_ratio = np.where(near, np.log1p(np.where(near, rel, 0.0)) / math.log(2),
+                             np.log2(np.abs(a)) - np.log2(np.abs(b)))
+        sim = -np.log2(np.abs(log_ratio))
+
+    a_zero = (a == 0)
+    b_zero = (b == 0)
+    sim = np.where(np.signbit(a) != np.signbit(b), -math.inf, sim)
+    sim = np.where(a_zero | b_zero, np.where(a_zero & b_zero, math.inf, -math.inf), sim)
+    sim = np.where(np.isinf(a) | np.isinf(b), np.where(np.isinf(a) & np.isinf(b), math.nan, -math.inf), sim)
+    sim = np.where(np.isnan(a) | np.isnan(b), math.nan, sim)
+    return sim
+
+def worst_and_avg_abits(a, b, p=None):
+    """Worst and average bits of agreement between two float64 arrays,
+    with each element's bits capped at p (if it is given).
+    Any non-real value makes both results -inf.
+    """
+    n = min(len(a), len(b))
+    a = np.asarray(a, dtype=np.float64)[:n]
+    b = np.asarray(b, dtype=np.float64)[:n]
+    if not (np.all(np.isfinite(a)) and np.all(np.isfinite(b))):
+        return -math.inf, -math.inf
+
+    abits = geo_sim(a, b)
+    if p is not None:
+        abits = np.minimum(abits, p)
+    # sum in order, like the scalar loop
+    return float(abits.min(initial=math.inf)), sum(abits.tolist()) / n
+
+
+def linear_ulps(m1, exp1, m2, exp2):
+    """Difference between the values m1 * 2**exp1 and m2 * 2**exp2, elementwise, in units
+    of the less significant of their last places, like utils.linear_ulps.
+    Returns an int64 array, or an object array of Python integers if the differences
+    don't all fit in 62 bits.
+    """
+    m1, exp1, m2, exp2 = np.broadcast_arrays(*(np.asarray(x, dtype=np.int64) for x in (m1, exp1, m2, exp2)))
+    emin = np.minimum(exp1, exp2)
+    shift1 = exp1 - emin
+    shift2 = exp2 - emin
+
+    # frexp of the magnitude gives its bit length, or one more near a power of two
+    _, bits1 = np.frexp(np.abs(m1).astype(np.float64))
+    _, bits2 = np.frexp(np.abs(m2).astype(np.float64))
+    fits = (bits1 + shift1 <= 61) & (bits2 + shift2 <= 61)
+
+    if np.all(fits):
+        return (m1 << shift1) - (m2 << shift2)
+
+    ulps = np.empty(m1.shape, dtype=object)
+    ulps[fits] = ((m1[fits] << shift1[fits]) - (m2[fits] << shift2[fits])).tolist()
+    for idx in zip(*np.nonzero(~fits)):
+        ulps[idx] = (int(m1[idx]) << int(shift1[idx])) - (int(m2[idx]) << int(shift2[idx]))
+    return ulps
+
+
+def abs_ulps(values, refs):
+    """abs(utils.linear_ulps(x, ref)) for each pair of finite Titanic values, as a list of Python integers.
+    Computed with linear_ulps when the values can be encoded, one pair at a time otherwise.
+    """
+    try:
+        m1, exp1 = encode(values)
+        m2, exp2 = encode(refs)
+    except ValueError:
+        ulps = []
+        for x, y in zip(values, refs):
+            emin = min(x.exp, y.exp)
+            ulps.append(abs((x.m << (x.exp - emin)) - (y.m << (y.exp - emin))))
+        return ulps
+    return [abs(int(u)) for u in linear_ulps(m1, exp1, m2, exp2).tolist()]
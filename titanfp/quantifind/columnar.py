@@ -0,0 +1,385 @@
+"""Columnar export of search state, for reading big searches without parsing JSON.
+
+An export is a directory of flat binary arrays, one file per column,
+plus a small meta.json that records the dtype, shape, and committed length of each one.
+Arrays only grow by appending to the end of their files, and meta.json is rewritten
+(atomically) after the data it describes, so a reader that opens the columns
+while a search is running always sees a consistent prefix.
+
+Columns:
+  history_cfg       (n, cfg_dim)  configuration parameters, as int64, float64,
+                                  or int64 codes into a table of other values
+  history_qos       (n, qos_dim)  float64 metrics; None is stored as nan
+  history_fidelity  (n,)          float64, nan for a plain (single fidelity) evaluation
+  flog_hidx         (f,)          int64 history index of each point in the frontier log
+  flog_replaced_by  (f,)          int64 frontier log index of the replacing point, or -1
+  generations       (g, 2)        int64 (horizon_size, new_frontier_points)
+
+If a later configuration doesn't fit the kind picked for its column (say a float
+turns up in an int column), the column is widened and history_cfg is rewritten
+under a new name, recorded in meta.json as cfg_file, so readers never see the
+old data with the new kinds.
+
+The replaced lists of the frontier log are the inverse of flog_replaced_by,
+and the current frontier is every point in the log that hasn't been replaced.
+meta.json also records the state's final_fidelity, so readers can tell which
+history entries come from partial evaluations (see search.partial_indices),
+and the search's settings, so readers don't need the JSON checkpoint for them.
+"""
+
+import os
+import json
+import math
+
+import numpy as np
+
+
+meta_name = 'meta.json'
+meta_version = 1
+
+
+def _column_kind(values):
+    """Pick a storage kind for one coordinate of the configurations: 'int', 'float', or 'code'."""
+    if all(isinstance(x, int) and not isinstance(x, bool) for x in values):
+        return 'int'
+    elif all(isinstance(x, (int, float)) and not isinstance(x, bool) for x in values):
+        return 'float'
+    else:
+        return 'code'
+
+def _widen_kind(kind, values):
+    """The narrowest kind that holds both what kind held and values."""
+    if kind == 'code':
+        return 'code'
+    new_kind = _column_kind(values)
+    if new_kind == 'code' or kind == new_kind:
+        return new_kind
+    else:
+        # one of them is int, the other float
+        return 'float'
+
+def _tuplify(x):
+    """Undo what JSON does to tuples in the code tables (they come back as lists)."""
+    if isinstance(x, (list, tuple)):
+        return tuple(_tuplify(y) for y in x)
+    else:
+        return x
+
+def _load_meta(path):
+    with open(os.path.join(path, meta_name), 'rt') as f:
+        meta = json.load(f)
+    if meta.get('version') == meta_version:
+        meta['cfg_codes'] = [[_tuplify(x) for x in table] for table in meta['cfg_codes']]
+    return meta
+
+def _decode_cfg(row, kinds, codes):
+    cfg = []
+    for j, kind in enumerate(kinds):
+        if kind == 'int':
+            cfg.append(int(row[j]))
+        elif kind == 'float':
+            cfg.append(float(row[j]))
+        else:
+            cfg.append(codes[j][int(row[j])])
+    return tuple(cfg)
+
+def _float_or_nan(x):
+    if x is None:
+        return math.nan
+    else:
+        return float(x)
+
+
+class ColumnarWriter(object):
+    """Incrementally export a SearchState to a directory of columns.
+    Call sync(state) whenever the state should be saved;
+    only new history and frontier log entries are appended.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.meta = None
+        self._stale_cfg_file = None
+        if os.path.exists(os.path.join(path, meta_name)):
+            self.meta = _load_meta(path)
+
+    def __repr__(self):
+        return f'<{type(self).__name__} object at {hex(id(self))} writing to {repr(self.path)}>'
+
+    def _file(self, name):
+        return os.path.join(self.path, name + '.bin')
+
+    def _append(self, name, arr):
+        with open(self._file(name), 'ab') as f:
+            f.write(np.ascontiguousarray(arr).tobytes())
+
+    def _truncate(self, name, nbytes):
+        # drop anything written after the last committed length, i.e. from an interrupted sync
+        fname = self._file(name)
+        if os.path.exists(fname) and os.path.getsize(fname) > nbytes:
+            with open(fname, 'r+b') as f:
+                f.truncate(nbytes)
+
+    def _replace(self, name, arr):
+        tmp = self._file(name) + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(np.ascontiguousarray(arr).tobytes())
+        os.replace(tmp, self._file(name))
+
+    def _write_meta(self):
+        tmp = os.path.join(self.path, meta_name + '.tmp')
+        with open(tmp, 'wt') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, os.path.join(self.path, meta_name))
+
+    def _encode_cfgs(self, cfgs):
+        kinds = self.meta['cfg_kinds']
+        codes = self.meta['cfg_codes']
+        arr = np.empty((len(cfgs), len(kinds)), dtype=np.int64 if 'float' not in kinds else np.float64)
+        for j, kind in enumerate(kinds):
+            if kind == 'code':
+                table = codes[j]
+                lookup = {repr(x): i for i, x in enumerate(table)}
+                for i, cfg in enumerate(cfgs):
+                    x = _tuplify(cfg[j])
+                    key = repr(x)
+                    if key not in lookup:
+                        lookup[key] = len(table)
+                        table.append(x)
+                    arr[i, j] = lookup[key]
+            else:
+                for i, cfg in enumerate(cfgs):
+                    arr[i, j] = cfg[j]
+        return arr
+
+    def _widen(self, cfgs, n_old):
+        """Widen the column kinds to fit cfgs, rewriting the n_old committed rows if any changed."""
+        kinds = self.meta['cfg_kinds']
+        new_kinds = [_widen_kind(kind, [cfg[j] for cfg in cfgs]) for j, kind in enumerate(kinds)]
+        if new_kinds == kinds:
+            return
+
+        cfg_dim = self.meta['cfg_dim']
+        old_file = self.meta.get('cfg_file', 'history_cfg')
+        old_rows = np.fromfile(self._file(old_file), dtype=self.meta['cfg_dtype'],
+                               count=n_old * cfg_dim).reshape((n_old, cfg_dim))
+        old_cfgs = [_decode_cfg(row, kinds, self.meta['cfg_codes']) for row in old_rows]
+
+        # codes for widened columns start over; the others keep theirs
+        self.meta['cfg_codes'] = [codes if kind == new_kind else []
+                                  for codes, kind, new_kind in zip(self.meta['cfg_codes'], kinds, new_kinds)]
+        self.meta['cfg_kinds'] = new_kinds
+        self.meta['cfg_dtype'] = 'float64' if 'float' in new_kinds else 'int64'
+        # the meta still on disk describes the old file, so write the new one under another name
+        self.meta['cfg_file'] = f'history_cfg.{self.meta.get("cfg_rewrites", 0) + 1}'
+        self.meta['cfg_rewrites'] = self.meta.get('cfg_rewrites', 0) + 1
+        self._replace(self.meta['cfg_file'], self._encode_cfgs(old_cfgs).astype(self.meta['cfg_dtype']))
+        self._stale_cfg_file = old_file
+
+    def _start(self, state):
+        cfg, qos = state.history[0]
+        kinds = [_column_kind([c[j] for c, q in state.history]) for j in range(len(cfg))]
+        self.meta = {
+            'version': meta_version,
+            'cfg_dim': len(cfg),
+            'qos_dim': len(qos),
+            'cfg_kinds': kinds,
+            # all the parameters share one array, so a single float parameter makes it all float
+            'cfg_dtype': 'float64' if 'float' in kinds else 'int64',
+            'cfg_codes': [[] for _ in kinds],
+            'lengths': {
+                'history': 0,
+                'flog': 0,
+                'generations': 0,
+            },
+        }
+        os.makedirs(self.path, exist_ok=True)
+        for name in ('history_cfg', 'history_qos', 'history_fidelity', 'flog_hidx', 'flog_replaced_by', 'generations'):
+            self._replace(name, np.empty((0,)))
+
+    def sync(self, state, settings=None):
+        """Bring the columns up to date with state.
+        The state's history and frontier log must only have grown since the last sync.
+        settings, if given, is the search's settings as a dict (from SearchSettings.to_dict),
+        which is kept in meta.json.
+        """
+        if self.meta is None:
+            if not state.history:
+                return
+            self._start(state)
+
+        lengths = self.meta['lengths']
+        cfg_dim = self.meta['cfg_dim']
+        qos_dim = self.meta['qos_dim']
+        n_old = lengths['history']
+        f_old = lengths['flog']
+
+        # clean up after an interrupted sync
+        self._truncate(self.meta.get('cfg_file', 'history_cfg'), n_old * cfg_dim * 8)
+        self._truncate('history_qos', n_old * qos_dim * 8)
+        self._truncate('history_fidelity', n_old * 8)
+        self._truncate('flog_hidx', f_old * 8)
+
+        new_history = state.history[n_old:]
+        if new_history:
+            cfgs = [cfg for cfg, qos in new_history]
+            if any(len(cfg) != cfg_dim for cfg in cfgs):
+                raise ValueError(f'configurations must all have {cfg_dim} parameters')
+            self._widen(cfgs, n_old)
+            self._append(self.meta.get('cfg_file', 'history_cfg'), self._encode_cfgs(cfgs).astype(self.meta['cfg_dtype']))
+            qos_arr = np.array([[_float_or_nan(x) for x in qos] for cfg, qos in new_history], dtype=np.float64)
+            self._append('history_qos', qos_arr.reshape((len(new_history), qos_dim)))
+            fidelities = getattr(state, 'fidelities', [])
+            fid_arr = np.array([_float_or_nan(fidelities[i]) if i < len(fidelities) else math.nan
+                                for i in range(n_old, len(state.history))], dtype=np.float64)
+            self._append('history_fidelity', fid_arr)
+
+        new_flog = state.frontier_log[f_old:]
+        if new_flog:
+            hidxs = []
+            for (cfg, qos), replaced, replaced_by in new_flog:
+                record = state.cache.get(cfg)
+                if record is None or record[0] is None:
+                    hidxs.append(-1)
+                else:
+                    hidxs.append(record[0])
+            self._append('flog_hidx', np.array(hidxs, dtype=np.int64))
+
+        # replaced_by changes for old entries, but it's one integer per frontier point
+        replaced_by = np.array([-1 if replaced_by is None else replaced_by
+                                for result, replaced, replaced_by in state.frontier_log], dtype=np.int64)
+        self._replace('flog_replaced_by', replaced_by)
+        self._replace('generations', np.array(state.generations, dtype=np.int64).reshape((len(state.generations), 2)))
+
+        self.meta['final_fidelity'] = getattr(state, 'final_fidelity', None)
+        if settings is not None:
+            self.meta['settings'] = settings
+        lengths['history'] = len(state.history)
+        lengths['flog'] = len(state.frontier_log)
+        lengths['generations'] = len(state.generations)
+        self._write_meta()
+
+        if self._stale_cfg_file is not None:
+            os.remove(self._file(self._stale_cfg_file))
+            self._stale_cfg_file = None
+
+
+class _HistoryView(object):
+    """Read-only sequence of (cfg, qos) tuples, decoded on demand from the columns,
+    so that code written for SearchState.history works unchanged.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return self.data.n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('history index out of range')
+        return self.data.cfg(i), self.data.qos(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class ColumnarData(object):
+    """Memory-mapped reader for a columnar export.
+    The arrays are available directly (history_cfg, history_qos, ...),
+    and history, frontier, frontier_log, and generations mimic a SearchState.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.refresh()
+
+    def __repr__(self):
+        return f'<{type(self).__name__} object at {hex(id(self))} with {self.n} configurations>'
+
+    @staticmethod
+    def is_export(path):
+        return os.path.isfile(os.path.join(path, meta_name))
+
+    def _map(self, name, dtype, shape):
+        if shape[0] == 0:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, name + '.bin'), dtype=dtype, mode='r', shape=shape)
+
+    def refresh(self):
+        """Re-map the columns, to pick up anything appended since they were opened."""
+        self.meta = _load_meta(self.path)
+        if self.meta['version'] != meta_version:
+            raise ValueError(f'unknown columnar export version {self.meta["version"]!r}')
+
+        lengths = self.meta['lengths']
+        self.n = lengths['history']
+        cfg_dim = self.meta['cfg_dim']
+        qos_dim = self.meta['qos_dim']
+        n_flog = lengths['flog']
+        n_gens = lengths['generations']
+
+        self.history_cfg = self._map(self.meta.get('cfg_file', 'history_cfg'), self.meta['cfg_dtype'], (self.n, cfg_dim))
+        self.history_qos = self._map('history_qos', np.float64, (self.n, qos_dim))
+        self.history_fidelity = self._map('history_fidelity', np.float64, (self.n,))
+        self.flog_hidx = self._map('flog_hidx', np.int64, (n_flog,))
+        # the replaced_by column can be rewritten by the writer, so read a copy
+        self.flog_replaced_by = np.fromfile(os.path.join(self.path, 'flog_replaced_by.bin'),
+                                            dtype=np.int64, count=n_flog)
+        self.generation_records = np.fromfile(os.path.join(self.path, 'generations.bin'),
+                                              dtype=np.int64, count=n_gens * 2).reshape((n_gens, 2))
+
+    # decoding individual records
+
+    def cfg(self, i):
+        return _decode_cfg(self.history_cfg[i], self.meta['cfg_kinds'], self.meta['cfg_codes'])
+
+    def qos(self, i):
+        return tuple(float(x) for x in self.history_qos[i])
+
+    # SearchState-like interface
+
+    @property
+    def history(self):
+        return _HistoryView(self)
+
+    @property
+    def fidelities(self):
+        return [None if math.isnan(x) else x for x in self.history_fidelity]
+
+    @property
+    def final_fidelity(self):
+        return self.meta.get('final_fidelity', None)
+
+    @property
+    def settings(self):
+        """The search's settings as a dict, or None if the export doesn't have them."""
+        return self.meta.get('settings', None)
+
+    @property
+    def generations(self):
+        return [tuple(int(x) for x in row) for row in self.generation_records]
+
+    @property
+    def frontier_log(self):
+        replaced = [[] for _ in range(len(self.flog_hidx))]
+        for i, replaced_by in enumerate(self.flog_replaced_by):
+            if replaced_by >= 0:
+                replaced[replaced_by].append(i)
+        return [[self.history[int(hidx)], replaced[i], None if replaced_by < 0 else int(replaced_by)]
+                for i, (hidx, replaced_by) in enumerate(zip(self.flog_hidx, self.flog_replaced_by))]
+
+    @property
+    def frontier_hidxs(self):
+        """History indices of the points on the current frontier, as an array."""
+        hidxs = np.asarray(self.flog_hidx)
+        return hidxs[(self.flog_replaced_by < 0) & (hidxs >= 0)]
+
+    @property
+    def frontier(self):
+        return [self.history[int(hidx)] for hidx in self.frontier_hidxs]
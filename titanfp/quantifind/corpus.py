@@ -0,0 +1,172 @@
+"""Shared corpora of test vectors for sweeps.
+
+Sweeps over random vectors (like the dot products in ex_dotprod) should evaluate every
+configuration on the same inputs. A VectorCorpus generates all of the trial vectors once,
+for a given length, context, and seed, with its own random number generator,
+and stores them as integer significands and exponents in one flat array.
+
+The array lives in a multiprocessing.shared_memory block, or in a .npy file if a directory
+is given (in which case it is also reused by later runs with the same parameters).
+Pickling a corpus only sends the name of the block or file, so worker processes
+map the same memory rather than getting a copy of a big list of MPMF objects.
+Vectors are decoded into MPMF values when they are first used in each process.
+"""
+
+import os
+import random
+import hashlib
+
+import numpy as np
+from multiprocessing import shared_memory
+
+from ..titanic import ndarray
+from ..arithmetic import mpmf
+
+
+# each value is stored as the pair (m, exp), for the exact value m * 2**exp
+entry_dtype = np.dtype([('m', '<i8'), ('exp', '<i8')])
+
+
+def encode_value(x):
+    if not x.is_finite_real():
+        raise ValueError(f'cannot encode non-real value {x!s}')
+    if x.c.bit_length() > 62:
+        raise ValueError(f'significand of {x!s} is too wide to encode')
+    return x.m, x.exp
+
+def decode_vector(entries, ctx):
+    return ndarray.NDArray([mpmf.MPMF(m=int(m), exp=int(exp), ctx=ctx) for m, exp in entries.tolist()])
+
+
+def generate(n, trials, ctx, seed=0, signed=True, groups=2):
+    """Encoded array of shape (groups, trials, n): groups of trial vectors,
+    with elements uniform in [0, 1) (or (-1, 1) if signed), rounded to ctx.
+    The result only depends on the arguments.
+    """
+    rng = random.Random(seed)
+    data = np.empty((groups, trials, n), dtype=entry_dtype)
+    for g in range(groups):
+        for t in range(trials):
+            for i in range(n):
+                if signed:
+                    x = rng.random() if rng.randint(0, 1) else -rng.random()
+                else:
+                    x = rng.random()
+                data[g, t, i] = encode_value(mpmf.MPMF(x, ctx=ctx))
+    return data
+
+
+class VectorCorpus(object):
+    """groups x trials vectors of length n, shared between processes.
+
+    Make a new one with VectorCorpus.create, and release it when done
+    (or use it in a with statement).
+    vectors(g) is the list of decoded vectors in group g.
+    """
+
+    def __init__(self, key, shape, ctx, shm=None, path=None, owner=False):
+        self.key = key
+        self.shape = tuple(shape)
+        self.ctx = ctx
+        self.shm = shm
+        self.path = path
+        self.owner = owner
+        if shm is not None:
+            self.raw = np.ndarray(self.shape, dtype=entry_dtype, buffer=shm.buf)
+        else:
+            self.raw = np.load(path, mmap_mode='r')
+            if self.raw.shape != self.shape or self.raw.dtype != entry_dtype:
+                raise ValueError(f'corpus file {path!r} has the wrong shape or type')
+        self._decoded = {}
+
+    @classmethod
+    def create(cls, n, trials, ctx, seed=0, signed=True, groups=2, corpus_dir=None):
+        """Generate a corpus, in shared memory, or in a .npy file in corpus_dir.
+        An existing file for the same parameters is reused.
+        """
+        key = f'{groups:d} {trials:d} {n:d} {ctx.propstr()} {seed!r} {signed!r}'
+        shape = (groups, trials, n)
+
+        if corpus_dir is None:
+            data = generate(n, trials, ctx, seed=seed, signed=signed, groups=groups)
+            shm = shared_memory.SharedMemory(create=True, size=max(1, data.nbytes))
+            corpus = cls(key, shape, ctx, shm=shm, owner=True)
+            corpus.raw[...] = data
+            return corpus
+
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        path = os.path.join(corpus_dir, f'corpus_{digest}.npy')
+        if not os.path.exists(path):
+            os.makedirs(corpus_dir, exist_ok=True)
+            data = generate(n, trials, ctx, seed=seed, signed=signed, groups=groups)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, data)
+            os.replace(tmp_path, path)
+        return cls(key, shape, ctx, path=path)
+
+    def __repr__(self):
+        where = self.shm.name if self.shm is not None else self.path
+        return f'<{type(self).__name__} {self.key} at {where!r}>'
+
+    # only the name of the memory travels between processes
+
+    def __getstate__(self):
+        return {
+            'key': self.key,
+            'shape': self.shape,
+            'ctx': self.ctx,
+            'shm_name': self.shm.name if self.shm is not None else None,
+            'path': self.path,
+        }
+
+    def __setstate__(self, state):
+        if state['shm_name'] is not None:
+            # worker processes share the resource tracker of the process that made the block,
+            # so attaching here doesn't change when it gets cleaned up
+            shm = shared_memory.SharedMemory(name=state['shm_name'])
+        else:
+            shm = None
+        self.__init__(state['key'], state['shape'], state['ctx'], shm=shm, path=state['path'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def close(self):
+        self._decoded = {}
+        self.raw = None
+        if self.shm is not None:
+            self.shm.close()
+
+    def unlink(self):
+        if self.shm is not None:
+            self.shm.unlink()
+
+    def release(self):
+        """Close the corpus, and free its shared memory if this process made it."""
+        self.close()
+        if self.owner:
+            self.unlink()
+
+    @property
+    def groups(self):
+        return self.shape[0]
+
+    @property
+    def trials(self):
+        return self.shape[1]
+
+    @property
+    def n(self):
+        return self.shape[2]
+
+    def vector(self, g, t):
+        return decode_vector(self.raw[g, t], self.ctx)
+
+    def vectors(self, g):
+        if g not in self._decoded:
+            self._decoded[g] = [self.vector(g, t) for t in range(self.trials)]
+        return self._decoded[g]
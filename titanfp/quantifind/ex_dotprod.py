@@ -4,12 +4,15 @@ import operator
 import math
 import random
 import traceback
+import itertools
 
 from ..titanic import ndarray, gmpmath
 from ..fpbench import fpcparser
 from ..arithmetic import mpmf, ieee754, posit, fixed, evalctx, analysis
 
 from . import search
+from . import corpus
+from . import accuracy
 from .utils import *
 from .benchmarks import mk_dotprod
 
@@ -105,20 +108,23 @@ class DotprodSettings(object):
         self.trials = None
         self.n = None
         self.signed = None
-        self.As = None
-        self.Bs = None
+        self.seed = None
+        self.corpus = None
         self.refs = None
         self.real_refs = None
         self.template = None
         self.overall_ctx = None
         self.mul_ctx = None
 
-    def cfg(self, trials, n, ctx, template, signed=True):
+    def cfg(self, trials, n, ctx, template, signed=True, seed=0, corpus_dir=None):
         self.trials = trials
         self.n = n
         self.signed = signed
-        self.As = [rand_vec(n, ctx=ctx, signed=signed) for _ in range(trials)]
-        self.Bs = [rand_vec(n, ctx=ctx, signed=signed) for _ in range(trials)]
+        self.seed = seed
+        # every configuration sees the same inputs, which workers read from shared memory
+        if self.corpus is not None:
+            self.corpus.release()
+        self.corpus = corpus.VectorCorpus.create(n, trials, ctx, seed=seed, signed=signed, corpus_dir=corpus_dir)
         evaltor, main = setup_full_quire(ctx, unrounded=False)
         self.refs = [evaltor.interpret(main, [a, b]) for a, b in zip(self.As, self.Bs)]
         evaltor, main = setup_full_quire(ctx, unrounded=True)
@@ -129,8 +135,16 @@ class DotprodSettings(object):
 
         print(mk_dotprod(template, self.overall_ctx, self.mul_ctx, safe_quire_ctx(ctx)))
 
+    @property
+    def As(self):
+        return self.corpus.vectors(0)
+
+    @property
+    def Bs(self):
+        return self.corpus.vectors(1)
+
     def describe_cfg(self):
-        return (f'cfg({self.trials!r}, {self.n!r}, {self.overall_ctx!r}, {self.template!r}, signed={self.signed!r})\n'
+        return (f'cfg({self.trials!r}, {self.n!r}, {self.overall_ctx!r}, {self.template!r}, signed={self.signed!r}, seed={self.seed!r})\n'
                 f'#As = [{", ".join(describe_vec(a) for a in self.As)}]\n'
                 f'#Bs = [{", ".join(describe_vec(b) for b in self.Bs)}]')
 
@@ -142,8 +156,15 @@ def describe_stage(quire_lo, quire_hi):
     ctxs = settings.overall_ctx, settings.mul_ctx, sum_ctx
     print(mk_dotprod(settings.template, *ctxs))
 
-def dotprod_stage(quire_lo, quire_hi):
+def dotprod_stage(quire_lo, quire_hi, fidelity=None):
+    """Metrics for a quire size, over the first fidelity trials of the corpus
+    (all of them by default), so this can be used as a multi-fidelity eval_fn for search.Sweep.
+    """
     try:
+        if fidelity is None:
+            trials = settings.trials
+        else:
+            trials = min(int(fidelity), settings.trials)
         sum_ctx = fixed.fixed_ctx(-quire_lo, quire_lo + quire_hi)
         ctxs = settings.overall_ctx, settings.mul_ctx, sum_ctx
         evaltor, main = setup_dotprod(settings.template, ctxs)
@@ -153,27 +174,33 @@ def dotprod_stage(quire_lo, quire_hi):
         worst_abits = math.inf
         total_abits = 0
         infs = 0
+        results = []
+        refs = []
 
-        for a, b, ref, real_ref in zip(settings.As, settings.Bs, settings.refs, settings.real_refs):
+        for a, b, ref, real_ref in itertools.islice(zip(settings.As, settings.Bs, settings.refs, settings.real_refs), trials):
             result = evaltor.interpret(main, [a, b])
             if result.is_finite_real():
-                ulps = abs(linear_ulps(result, ref))
-                total_ulps += ulps
-                if ulps > worst_ulps:
-                    worst_ulps = ulps
+                results.append(result)
+                refs.append(ref)
                 abits = min(gmpmath.geo_sim(result, real_ref), settings.overall_ctx.p)
                 total_abits += abits
                 if abits < worst_abits:
                     worst_abits = abits
             else:
-                worst_ulps = math.inf
-                total_ulps = math.inf
                 worst_abits = -math.inf
                 total_abits = -math.inf
                 infs += 1
 
-        avg_ulps = total_ulps / settings.trials
-        avg_abits = total_abits / settings.trials
+        if infs:
+            worst_ulps = math.inf
+            total_ulps = math.inf
+        elif results:
+            ulps = accuracy.abs_ulps(results, refs)
+            worst_ulps = max(ulps)
+            total_ulps = sum(ulps)
+
+        avg_ulps = total_ulps / trials
+        avg_abits = total_abits / trials
 
         return quire_lo + quire_hi, infs, worst_ulps, avg_ulps, worst_abits, avg_abits
     except Exception:
@@ -6,15 +6,15 @@ import traceback
 
 from ..titanic import ndarray
 from ..fpbench import fpcparser
-from ..arithmetic import mpmf, ieee754, posit, analysis
+from ..arithmetic import mpmf, ieee754, posit, analysis, tiling
 
 from . import search
 from .utils import *
 from .benchmarks import mk_blur
+from . import imgkernel
 
 from PIL import Image
 import numpy as np
-from skimage import metrics as skim
 
 
 def pixel(x):
@@ -30,7 +30,7 @@ def imgify(tensor):
     return Image.fromarray(npify(tensor))
 
 def ssim(a, b):
-    return skim.structural_similarity(a, b, multichannel=True)
+    return imgkernel.ssim(a, b)
 
 class ImgSettings(object):
     def __init__(self):
@@ -46,6 +46,9 @@ class ImgSettings(object):
         '''
 
         self.img_args = [nd_img] + fpcparser.read_exprs(self.mask)
+        # for the vectorized kernel
+        self.np_img = np_img
+        self.mask_expr = self.img_args[1]
 
         ref_evaltor = mpmf.Interpreter()
         ref_main = load_cores(ref_evaltor, mk_blur(f64, f64, f64, f64))
@@ -56,13 +59,53 @@ class ImgSettings(object):
         self.ref = output_np
 
         self.use_posit = True
+        self.vectorized = True
 
-    def cfg(self, use_posit):
+    def cfg(self, use_posit, vectorized=True):
         self.use_posit = use_posit
+        self.vectorized = vectorized
 
 settings = ImgSettings()
 
 
+def blur_stage(overall_ctx, mask_ctx, accum_ctx, mul_ctx):
+    """Run the blur with these contexts, and return its cost and SSIM against the reference.
+    Uses the vectorized kernel when it supports the contexts, otherwise the interpreter.
+    """
+    if settings.vectorized:
+        try:
+            kernel = imgkernel.BlurKernel(overall_ctx, mask_ctx, accum_ctx, mul_ctx, settings.mask_expr)
+            result = imgkernel.to_pixels(kernel(settings.np_img))
+            return kernel.cost(settings.np_img.shape), ssim(settings.ref, result)
+        except imgkernel.VectorRoundingError:
+            pass
+
+    prog = mk_blur(overall_ctx, mask_ctx, accum_ctx, mul_ctx)
+
+    evaltor = mpmf.Interpreter()
+    als = analysis.BitcostAnalysis()
+    main = load_cores(evaltor, prog, [als])
+    result = evaltor.interpret(main, settings.img_args)
+
+    err = ssim(settings.ref, npify(result))
+    cost = als.bits_requested
+
+    return cost, err
+
+def blur_tiled(src, dst, overall_ctx, mask_ctx, accum_ctx, mul_ctx,
+               tile_shape=(256, 256), processes=None, verbosity=0):
+    """Blur a full resolution image tile by tile with the vectorized kernel,
+    writing 8-bit pixels to the .npy file dst.
+    src is an array, or the path to a .npy file, which is memory-mapped
+    (it has to be a path to use a pool of processes).
+    Returns the output as a read-only memory-mapped array.
+    """
+    kernel = imgkernel.BlurKernel(overall_ctx, mask_ctx, accum_ctx, mul_ctx, settings.mask_expr)
+    halo = tiling.stencil_halo(fpcparser.compile(kernel.prog)[-1])
+    out, _ = tiling.run_tiled(kernel, src, dst, halo, tile_shape=tile_shape, processes=processes,
+                              convert=imgkernel.to_pixels, verbosity=verbosity)
+    return out
+
 def img_stage(ebits, overall_prec, mask_prec, accum_prec, mul_prec):
     try:
         if settings.use_posit:
@@ -77,15 +120,7 @@ def img_stage(ebits, overall_prec, mask_prec, accum_prec, mul_prec):
         accum_ctx = mk_ctx(ebits, accum_prec + extra_bits)
         mul_ctx = mk_ctx(ebits, mul_prec + extra_bits)
 
-        prog = mk_blur(overall_ctx, mask_ctx, accum_ctx, mul_ctx)
-
-        evaltor = mpmf.Interpreter()
-        als = analysis.BitcostAnalysis()
-        main = load_cores(evaltor, prog, [als])
-        result = evaltor.interpret(main, settings.img_args)
-
-        err = ssim(settings.ref, npify(result))
-        cost = als.bits_requested
+        cost, err = blur_stage(overall_ctx, mask_ctx, accum_ctx, mul_ctx)
     except Exception:
         traceback.print_exc()
         return math.inf, 0
@@ -93,17 +128,7 @@ def img_stage(ebits, overall_prec, mask_prec, accum_prec, mul_prec):
     return cost, err
 
 def img_ref_stage(overall_ctx, mask_ctx, accum_ctx, mul_ctx):
-    prog = mk_blur(overall_ctx, mask_ctx, accum_ctx, mul_ctx)
-
-    evaltor = mpmf.Interpreter()
-    als = analysis.BitcostAnalysis()
-    main = load_cores(evaltor, prog, [als])
-    result = evaltor.interpret(main, settings.img_args)
-
-    err = ssim(settings.ref, npify(result))
-    cost = als.bits_requested
-
-    return cost, err
+    return blur_stage(overall_ctx, mask_ctx, accum_ctx, mul_ctx)
 
 def img_fenceposts():
     points = [
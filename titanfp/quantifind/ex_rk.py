@@ -1,20 +1,46 @@
 """Runge-Kutta stepper for chaotic attractors."""
 
+import os
 import operator
 import math
 import traceback
+import functools
+import hashlib
+import tempfile
+
+import numpy as np
 
 from ..titanic import ndarray, gmpmath
 from ..fpbench import fpcparser
-from ..arithmetic import mpmf, ieee754, posit, analysis
+from ..arithmetic import mpmf, ieee754, posit, analysis, bitcost
 
 from . import search
+from . import accuracy
 from .utils import *
 from .benchmarks import mk_rk, rk_equations, rk_data
 
 
+# the same few programs are compiled over and over during a sweep
+@functools.lru_cache(maxsize=1024)
+def compile_cached(source):
+    return tuple(fpcparser.compile(source))
+
 
 def worst_and_avg_abits(a1, a2, ctx):
+    """Worst and average bits of agreement between two arrays of values,
+    which can be lists of Titanic values, or float64 arrays.
+    Computed over the whole arrays at once whenever the values fit in float64.
+    """
+    x1 = a1 if isinstance(a1, np.ndarray) else accuracy.to_float_array(a1)
+    x2 = a2 if isinstance(a2, np.ndarray) else accuracy.to_float_array(a2)
+    if x1 is not None and x2 is not None:
+        return accuracy.worst_and_avg_abits(x1, x2, None if ctx is None else ctx.p)
+
+    if isinstance(a1, np.ndarray):
+        a1 = [mpmf.MPMF(float(e), ctx=f64) for e in a1]
+    if isinstance(a2, np.ndarray):
+        a2 = [mpmf.MPMF(float(e), ctx=f64) for e in a2]
+
     worst_abits = math.inf
     total_abits = 0
 
@@ -58,7 +84,7 @@ def setup_rk(ebits, fn_prec, rk_prec, k1_prec, k2_prec, k3_prec, k4_prec,
     eqn_name, eqn_template = rk_equations[eqn]
     equation = eqn_template.format(fn_prec=fn_ctx.propstr())
 
-    return fpcparser.compile(prog), fpcparser.compile(equation), rk_ctx
+    return compile_cached(prog), compile_cached(equation), rk_ctx
 
 def run_rk(prog, args):
     evaltor = mpmf.Interpreter()
@@ -81,25 +107,87 @@ def eval_rk(equation, als, result_array, ref, dref, ctx=None):
     return als.bits_requested, worst_abits_last, avg_abits_last, worst_abits_dlast, avg_abits_dlast
 
 
+# references are kept in the per-user cache directory ($XDG_CACHE_HOME, or ~/.cache), so every sweep shares them
+rk_ref_dir = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser(os.path.join('~', '.cache'))),
+                          'titanfp', 'rk_ref')
+
+def rk_reference(eqn, method='rk4', args=None, ref_ctx=f4k, cache_dir=None):
+    """High precision reference for an RK benchmark: the whole trajectory,
+    and the derivative at its last step, rounded to float64 arrays.
+
+    These only depend on the equation, the method, the arguments (which include the step count)
+    and the reference precision, so they are computed once and saved in cache_dir;
+    after that, every process (including sweep workers) just loads the file.
+    cache_dir defaults to rk_ref_dir.
+    """
+    if cache_dir is None:
+        cache_dir = rk_ref_dir
+    if args is None:
+        args = rk_data[eqn][0]
+    key = ' '.join([eqn, method, args, ref_ctx.propstr()])
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    fname = os.path.join(cache_dir, f'rk_{eqn}_{method}_{digest}.npz')
+
+    if os.path.exists(fname):
+        with np.load(fname) as data:
+            if str(data['key']) == key:
+                return data['trajectory'], data['dlast']
+
+    prog = compile_cached(mk_rk(*((ref_ctx,) * 6), method=method, eqn=eqn))
+    evaltor, als, result_array = run_rk(prog, fpcparser.read_exprs(args))
+    last = result_array[-1]
+
+    eqn_name, eqn_template = rk_equations[eqn]
+    evaltor = mpmf.Interpreter()
+    main = load_cores(evaltor, compile_cached(eqn_template.format(fn_prec=ref_ctx.propstr())))
+    dlast = evaltor.interpret(main, [ndarray.NDArray(last)])
+
+    trajectory = np.array([[float(e) for e in row] for row in result_array], dtype=np.float64)
+    dlast = np.array([float(e) for e in dlast], dtype=np.float64)
+
+    # write to a temporary file first, in case several processes get here at once
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(f, key=key, trajectory=trajectory, dlast=dlast)
+    os.replace(tmp_name, fname)
+
+    return trajectory, dlast
+
+
 class RkSettings(object):
-    """Global settings"""
+    """Global settings.
+    The reference is only computed (or loaded) the first time it is used,
+    so importing this module doesn't run anything.
+    """
 
     def __init__(self):
         self.method = 'rk4'
-        self.eqn = 'lorenz'
-        args, ref, dref = rk_data[self.eqn]
-        self.args = fpcparser.read_exprs(args)
-        self.ref = [mpmf.MPMF(e, ctx=f64) for e in ref]
-        self.dref = [mpmf.MPMF(e, ctx=f64) for e in dref]
-        self.use_posit = False
+        self.ref_dir = rk_ref_dir
+        self.cfg('lorenz', False)
 
     def cfg(self, eqn, use_posit):
         self.eqn = eqn
-        args, ref, dref = rk_data[self.eqn]
+        args, _, _ = rk_data[self.eqn]
         self.args = fpcparser.read_exprs(args)
-        self.ref = [mpmf.MPMF(e, ctx=f64) for e in ref]
-        self.dref = [mpmf.MPMF(e, ctx=f64) for e in dref]
         self.use_posit = use_posit
+        self._ref = None
+
+    def _reference(self):
+        key = (self.eqn, self.method, self.ref_dir)
+        if self._ref is None or self._ref[0] != key:
+            args, _, _ = rk_data[self.eqn]
+            trajectory, dlast = rk_reference(self.eqn, self.method, args, cache_dir=self.ref_dir)
+            self._ref = key, trajectory[-1], dlast
+        return self._ref
+
+    @property
+    def ref(self):
+        return self._reference()[1]
+
+    @property
+    def dref(self):
+        return self._reference()[2]
 
 settings = RkSettings()
 
@@ -114,13 +202,30 @@ def rk_stage(ebits, fn_prec, rk_prec, k1_prec, k2_prec, k3_prec, k4_prec):
         traceback.print_exc()
         return math.inf, -math.inf, -math.inf, -math.inf, -math.inf
 
+def rk_bound(ebits, fn_prec, rk_prec, k1_prec, k2_prec, k3_prec, k4_prec):
+    """Optimistic metrics for rk_stage, without running the stepper.
+    The cost of the rk program doesn't depend on the values it computes,
+    so the static estimate is exact, and no result can be more accurate
+    than the precision of the rk context.
+    """
+    try:
+        prog, equation, ctx = setup_rk(ebits, fn_prec, rk_prec, k1_prec, k2_prec, k3_prec, k4_prec,
+                                       method=settings.method, eqn=settings.eqn, use_posit=settings.use_posit)
+        estimator = bitcost.BitcostEstimator()
+        main = load_cores(estimator, prog)
+        bits_lo, bits_hi = estimator.estimate(main, settings.args)
+        return bits_lo, ctx.p, ctx.p, ctx.p, ctx.p
+    except Exception:
+        traceback.print_exc()
+        return None
+
 def rk_ref_stage(fn_ctx, rk_ctx, k1_ctx, k2_ctx, k3_ctx, k4_ctx):
     try:
         prog = mk_rk(fn_ctx, rk_ctx, k1_ctx, k2_ctx, k3_ctx, k4_ctx,
                      method=settings.method, eqn=settings.eqn)
         eqn_name, eqn_template = rk_equations[settings.eqn]
         equation = eqn_template.format(fn_prec=fn_ctx.propstr())
-        prog, equation, ctx = fpcparser.compile(prog), fpcparser.compile(equation), rk_ctx
+        prog, equation, ctx = compile_cached(prog), compile_cached(equation), rk_ctx
 
         evaltor, als, result_array = run_rk(prog, settings.args)
         return eval_rk(equation, als, result_array, settings.ref, settings.dref, ctx)
@@ -187,7 +292,8 @@ def rk_experiment(prefix, ebit_slice, pbit_slice, es_slice, inits, retries, eq_n
 
     settings.cfg(eq_name, False)
     try:
-        with search.Sweep(rk_stage, rk_inits, rk_neighbors, rk_metrics, settings=sweep_settings, cores=cores) as sweep:
+        with search.Sweep(rk_stage, rk_inits, rk_neighbors, rk_metrics, settings=sweep_settings, cores=cores,
+                          bound_fn=rk_bound) as sweep:
             frontier = sweep.run_search(checkpoint_dir=prefix+'/float')
             sweepdata = sweep.state.generations, sweep.state.history, frontier
         #sweep = search.sweep_multi(rk_stage, rk_inits, rk_neighbors, rk_metrics, inits, retries, force_exploration=True)
@@ -200,7 +306,8 @@ def rk_experiment(prefix, ebit_slice, pbit_slice, es_slice, inits, retries, eq_n
 
     settings.cfg(eq_name, True)
     try:
-        with search.Sweep(rk_stage, rk_inits, rk_neighbors, rk_metrics, settings=sweep_settings, cores=cores) as sweep:
+        with search.Sweep(rk_stage, rk_inits, rk_neighbors, rk_metrics, settings=sweep_settings, cores=cores,
+                          bound_fn=rk_bound) as sweep:
             frontier = sweep.run_search(checkpoint_dir=prefix+'/posit')
             sweepdata = sweep.state.generations, sweep.state.history, frontier
         #sweep = search.sweep_multi(rk_stage, rk_inits, rk_neighbors, rk_metrics, inits, retries, force_exploration=True)
@@ -9,6 +9,7 @@ from ..fpbench import fpcparser
 from ..arithmetic import mpmf, ieee754, evalctx, analysis
 
 from . import search
+from . import accuracy
 from .utils import *
 from .benchmarks import mk_sqrt, mk_sqrt_manual
 
@@ -51,6 +52,8 @@ def eval_sqrt(core, bound):
     total_abits = 0
     worst_bitcost = 0
     total_bitcost = 0
+    results = []
+    refs = []
 
     for arg, (ref, ref_hi) in zip(settings.example_inputs, settings.reference_outputs):
         evaltor = mpmf.Interpreter()
@@ -65,17 +68,13 @@ def eval_sqrt(core, bound):
             timeouts += 1
 
         if result.is_finite_real():
-            ulps = abs(linear_ulps(result, ref))
-            if ulps > worst_ulps:
-                worst_ulps = ulps
-            total_ulps += ulps
+            results.append(result)
+            refs.append(ref)
             abits = min(gmpmath.geo_sim(result, ref_hi), settings.overall_ctx.p)
             if abits < worst_abits:
                 worst_abits = abits
             total_abits += abits
         else:
-            worst_ulps = math.inf
-            total_ulps = math.inf
             worst_abits = -math.inf
             total_abits = -math.inf
             infs += 1
@@ -84,6 +83,14 @@ def eval_sqrt(core, bound):
             worst_bitcost = bitcost
         total_bitcost += bitcost
 
+    if infs:
+        worst_ulps = math.inf
+        total_ulps = math.inf
+    elif results:
+        ulps = accuracy.abs_ulps(results, refs)
+        worst_ulps = max(ulps)
+        total_ulps = sum(ulps)
+
     return timeouts, infs, worst_bitcost, total_bitcost, worst_ulps, total_ulps, worst_abits, total_abits
 
 def sqrt_stage(expbits, res_bits, diff_bits, scale_bits):
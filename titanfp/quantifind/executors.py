@@ -0,0 +1,817 @@
+"""Pluggable evaluation backends for the QuantiFind search driver.
+
+An executor is anything that can be used as a context manager
+and provides the same apply_async(fn, args) method as multiprocessing.Pool,
+returning an object with a get() method that blocks until the result is ready.
+The Sweep object only relies on this interface,
+so a plain multiprocessing.Pool also counts as an executor.
+"""
+
+import os
+import time
+import socket
+import secrets
+import collections
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import threading
+import traceback
+
+
+class ExecutorError(Exception):
+    """QuantiFind executor error."""
+
+class LostWorkError(ExecutorError):
+    """A task was lost too many times to be resubmitted.
+    Like a BudgetExceededError with kind 'lost', where used is the number of attempts.
+    """
+
+    kind = 'lost'
+
+    def __init__(self, msg, attempts=None):
+        super().__init__(msg)
+        self.used = attempts
+
+class BudgetExceededError(ExecutorError):
+    """A task was killed for using too much time or memory.
+    kind is 'time' or 'memory', and used is how many seconds or bytes
+    the task had used when it was stopped.
+    """
+
+    def __init__(self, msg, kind=None, limit=None, used=None):
+        super().__init__(msg)
+        self.kind = kind
+        self.limit = limit
+        self.used = used
+
+class WorkerDiedError(ExecutorError):
+    """The worker running a task died, e.g. at the hands of the OOM killer.
+    Like a BudgetExceededError with kind 'died', where used is the worker's exit code.
+    """
+
+    kind = 'died'
+
+    def __init__(self, msg, exitcode=None):
+        super().__init__(msg)
+        self.used = exitcode
+
+
+def _nice_initializer(niceness, initializer, initargs):
+    os.nice(niceness)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+class PoolExecutor(object):
+    """Run evaluations on a local multiprocessing.Pool.
+    This is the default executor used by Sweep.
+    """
+
+    def __init__(self, cores=None, initializer=None, initargs=(), niceness=10, max_tasks=None):
+        self.cores = cores
+        self.initializer = initializer
+        self.initargs = initargs
+        self.niceness = niceness
+        # if set, replace each worker process after this many tasks
+        self.max_tasks = max_tasks
+        self.pool = None
+        self.workers = None
+
+    def __enter__(self):
+        if self.cores is None:
+            self.workers = os.cpu_count()
+        else:
+            self.workers = self.cores
+        self.pool = multiprocessing.Pool(self.cores, initializer=_nice_initializer,
+                                         initargs=(self.niceness, self.initializer, self.initargs),
+                                         maxtasksperchild=self.max_tasks)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __repr__(self):
+        return f'<{type(self).__name__} object at {hex(id(self))} with pool {repr(self.pool)}>'
+
+    def apply_async(self, fn, args):
+        return self.pool.apply_async(fn, args)
+
+
+# local execution with resource limits
+#
+# Each worker process gets its own pipe, and is sent one task at a time as (fn, args)
+# (or None to exit), replying with (ok, value) like the socket protocol below.
+# A monitor thread in the server hands out tasks and watches the clock and each worker's
+# resident set size; a worker that goes over budget is killed and replaced,
+# since there's no safe way to interrupt the interpreter in the middle of an evaluation.
+
+_page_size = os.sysconf('SC_PAGE_SIZE')
+
+def process_rss(pid):
+    """Resident set size of process pid in bytes, or None if it can't be read.
+    Reads /proc, so this only works on Linux.
+    """
+    try:
+        with open(f'/proc/{pid:d}/statm', 'rt') as f:
+            return int(f.read().split()[1]) * _page_size
+    except (OSError, ValueError, IndexError):
+        return None
+
+def _budget_worker(conn, niceness, initializer, initargs):
+    if niceness:
+        os.nice(niceness)
+    if initializer is not None:
+        initializer(*initargs)
+
+    while True:
+        try:
+            msg = conn.recv()
+        except (OSError, EOFError):
+            return
+        if msg is None:
+            return
+        fn, args = msg
+        try:
+            reply = (True, fn(*args))
+        except Exception:
+            reply = (False, traceback.format_exc())
+        conn.send(reply)
+
+
+class _BudgetSlot(object):
+    """A worker process managed by a BudgetExecutor, and the task it is running."""
+
+    def __init__(self, proc, conn):
+        self.proc = proc
+        self.conn = conn
+        self.ares = None
+        self.started = None
+        self.tasks = 0
+
+
+class BudgetExecutor(object):
+    """Run evaluations on local worker processes, with a budget for each evaluation.
+
+    If an evaluation runs for more than time_budget seconds,
+    or its worker's resident memory grows past memory_budget bytes,
+    the worker is killed and replaced, and the result raises BudgetExceededError.
+    If a worker dies on its own while running an evaluation (say the OOM killer got it),
+    it is replaced, and the result raises WorkerDiedError.
+    If max_tasks is set, workers are also replaced after that many evaluations,
+    to keep slow memory growth from building up over a long search.
+    """
+
+    def __init__(self, cores=None, time_budget=None, memory_budget=None, max_tasks=None,
+                 initializer=None, initargs=(), niceness=10, poll_interval=0.1,
+                 verbosity=1):
+        if cores is None:
+            cores = os.cpu_count()
+        self.cores = cores
+        self.workers = cores
+        self.time_budget = time_budget
+        self.memory_budget = memory_budget
+        self.max_tasks = max_tasks
+        self.initializer = initializer
+        self.initargs = initargs
+        self.niceness = niceness
+        self.poll_interval = poll_interval
+        self.verbosity = verbosity
+
+        self.slots = []
+        self.monitor_thread = None
+
+        # shared state, protected by the condition's lock
+        self.cond = threading.Condition()
+        self.queue = collections.deque()
+        self.task_ids = itertools.count()
+        self.running = False
+
+        # some counters for reporting
+        self.workers_started = 0
+        self.workers_recycled = 0
+        self.tasks_over_time = 0
+        self.tasks_over_memory = 0
+
+    def __enter__(self):
+        if self.memory_budget is not None and process_rss(os.getpid()) is None:
+            print('WARNING: unable to measure memory usage; the memory budget will not be enforced')
+        self.slots = [self._start_worker() for _ in range(self.cores)]
+        self.running = True
+        self.monitor_thread = threading.Thread(target=self._monitor_loop, daemon=True)
+        self.monitor_thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        with self.cond:
+            self.running = False
+            for ares in self.queue:
+                ares._set(False, ExecutorError(f'executor shut down before task {ares.task_id} was run'))
+            self.queue.clear()
+            self.cond.notify_all()
+        self.monitor_thread.join()
+
+        for slot in self.slots:
+            if slot.ares is not None:
+                slot.ares._set(False, ExecutorError(f'executor shut down while task {slot.ares.task_id} was running'))
+                self._stop_worker(slot, kill=True)
+            else:
+                self._stop_worker(slot)
+        self.slots.clear()
+
+        if self.verbosity >= 1 and (self.tasks_over_time or self.tasks_over_memory):
+            print(f'Killed {self.tasks_over_time} evaluations for exceeding the time budget '
+                  f'and {self.tasks_over_memory} for exceeding the memory budget.')
+
+    def __repr__(self):
+        return f'<{type(self).__name__} object at {hex(id(self))} with {len(self.slots)} workers>'
+
+    def apply_async(self, fn, args):
+        with self.cond:
+            if not self.running:
+                raise ExecutorError(f'{repr(self)} is not running')
+            ares = TaskResult(next(self.task_ids), fn, tuple(args))
+            self.queue.append(ares)
+            self.cond.notify()
+        return ares
+
+    def _start_worker(self):
+        conn, child_conn = multiprocessing.Pipe()
+        p = multiprocessing.Process(target=_budget_worker,
+                                    args=(child_conn, self.niceness, self.initializer, self.initargs),
+                                    daemon=True)
+        p.start()
+        # close our copy of the child's end, so we see EOF if the worker dies
+        child_conn.close()
+        self.workers_started += 1
+        return _BudgetSlot(p, conn)
+
+    def _stop_worker(self, slot, kill=False):
+        if kill:
+            slot.proc.kill()
+        else:
+            try:
+                slot.conn.send(None)
+            except OSError:
+                pass
+        slot.proc.join()
+        slot.conn.close()
+
+    def _replace_worker(self, i, kill=False):
+        self._stop_worker(self.slots[i], kill=kill)
+        self.slots[i] = self._start_worker()
+
+    def _over_budget(self, i, kind, limit, used):
+        slot = self.slots[i]
+        ares = slot.ares
+        if kind == 'time':
+            self.tasks_over_time += 1
+        else:
+            self.tasks_over_memory += 1
+        self._replace_worker(i, kill=True)
+        ares._set(False, BudgetExceededError(f'task {ares.task_id} {getattr(ares.fn, "__name__", repr(ares.fn))}{repr(ares.args)} '
+                                             f'exceeded its {kind} budget: {used!r} > {limit!r}',
+                                             kind=kind, limit=limit, used=used))
+        if self.verbosity >= 2:
+            print(f'-- killed task {ares.task_id} for using too much {kind} --', flush=True)
+
+    def _send_task(self, i):
+        """Send the task assigned to slot i to its worker.
+        If the worker died while it was idle, it is replaced and the task goes back
+        on the queue; if the task can't be sent at all (say it can't be pickled),
+        its result raises ExecutorError.
+        """
+        slot = self.slots[i]
+        ares = slot.ares
+        try:
+            slot.conn.send((ares.fn, ares.args))
+        except OSError as e:
+            slot.ares = None
+            self._replace_worker(i, kill=True)
+            ares.attempts += 1
+            if ares.attempts > 2:
+                ares._set(False, ExecutorError(f'unable to send task {ares.task_id} to a worker: {e!r}'))
+            else:
+                self.queue.appendleft(ares)
+        except Exception as e:
+            slot.ares = None
+            self._replace_worker(i, kill=True)
+            ares._set(False, ExecutorError(f'unable to send task {ares.task_id} '
+                                           f'{getattr(ares.fn, "__name__", repr(ares.fn))}{repr(ares.args)} '
+                                           f'to a worker: {e!r}'))
+
+    def _monitor_loop(self):
+        try:
+            self._monitor()
+        except BaseException as e:
+            # don't leave anyone waiting on a result that will never come
+            traceback.print_exc()
+            with self.cond:
+                self.running = False
+                err = ExecutorError(f'{repr(self)} failed: {e!r}')
+                for ares in self.queue:
+                    ares._set(False, err)
+                self.queue.clear()
+                for slot in self.slots:
+                    if slot.ares is not None:
+                        slot.ares._set(False, err)
+                        slot.ares = None
+
+    def _monitor(self):
+        while True:
+            # hand out work to idle workers
+            with self.cond:
+                if not self.running:
+                    return
+                for i, slot in enumerate(self.slots):
+                    while slot.ares is None and self.queue:
+                        slot.ares = self.queue.popleft()
+                        slot.started = time.time()
+                        self._send_task(i)
+                        slot = self.slots[i]
+                if not any(slot.ares is not None for slot in self.slots):
+                    self.cond.wait(self.poll_interval)
+                    continue
+
+            # collect results
+            busy = {slot.conn: i for i, slot in enumerate(self.slots) if slot.ares is not None}
+            for conn in multiprocessing.connection.wait(list(busy), timeout=self.poll_interval):
+                i = busy[conn]
+                slot = self.slots[i]
+                ares = slot.ares
+                try:
+                    ok, value = conn.recv()
+                except (OSError, EOFError):
+                    slot.proc.join(1)
+                    exitcode = slot.proc.exitcode
+                    self._replace_worker(i, kill=True)
+                    ares._set(False, WorkerDiedError(f'worker died (exit code {exitcode!r}) while running task {ares.task_id} '
+                                                     f'{getattr(ares.fn, "__name__", repr(ares.fn))}{repr(ares.args)}', exitcode=exitcode))
+                    continue
+
+                if ok:
+                    ares._set(True, value)
+                else:
+                    ares._set(False, ExecutorError(f'task {ares.task_id} raised:\n{value}'))
+                slot.ares = None
+                slot.tasks += 1
+                if self.max_tasks is not None and slot.tasks >= self.max_tasks:
+                    self.workers_recycled += 1
+                    self._replace_worker(i)
+
+            # enforce budgets on whatever is still running
+            now = time.time()
+            for i, slot in enumerate(self.slots):
+                if slot.ares is None:
+                    continue
+                elapsed = now - slot.started
+                if self.time_budget is not None and elapsed > self.time_budget:
+                    self._over_budget(i, 'time', self.time_budget, elapsed)
+                elif self.memory_budget is not None:
+                    rss = process_rss(slot.proc.pid)
+                    if rss is not None and rss > self.memory_budget:
+                        self._over_budget(i, 'memory', self.memory_budget, rss)
+
+
+# distributed execution over TCP
+#
+# The protocol is built on multiprocessing.connection,
+# which gives us length-prefixed pickled messages and HMAC authentication.
+# Every message is a tuple, with a string tag as the first element.
+#
+# worker -> server:
+#   ('hello', name)                   on connect
+#   ('ready',)                        the worker is idle and wants a task
+#   ('heartbeat', task_id)            the worker is still working on task_id
+#   ('result', task_id, ok, value)    the worker finished task_id;
+#                                     if ok is False, value is a formatted traceback
+#
+# server -> worker:
+#   ('init', fn, args)                run fn(*args) once before taking tasks, or fn is None
+#   ('task', task_id, fn, args)       evaluate fn(*args)
+#   ('shutdown',)                     disconnect and exit
+#
+# Tasks are leased to one worker at a time.
+# If the server doesn't hear from the worker for lease_timeout seconds,
+# or the connection drops, the lease is broken and the task goes back on the queue.
+# A task is resubmitted at most retry_attempts times (additional tries after the first);
+# after that its result raises LostWorkError.
+#
+# Messages are pickled, so anyone who knows the authkey can run code on the server
+# and on every worker. There is no default key: on a loopback host the server makes
+# up a random one, and anywhere else it has to be given explicitly.
+
+
+class TaskResult(object):
+    """Handle for a task submitted to a SocketExecutor or BudgetExecutor.
+    Mirrors the interface of multiprocessing.pool.AsyncResult.
+    """
+
+    def __init__(self, task_id, fn, args):
+        self.task_id = task_id
+        self.fn = fn
+        self.args = args
+        self.attempts = 0
+        self._event = threading.Event()
+        self._ok = None
+        self._value = None
+
+    def __repr__(self):
+        return f'<{type(self).__name__} for task {self.task_id} after {self.attempts} attempts>'
+
+    def _set(self, ok, value):
+        self._ok = ok
+        self._value = value
+        self._event.set()
+
+    def ready(self):
+        return self._event.is_set()
+
+    def successful(self):
+        if not self.ready():
+            raise ValueError(f'{repr(self)} not ready')
+        return self._ok
+
+    def wait(self, timeout=None):
+        self._event.wait(timeout)
+
+    def get(self, timeout=None):
+        self.wait(timeout)
+        if not self.ready():
+            raise multiprocessing.TimeoutError()
+        if self._ok:
+            return self._value
+        else:
+            raise self._value
+
+
+class SocketExecutor(object):
+    """Serve evaluations to worker processes over TCP.
+
+    Workers can be started on any machine that can reach host:port with
+    python -m titanfp.quantifind.executors --connect HOST:PORT --authkey KEY
+    and local_workers additional worker processes are started on this machine.
+    The initializer is sent to every worker when it connects,
+    for example to configure module-level experiment settings.
+
+    authkey is required unless host is a loopback address, in which case
+    a random key is generated (and printed, for workers started by hand).
+
+    retry_attempts is how many times a task lost with its worker is resubmitted here,
+    before its result raises LostWorkError. It has nothing to do with Sweep's retry_attempts,
+    which is how many more times the sweep tries to generate new configurations
+    when a batch keeps hitting the cache.
+    """
+
+    def __init__(self, host='localhost', port=0, authkey=None,
+                 local_workers=0, initializer=None, initargs=(),
+                 heartbeat_interval=5.0, lease_timeout=30.0, retry_attempts=1,
+                 verbosity=1):
+        self.host = host
+        self.port = port
+        if authkey is None:
+            if not is_loopback(host):
+                raise ValueError(f'an authkey is required to serve evaluations on {host!r}, '
+                                 f'since anyone who can connect can run code on this machine')
+            authkey = secrets.token_hex(16)
+        if isinstance(authkey, str):
+            authkey = authkey.encode('utf-8')
+        self.authkey = authkey
+        self.local_workers = local_workers
+        self.initializer = initializer
+        self.initargs = initargs
+        self.heartbeat_interval = heartbeat_interval
+        self.lease_timeout = lease_timeout
+        self.retry_attempts = retry_attempts
+        self.verbosity = verbosity
+
+        self.listener = None
+        self.address = None
+        self.accept_thread = None
+        self.handler_threads = []
+        self.worker_procs = []
+
+        # shared state, protected by the condition's lock
+        self.cond = threading.Condition()
+        self.queue = collections.deque()
+        self.task_ids = itertools.count()
+        self.running = False
+
+        # some counters for reporting
+        self.workers = 0
+        self.workers_seen = 0
+        self.tasks_lost = 0
+        self.tasks_resubmitted = 0
+        self.workers_replaced = 0
+
+    def __enter__(self):
+        self.listener = multiprocessing.connection.Listener((self.host, self.port), authkey=self.authkey)
+        self.address = self.listener.address
+        self.running = True
+
+        self.accept_thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self.accept_thread.start()
+
+        if self.verbosity >= 1:
+            print(f'Serving QuantiFind evaluations on {self.address[0]}:{self.address[1]} '
+                  f'with authkey {self.authkey.decode("utf-8", errors="replace")}.')
+
+        for i in range(self.local_workers):
+            self.worker_procs.append(self._start_local_worker(i))
+
+        return self
+
+    def _local_name(self, i):
+        return f'local:{os.getpid()}:{i}'
+
+    def _start_local_worker(self, i):
+        p = multiprocessing.Process(target=run_worker, args=(self.address, self.authkey),
+                                    kwargs={'name': self._local_name(i),
+                                            'heartbeat_interval': self.heartbeat_interval},
+                                    daemon=True)
+        p.start()
+        return p
+
+    def _replace_local_worker(self, name):
+        """If the worker that just disconnected was one of ours, start a fresh one in its place."""
+        for i, p in enumerate(self.worker_procs):
+            if name == self._local_name(i):
+                break
+        else:
+            return
+        # without its connection, the worker exits (or is stuck), either way it's no use
+        p.join(1)
+        if p.is_alive():
+            p.terminate()
+            p.join()
+        with self.cond:
+            if not self.running:
+                return
+            self.workers_replaced += 1
+            self.worker_procs[i] = self._start_local_worker(i)
+        if self.verbosity >= 2:
+            print(f'-- replaced local worker {name} (exit code {p.exitcode!r}) --', flush=True)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        with self.cond:
+            self.running = False
+            for ares in self.queue:
+                ares._set(False, ExecutorError(f'executor shut down before task {ares.task_id} was run'))
+            self.queue.clear()
+            self.cond.notify_all()
+
+        # closing the listener won't reliably interrupt a blocking accept(),
+        # so connect to ourselves to wake up the accept thread
+        try:
+            multiprocessing.connection.Client(self.address, authkey=self.authkey).close()
+        except OSError:
+            pass
+        self.accept_thread.join()
+        self.listener.close()
+        for t in self.handler_threads:
+            t.join()
+        for p in self.worker_procs:
+            p.join()
+
+        self.handler_threads.clear()
+        self.worker_procs.clear()
+        self.listener = None
+
+        if self.verbosity >= 1:
+            print(f'Stopped serving QuantiFind evaluations; saw {self.workers_seen} workers '
+                  f'({self.workers_replaced} local workers replaced), '
+                  f'lost {self.tasks_lost} tasks and resubmitted {self.tasks_resubmitted}.')
+
+    def __repr__(self):
+        return f'<{type(self).__name__} object at {hex(id(self))} on {repr(self.address)}>'
+
+    def apply_async(self, fn, args):
+        with self.cond:
+            if not self.running:
+                raise ExecutorError(f'{repr(self)} is not running')
+            ares = TaskResult(next(self.task_ids), fn, tuple(args))
+            self.queue.append(ares)
+            self.cond.notify()
+        return ares
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError):
+                conn = None
+            with self.cond:
+                if not self.running:
+                    if conn is not None:
+                        conn.close()
+                    return
+            if conn is None:
+                continue
+            t = threading.Thread(target=self._handle_worker, args=(conn,), daemon=True)
+            t.start()
+            self.handler_threads.append(t)
+
+    def _next_task(self):
+        """Block until there is a task to run, or the executor is shutting down.
+        Returns the task's result handle, or None to shut down.
+        """
+        with self.cond:
+            while self.running and not self.queue:
+                self.cond.wait()
+            if self.running:
+                return self.queue.popleft()
+            else:
+                return None
+
+    def _lose_task(self, ares, reason):
+        """Break the lease on a task, and resubmit it if it hasn't been tried too many times."""
+        with self.cond:
+            self.tasks_lost += 1
+            if not self.running:
+                ares._set(False, ExecutorError(f'executor shut down while task {ares.task_id} was running'))
+            elif ares.attempts > self.retry_attempts:
+                ares._set(False, LostWorkError(f'task {ares.task_id} {getattr(ares.fn, "__name__", repr(ares.fn))}{repr(ares.args)} '
+                                               f'lost after {ares.attempts} attempts: {reason}', attempts=ares.attempts))
+            else:
+                self.tasks_resubmitted += 1
+                # lost work goes to the front, so it gets picked up first
+                self.queue.appendleft(ares)
+                self.cond.notify()
+
+        if self.verbosity >= 2:
+            print(f'-- lost task {ares.task_id}: {reason} --', flush=True)
+
+    def _handle_worker(self, conn):
+        name = None
+        ares = None
+        try:
+            tag, name = conn.recv()
+            if tag != 'hello':
+                raise ExecutorError(f'expected hello from worker, got {repr(tag)}')
+            with self.cond:
+                self.workers_seen += 1
+                self.workers += 1
+            conn.send(('init', self.initializer, self.initargs))
+
+            # the lease on a task lasts until lease_timeout seconds pass without a message
+            while True:
+                if not conn.poll(self.lease_timeout):
+                    if ares is None:
+                        # idle workers don't need to heartbeat
+                        continue
+                    raise ExecutorError(f'worker {name} missed its heartbeat')
+
+                msg = conn.recv()
+                tag = msg[0]
+
+                if tag == 'ready':
+                    ares = self._next_task()
+                    if ares is None:
+                        conn.send(('shutdown',))
+                        return
+                    with self.cond:
+                        ares.attempts += 1
+                    conn.send(('task', ares.task_id, ares.fn, ares.args))
+
+                elif tag == 'heartbeat':
+                    # receiving it was enough to renew the lease
+                    pass
+
+                elif tag == 'result':
+                    _, task_id, ok, value = msg
+                    if ares is None or task_id != ares.task_id:
+                        raise ExecutorError(f'worker {name} returned result for unleased task {task_id}')
+                    if ok:
+                        ares._set(True, value)
+                    else:
+                        ares._set(False, ExecutorError(f'task {task_id} raised on worker {name}:\n{value}'))
+                    ares = None
+
+                else:
+                    raise ExecutorError(f'unknown message {repr(tag)} from worker {name}')
+
+        except (OSError, EOFError, ExecutorError) as e:
+            if ares is not None:
+                self._lose_task(ares, f'{type(e).__name__}: {e!s}')
+            elif self.verbosity >= 2:
+                print(f'-- worker {name} disconnected: {e!s} --', flush=True)
+        finally:
+            if name is not None:
+                with self.cond:
+                    self.workers -= 1
+            conn.close()
+            if name is not None:
+                self._replace_local_worker(name)
+
+
+def _heartbeat_loop(conn, send_lock, task_id, interval, done):
+    while not done.wait(interval):
+        try:
+            with send_lock:
+                conn.send(('heartbeat', task_id))
+        except OSError:
+            # the main loop will notice when it tries to send the result
+            return
+
+def is_loopback(host):
+    """True if host only accepts connections from this machine."""
+    try:
+        infos = socket.getaddrinfo(host, None)
+    except socket.gaierror:
+        return False
+    return all(info[4][0].startswith('127.') or info[4][0] == '::1' for info in infos)
+
+def run_worker(address, authkey, name=None, heartbeat_interval=5.0,
+               connect_attempts=10, connect_delay=1.0, niceness=10):
+    """Connect to a SocketExecutor at address (a (host, port) tuple)
+    and evaluate tasks until the server shuts down.
+    authkey must be the server's key.
+    Returns the number of tasks evaluated.
+    """
+    if isinstance(authkey, str):
+        authkey = authkey.encode('utf-8')
+    if name is None:
+        name = f'{os.uname().nodename}:{os.getpid()}'
+    if niceness:
+        os.nice(niceness)
+
+    for attempt in range(connect_attempts):
+        try:
+            conn = multiprocessing.connection.Client(address, authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            if attempt + 1 >= connect_attempts:
+                raise
+            time.sleep(connect_delay)
+
+    send_lock = threading.Lock()
+    tasks = 0
+    try:
+        conn.send(('hello', name))
+        tag, initializer, initargs = conn.recv()
+        if initializer is not None:
+            initializer(*initargs)
+
+        while True:
+            with send_lock:
+                conn.send(('ready',))
+            msg = conn.recv()
+            if msg[0] == 'shutdown':
+                return tasks
+            _, task_id, fn, args = msg
+
+            done = threading.Event()
+            heartbeat = threading.Thread(target=_heartbeat_loop,
+                                         args=(conn, send_lock, task_id, heartbeat_interval, done),
+                                         daemon=True)
+            heartbeat.start()
+            try:
+                reply = ('result', task_id, True, fn(*args))
+            except Exception:
+                reply = ('result', task_id, False, traceback.format_exc())
+            finally:
+                done.set()
+                heartbeat.join()
+
+            with send_lock:
+                conn.send(reply)
+            tasks += 1
+    except (OSError, EOFError):
+        # the server went away
+        return tasks
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--connect', type=str, required=True,
+                        help='server address, as host:port')
+    parser.add_argument('--authkey', type=str, required=True,
+                        help='shared secret used to authenticate with the server')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes to run in parallel')
+    parser.add_argument('--heartbeat', type=float, default=5.0,
+                        help='seconds between heartbeats while evaluating')
+    args = parser.parse_args()
+
+    host, port = args.connect.rsplit(':', 1)
+    address = (host, int(port))
+
+    procs = []
+    for i in range(args.workers):
+        name = f'{os.uname().nodename}:{i}'
+        p = multiprocessing.Process(target=run_worker, args=(address, args.authkey),
+                                    kwargs={'name': name, 'heartbeat_interval': args.heartbeat})
+        p.start()
+        procs.append(p)
+
+    print(f'{args.workers:d} worker processes connecting to {host}:{port}.')
+    for p in procs:
+        p.join()
+    print('Goodbye!')
@@ -13,6 +13,8 @@ from adjustText import adjust_text
 
 from .utils import *
 from . import search
+from . import columnar
+from .progress import integrate_frontier, progress_series
 
 here = os.path.dirname(os.path.realpath(__file__))
 data_dir = os.path.join(here, 'new_again')
@@ -54,6 +56,16 @@ class ExperimentData(object):
     _data_suffix = '.json'
 
     def __init__(self):
+        # columnar exports are memory mapped, rather than parsed
+        for dname in os.listdir(data_dir):
+            dpath = os.path.join(data_dir, dname)
+            if os.path.isdir(dpath) and columnar.ColumnarData.is_export(dpath):
+                result_name = self._clean(dname)
+                if result_name in self.__dict__:
+                    raise ValueError(f'inappropriate result directory name {dname!r}\n'
+                                     f'  cleaned name {result_name!r} is already bound')
+                self.__dict__[result_name] = columnar.ColumnarData(dpath)
+
         files = filter(lambda name: name.endswith(self._data_suffix), os.listdir(data_dir))
         for fname in files:
             result_name = self._clean(fname[:-len(self._data_suffix)])
@@ -141,6 +153,7 @@ def plot_density(fname, sources, metrics, plot_settings = [],
         plot_count = 0
         for source, opts in zip(sources, plot_settings):
             all_points = source.history
+            partial = search.partial_indices(source)
             final_frontier = source.frontier
             frontier = []
             plot_points = []
@@ -159,7 +172,10 @@ def plot_density(fname, sources, metrics, plot_settings = [],
                         print('regressed a generation???')
                         print(i, point)
 
-                changed, frontier, _ = update_frontier(frontier, (tuple(data), tuple(measures)), metrics)
+                if i in partial:
+                    changed = False
+                else:
+                    changed, frontier, _ = update_frontier(frontier, (tuple(data), tuple(measures)), metrics)
                 if changed or i == len(all_points) - 1:
                     points_from_final = 0
                     for current_point in frontier:
@@ -218,67 +234,8 @@ def plot_density(fname, sources, metrics, plot_settings = [],
 
 
 
-def integrate_frontier(frontier, x_left=None, x_right=None, y_floor=None, y_ceil=None,
-                       x_idx=0, y_idx=1):
-    x_first = None
-    x_prev = None
-    y_prev = None
-
-    total_area = 0.0
-    for cfg, meas in sorted(frontier, key=nd_getter(1, x_idx)):
-        x, y = float(meas[x_idx]), float(meas[y_idx])
-        if math.isfinite(x) and math.isfinite(y):
-            if x_prev is None:
-                assert x_left is None or x_left <= x
-                x_first = x
-                x_prev = x
-                if y_floor is None:
-                    y_floor = y
-                y_prev = y
-            else:
-                assert x_prev <= x and y_prev <= y
-                if x_right is None:
-                    x_dist = x - x_prev
-                else:
-                    x_dist = min(x, x_right) - x_prev
-                x_prev = x
-                if y_ceil is None:
-                    y_dist = y_prev - y_floor
-                else:
-                    y_dist = min(y_ceil, y_prev) - y_floor
-                y_prev = y
-                if y_dist > 0 and x_dist > 0:
-                    # discount area under the floor
-                    # (this can happen when we first find a point,
-                    #  which happens to be worse than the best configuration
-                    #  in the final frontier with the lowest cost we ever see.)
-                    # also, discount area to the right of x_right,
-                    # which can happen when a very expensive point is first discovered,
-                    # which is subsequently improved upon even by a cheaper alternative.
-                    total_area += x_dist * y_dist
-
-                # if we've exceeded the ceiling, we actually want to stop early
-                if y_ceil is not None and y >= y_ceil:
-                    break
-
-    # extend over to the right
-    if x_right is not None and x_prev is not None and x_prev < x_right:
-        x_dist = x_right - x_prev
-        if y_ceil is None:
-            y_dist = y_prev - y_floor
-        else:
-            y_dist = min(y_ceil, y_prev) - y_floor
-        if y_dist > 0:
-            # we already checked x_dist when deciding if we should run
-            # this fixup code
-            total_area += x_dist * y_dist
-
-    return x_first, x_prev, y_floor, total_area
-
 def plot_progress(fname, sources, new_metrics, ceiling=None,
-                  plot_settings=[], axis_titles=[]):
-
-    update_metrics = [m for m in new_metrics if m is not None]
+                  plot_settings=[], axis_titles=[], per_generation=False):
 
     fig = plt.figure(figsize=(12,6), dpi=80)
     ax = fig.gca()
@@ -292,13 +249,13 @@ def plot_progress(fname, sources, new_metrics, ceiling=None,
         for source, opts in zip(sources, plot_settings):
             all_points = source.history
             final_frontier = filter_frontier(source.frontier, new_metrics)
-            frontier = []
             plot_points = []
             plot_points_capped = []
 
             x_left, x_right, y_floor, ref_area = integrate_frontier(
                 final_frontier, y_ceil=None, x_idx=x_idx, y_idx=y_idx,
             )
+            windows = [(x_right, y_floor, None)]
 
             last_ratio = 0
 
@@ -306,47 +263,35 @@ def plot_progress(fname, sources, new_metrics, ceiling=None,
                 x_left_capped, x_right_capped, y_floor_capped, ref_area_capped = integrate_frontier(
                     final_frontier, y_ceil=ceiling, x_idx=x_idx, y_idx=y_idx,
                 )
+                windows.append((x_right_capped, y_floor_capped, ceiling))
 
                 last_ratio_capped = 0
 
-            for i, point in enumerate(all_points):
-                if len(point) == 2:
-                    data, measures = point
-                if len(point) == 3:
-                    gen, data, measures = point
-
-                filtered_measures = tuple(meas for meas, m in zip(measures, new_metrics) if m is not None)
-
-                changed, frontier, _ = update_frontier(frontier, (tuple(data), filtered_measures), update_metrics)
-                if changed or i == len(all_points) - 1:
-                    x_left_current, x_right_current, y_floor_current, current_area = integrate_frontier(
-                        frontier, x_left=x_left, x_right=x_right, y_floor=y_floor, y_ceil=None, x_idx=x_idx, y_idx=y_idx,
-                    )
-                    # print(f'coverage: {current_area!s} / {ref_area!s}')
-                    # print(f'  from {x_left_current!s} - {x_right_current!s} of {x_left!s} - {x_right!s}')
-
-                    ratio = current_area / ref_area
+            if per_generation:
+                generations = source.generations
+            else:
+                generations = None
 
-                    if ratio < last_ratio:
-                        print(f'  RATIO DECREASED!!! {last_ratio!s} -> {ratio!s}')
+            # the frontier and its area are maintained as we go,
+            # rather than integrating the whole frontier again every time it changes
+            for i, areas in progress_series(all_points, new_metrics, windows, generations=generations,
+                                            skip=search.partial_indices(source)):
+                ratio = areas[0] / ref_area
 
-                    last_ratio = ratio
-                    plot_points.append((i, ratio))
+                if ratio < last_ratio:
+                    print(f'  RATIO DECREASED!!! {last_ratio!s} -> {ratio!s}')
 
-                    if ceiling is not None:
-                        x_left_current, x_right_current, y_floor_current, current_area = integrate_frontier(
-                            frontier, x_left=x_left_capped, x_right=x_right_capped, y_floor=y_floor_capped, y_ceil=ceiling, x_idx=x_idx, y_idx=y_idx,
-                        )
-                        # print(f' capped coverage: {current_area!s} / {ref_area!s}')
-                        # print(f'  from {x_left_current!s} - {x_right_current!s} of {x_left!s} - {x_right!s}')
+                last_ratio = ratio
+                plot_points.append((i, ratio))
 
-                        ratio = current_area / ref_area_capped
+                if ceiling is not None:
+                    ratio = areas[1] / ref_area_capped
 
-                        if ratio < last_ratio_capped:
-                            print(f'  RATIO DECREASED!!! {last_ratio!s} -> {ratio!s}')
+                    if ratio < last_ratio_capped:
+                        print(f'  RATIO DECREASED!!! {last_ratio!s} -> {ratio!s}')
 
-                        last_ratio_capped = ratio
-                        plot_points_capped.append((i, ratio))
+                    last_ratio_capped = ratio
+                    plot_points_capped.append((i, ratio))
 
             if plot_count == 1:
                 zidx = 96
@@ -404,7 +349,8 @@ def plot_frontier(fname, sources, new_metrics, plot_settings = [],
         for source, metric_group, plot_settings_group in zip(sources, new_metrics, plot_settings):
             plot_count += 1
             frontier = source.frontier
-            all_points = source.history
+            partial = search.partial_indices(source)
+            all_points = [point for i, point in enumerate(source.history) if i not in partial]
 
             print(f'f: {len(frontier)!s}, all: {len(all_points)!s}')
 
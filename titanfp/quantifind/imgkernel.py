@@ -0,0 +1,218 @@
+"""Vectorized evaluation of image kernels, and SSIM with NumPy.
+
+Running the blur from benchmarks.mk_blur through the MPMF interpreter
+is one interpreted operation per pixel, per channel, per mask entry.
+BlurKernel computes exactly the same thing over whole images at once,
+with the correctly rounded array operations from arithmetic.nprounding,
+so the output is the same as the interpreter's, bit for bit:
+
+  - Pixels are converted to the overall context through a lookup table,
+    built by the interpreter's own argument conversion for each distinct pixel value.
+  - The mask is evaluated by the interpreter, since it's only 9 values.
+  - Each of the 9 mask offsets is applied to the whole region of the image where it's
+    in bounds, in the same order as the for* loops, with the same rounding contexts.
+
+The bitcost reported by analysis.BitcostAnalysis doesn't depend on the pixel values,
+only on how many mask entries are in bounds around each pixel. That makes it
+an affine function of rows * cols and (3 * rows - 2) * (3 * cols - 2),
+the total number of in-bounds mask entries, so the coefficients
+are fit by running the interpreter on a few tiny images, and checked on another.
+
+Contexts that arithmetic.nprounding can't handle raise VectorRoundingError,
+in which case the caller should use the interpreter instead.
+"""
+
+import numpy as np
+
+from ..titanic import ndarray
+from ..arithmetic import mpmf, analysis, nprounding
+from ..arithmetic.nprounding import VectorRoundingError
+
+from .utils import load_cores
+from .benchmarks import mk_blur
+
+
+def lut_convert(a, ctx):
+    """Round every value of an integer array to ctx, with a lookup table
+    computed by the interpreter's argument conversion.
+    Non-real results come back as inf or nan.
+    """
+    values, inverse = np.unique(a, return_inverse=True)
+    table = np.empty(len(values), dtype=np.float64)
+    for i, v in enumerate(values):
+        x = mpmf.MPMF(int(v), ctx=ctx)
+        if x.isnan:
+            table[i] = np.nan
+        else:
+            table[i] = float(x)
+    return table[inverse].reshape(a.shape)
+
+
+class BlurKernel(object):
+    """The 3x3 mask blur from benchmarks.mk_blur, for one set of contexts.
+
+    mask is the mask argument, as an expression (i.e. from fpcparser.read_exprs).
+    Call the kernel on a (rows, cols, channels) integer array to get the blurred image
+    as a float64 array; cost(shape) is the bits_requested for an image of that shape.
+    """
+
+    def __init__(self, overall_ctx, mask_ctx, accum_ctx, mul_ctx, mask):
+        self.overall_ctx = overall_ctx
+        self.mask_ctx = mask_ctx
+        self.accum_ctx = accum_ctx
+        self.mul_ctx = mul_ctx
+        for ctx in (overall_ctx, mask_ctx, accum_ctx, mul_ctx):
+            if not nprounding.supported(ctx):
+                raise VectorRoundingError(f'unsupported context {ctx!r}')
+
+        self.prog = mk_blur(overall_ctx, mask_ctx, accum_ctx, mul_ctx)
+        self.mask = mask
+        self._mask_values = None
+        self._cost_coeffs = {}
+
+    def __repr__(self):
+        return '{}(overall={}, mask={}, accum={}, mul={})'.format(
+            type(self).__name__, self.overall_ctx.propstr(), self.mask_ctx.propstr(),
+            self.accum_ctx.propstr(), self.mul_ctx.propstr())
+
+    def _interpret(self, img, analyses=None):
+        evaltor = mpmf.Interpreter()
+        main = load_cores(evaltor, self.prog, analyses)
+        return evaltor, main, evaltor.interpret(main, [img, self.mask])
+
+    def mask_values(self):
+        """The mask, rounded as the interpreter would round it, as a 3x3 float64 array."""
+        if self._mask_values is None:
+            evaltor = mpmf.Interpreter()
+            main = load_cores(evaltor, self.prog)
+            # the image here is just a placeholder with the right number of dimensions
+            dummy = ndarray.NDArray(shape=(1, 1, 1), data=[0])
+            ctx = evaltor.arg_ctx(main, [dummy, self.mask])
+            mask = ctx.bindings['mask']
+            values = np.empty((3, 3), dtype=np.float64)
+            for y in range(3):
+                for x in range(3):
+                    values[y, x] = float(mask[y, x])
+            self._mask_values = values
+        return self._mask_values
+
+    def __call__(self, img):
+        img = np.asarray(img)
+        if img.ndim != 3:
+            raise ValueError(f'expecting a (rows, cols, channels) image, got shape {img.shape!r}')
+        rows, cols, channels = img.shape
+
+        pixels = lut_convert(img, self.overall_ctx)
+        mask = self.mask_values()
+
+        # the literal zeros that start the accumulations are exact in any context
+        mw = np.zeros((rows, cols), dtype=np.float64)
+        w = np.zeros((rows, cols, channels), dtype=np.float64)
+
+        for my in range(3):
+            dy = my - 1
+            # output rows for which the input row y + dy is in bounds
+            y0, y1 = max(0, -dy), min(rows, rows - dy)
+            for mx in range(3):
+                dx = mx - 1
+                x0, x1 = max(0, -dx), min(cols, cols - dx)
+                if y0 >= y1 or x0 >= x1:
+                    continue
+                m = mask[my, mx]
+                out = (slice(y0, y1), slice(x0, x1))
+                src = (slice(y0 + dy, y1 + dy), slice(x0 + dx, x1 + dx))
+
+                mw[out] = nprounding.add(mw[out], m, self.mask_ctx)
+                prod = nprounding.mul(m, pixels[src], self.mul_ctx)
+                w[out] = nprounding.add(w[out], prod, self.accum_ctx)
+
+        return nprounding.div(w, mw[:, :, np.newaxis], self.overall_ctx)
+
+    def _measure_cost(self, rows, cols, channels):
+        als = analysis.BitcostAnalysis()
+        img = ndarray.NDArray(shape=(rows, cols, channels), data=[0] * (rows * cols * channels))
+        self._interpret(img, [als])
+        return als.bits_requested
+
+    def cost(self, shape):
+        """The bitcost (bits_requested) the interpreter would report for an image of this shape."""
+        rows, cols, channels = shape
+        coeffs = self._cost_coeffs.get(channels)
+        if coeffs is None:
+            c11 = self._measure_cost(1, 1, channels)
+            c12 = self._measure_cost(1, 2, channels)
+            c22 = self._measure_cost(2, 2, channels)
+            # cost = k0 + a * (rows * cols) + b * (3 * rows - 2) * (3 * cols - 2)
+            d1 = c12 - c11
+            d2 = c22 - c12
+            b, rem = divmod(d2 - 2 * d1, 6)
+            a = d1 - 3 * b
+            k0 = c11 - a - b
+            coeffs = (k0, a, b)
+            if rem != 0 or self._affine_cost(coeffs, 2, 3) != self._measure_cost(2, 3, channels):
+                raise VectorRoundingError(f'bitcost of {self!r} is not affine in the image size')
+            self._cost_coeffs[channels] = coeffs
+        return self._affine_cost(coeffs, rows, cols)
+
+    @staticmethod
+    def _affine_cost(coeffs, rows, cols):
+        k0, a, b = coeffs
+        return k0 + a * rows * cols + b * (3 * rows - 2) * (3 * cols - 2)
+
+
+def to_pixels(a):
+    """Clamp and truncate a float64 image to 8-bit pixels, like ex_img.npify.
+    Non-real values raise an exception, as int() would.
+    """
+    if not np.all(np.isfinite(a)):
+        raise OverflowError('cannot convert non-real pixel values to integers')
+    return np.clip(np.trunc(a), 0, 255).astype(np.uint8)
+
+
+def _window_means(x, win_size):
+    # mean over every complete win_size x win_size window of a 2d array,
+    # from a summed area table
+    sat = np.zeros((x.shape[0] + 1, x.shape[1] + 1), dtype=x.dtype)
+    np.cumsum(np.cumsum(x, axis=0), axis=1, out=sat[1:, 1:])
+    k = win_size
+    sums = sat[k:, k:] - sat[:-k, k:] - sat[k:, :-k] + sat[:-k, :-k]
+    return sums / (k * k)
+
+def ssim_channel(a, b, win_size=7, data_range=255.0, k1=0.01, k2=0.03):
+    """Mean structural similarity of two 2d images, with the same definition as
+    skimage.metrics.structural_similarity with its default (uniform window) settings.
+    Only the windows that fit entirely inside the image are used, which are
+    the same ones skimage averages over after cropping its filtered images.
+    """
+    # window sums of integer pixels are exact in int64
+    if np.issubdtype(a.dtype, np.integer) and np.issubdtype(b.dtype, np.integer):
+        a = a.astype(np.int64)
+        b = b.astype(np.int64)
+    else:
+        a = a.astype(np.float64)
+        b = b.astype(np.float64)
+
+    ux = _window_means(a, win_size)
+    uy = _window_means(b, win_size)
+    uxx = _window_means(a * a, win_size)
+    uyy = _window_means(b * b, win_size)
+    uxy = _window_means(a * b, win_size)
+
+    n = win_size * win_size
+    cov_norm = n / (n - 1)
+    vx = cov_norm * (uxx - ux * ux)
+    vy = cov_norm * (uyy - uy * uy)
+    vxy = cov_norm * (uxy - ux * uy)
+
+    c1 = (k1 * data_range) ** 2
+    c2 = (k2 * data_range) ** 2
+    s = ((2 * ux * uy + c1) * (2 * vxy + c2)) / ((ux * ux + uy * uy + c1) * (vx + vy + c2))
+    return s.mean(dtype=np.float64)
+
+def ssim(a, b, win_size=7):
+    """Mean SSIM of two images, averaged over channels if they have a third dimension."""
+    if a.shape != b.shape:
+        raise ValueError(f'images must have the same shape, got {a.shape!r} and {b.shape!r}')
+    if a.ndim == 2:
+        return ssim_channel(a, b, win_size=win_size)
+    return np.mean([ssim_channel(a[:, :, c], b[:, :, c], win_size=win_size) for c in range(a.shape[2])])
@@ -0,0 +1,258 @@
+"""Frontier progress: how much of a reference frontier a search has covered over time.
+
+The progress of a search is measured in two dimensions, a cost to minimize (x)
+and a quality to maximize (y), as the area under the staircase of the current frontier,
+between the cheapest point and x_right, and above y_floor (and optionally below a ceiling).
+These are the same conventions as figures.plot_progress,
+which takes the bounds from the final frontier of each search.
+
+integrate_frontier computes the area of a whole frontier at once.
+FrontierProgress keeps the frontier sorted, and updates the area as points are added:
+each point costs a binary search and a constant amount of area arithmetic
+(plus the points it removes from the frontier), rather than re-integrating the whole frontier.
+Inserting into the sorted lists still moves O(f) entries for a frontier with f points,
+but that is a memmove, not Python work, so it is cheap next to the rest.
+"""
+
+import math
+import bisect
+import operator
+
+
+def integrate_frontier(frontier, x_left=None, x_right=None, y_floor=None, y_ceil=None,
+                       x_idx=0, y_idx=1):
+    x_first = None
+    x_prev = None
+    y_prev = None
+
+    total_area = 0.0
+    for cfg, meas in sorted(frontier, key=lambda t: t[1][x_idx]):
+        x, y = float(meas[x_idx]), float(meas[y_idx])
+        if math.isfinite(x) and math.isfinite(y):
+            if x_prev is None:
+                assert x_left is None or x_left <= x
+                x_first = x
+                x_prev = x
+                if y_floor is None:
+                    y_floor = y
+                y_prev = y
+            else:
+                assert x_prev <= x and y_prev <= y
+                if x_right is None:
+                    x_dist = x - x_prev
+                else:
+                    x_dist = min(x, x_right) - x_prev
+                x_prev = x
+                if y_ceil is None:
+                    y_dist = y_prev - y_floor
+                else:
+                    y_dist = min(y_ceil, y_prev) - y_floor
+                y_prev = y
+                if y_dist > 0 and x_dist > 0:
+                    # discount area under the floor
+                    # (this can happen when we first find a point,
+                    #  which happens to be worse than the best configuration
+                    #  in the final frontier with the lowest cost we ever see.)
+                    # also, discount area to the right of x_right,
+                    # which can happen when a very expensive point is first discovered,
+                    # which is subsequently improved upon even by a cheaper alternative.
+                    total_area += x_dist * y_dist
+
+                # if we've exceeded the ceiling, we actually want to stop early
+                if y_ceil is not None and y >= y_ceil:
+                    break
+
+    # extend over to the right
+    if x_right is not None and x_prev is not None and x_prev < x_right:
+        x_dist = x_right - x_prev
+        if y_ceil is None:
+            y_dist = y_prev - y_floor
+        else:
+            y_dist = min(y_ceil, y_prev) - y_floor
+        if y_dist > 0:
+            # we already checked x_dist when deciding if we should run
+            # this fixup code
+            total_area += x_dist * y_dist
+
+    return x_first, x_prev, y_floor, total_area
+
+
+class FrontierProgress(object):
+    """Incrementally maintained two dimensional frontier, and the area it covers.
+
+    metric_fns should have exactly two metrics that are not None:
+    a cost (operator.lt) and a quality (operator.gt), in that order.
+    Each window is a tuple (x_right, y_floor, y_ceil) to measure area in,
+    with the same meaning as the arguments to integrate_frontier;
+    y_ceil may be None.
+
+    Adding a point changes the frontier exactly as update_frontier would;
+    points with nan metrics are ignored.
+    """
+
+    def __init__(self, metric_fns, windows=()):
+        idxs = [i for i, f in enumerate(metric_fns) if f is not None]
+        if len(idxs) != 2:
+            raise ValueError(f'expecting exactly two metrics, got {repr(metric_fns)}')
+        self.x_idx, self.y_idx = idxs
+        if metric_fns[self.x_idx] is not operator.lt or metric_fns[self.y_idx] is not operator.gt:
+            raise ValueError(f'expecting a cost (operator.lt) and then a quality (operator.gt), got {repr(metric_fns)}')
+        self.windows = [tuple(window) for window in windows]
+
+        # the frontier, sorted by x; along it y never decreases
+        self.xs = []
+        self.ys = []
+        self.results = []
+        # the points with finite coordinates, which are the ones that cover any area,
+        # and the area each one covers (out to the next point) in each window
+        self.fxs = []
+        self.fys = []
+        self.segs = [[] for _ in self.windows]
+        self.areas = [0.0 for _ in self.windows]
+        # updated areas pick up rounding error, so they are summed exactly again
+        # after every len(fxs) updates, which amortizes to O(1) per point
+        self.stale = 0
+
+    def __len__(self):
+        return len(self.results)
+
+    @property
+    def frontier(self):
+        return list(self.results)
+
+    def _seg(self, w, i):
+        x_right, y_floor, y_ceil = self.windows[w]
+        x = self.fxs[i]
+        if i + 1 < len(self.fxs):
+            x_next = self.fxs[i + 1]
+        elif x_right is None:
+            return 0.0
+        else:
+            x_next = math.inf
+        if x_right is not None:
+            x_next = min(x_next, x_right)
+        y = self.fys[i]
+        if y_ceil is not None:
+            y = min(y_ceil, y)
+        x_dist = x_next - x
+        y_dist = y - y_floor
+        if x_dist > 0 and y_dist > 0:
+            return x_dist * y_dist
+        else:
+            return 0.0
+
+    def add(self, cfg, qos):
+        """Try to add a point to the frontier; returns True if the frontier changed."""
+        x, y = float(qos[self.x_idx]), float(qos[self.y_idx])
+        if math.isnan(x) or math.isnan(y):
+            return False
+
+        # the point with the best y among those that are at least as cheap
+        k = bisect.bisect_right(self.xs, x) - 1
+        equal = False
+        if k >= 0:
+            kx, ky = self.xs[k], self.ys[k]
+            if ky > y or (ky == y and kx < x):
+                return False
+            elif ky == y and kx == x:
+                # same metrics as points already on the frontier; only a new configuration counts
+                j = k
+                while j >= 0 and self.xs[j] == x and self.ys[j] == y:
+                    if self.results[j][0] == cfg:
+                        return False
+                    j -= 1
+                equal = True
+
+        # everything at least as expensive and no better is dominated,
+        # which is a contiguous run starting where the new point goes
+        if equal:
+            i0 = i1 = k + 1
+            fi0 = fi1 = bisect.bisect_right(self.fxs, x)
+        else:
+            i0 = bisect.bisect_left(self.xs, x)
+            i1 = bisect.bisect_right(self.ys, y, i0)
+            fi0 = bisect.bisect_left(self.fxs, x)
+            fi1 = bisect.bisect_right(self.fys, y, fi0)
+
+        self.xs[i0:i1] = [x]
+        self.ys[i0:i1] = [y]
+        self.results[i0:i1] = [(cfg, qos)]
+
+        # the segments ending at the new point are replaced, as is the one before it
+        removed = [math.fsum(segs[max(fi0 - 1, 0):fi1]) for segs in self.segs]
+
+        if math.isfinite(x) and math.isfinite(y):
+            self.fxs[fi0:fi1] = [x]
+            self.fys[fi0:fi1] = [y]
+            for segs in self.segs:
+                segs[fi0:fi1] = [0.0]
+            changed_segs = (fi0 - 1, fi0)
+        else:
+            self.fxs[fi0:fi1] = []
+            self.fys[fi0:fi1] = []
+            for segs in self.segs:
+                segs[fi0:fi1] = []
+            changed_segs = (fi0 - 1,)
+
+        self.stale += 1
+        resum = self.stale >= len(self.fxs)
+        if resum:
+            self.stale = 0
+        for w, segs in enumerate(self.segs):
+            added = []
+            for i in changed_segs:
+                if 0 <= i < len(segs):
+                    segs[i] = self._seg(w, i)
+                    added.append(segs[i])
+            if resum:
+                self.areas[w] = math.fsum(segs)
+            else:
+                self.areas[w] = math.fsum([self.areas[w], -removed[w]] + added)
+
+        return True
+
+
+def generation_ends(generations, n):
+    """History index of the last point in each generation,
+    from the horizon sizes in a SearchState's generation records.
+    Clamped to the n points in the history, in case the last generation was only partly evaluated.
+    """
+    ends = []
+    total = 0
+    for horizon_size, new_frontier_points in generations:
+        total += horizon_size
+        if total > 0:
+            ends.append(min(total, n) - 1)
+    return ends
+
+def progress_series(history, metric_fns, windows, generations=None, skip=None):
+    """Walk the history once, and yield (i, areas), where areas is the area covered in each window
+    by the frontier of the first i+1 points.
+
+    By default, a pair is produced each time the frontier changes, and for the last point.
+    If generations (from a SearchState) is given, a pair is produced at the end of each generation instead.
+    Points whose indices are in skip (e.g. search.partial_indices of the state)
+    are left out of the frontier, but still count towards the indices.
+    """
+    engine = FrontierProgress(metric_fns, windows)
+    last = len(history) - 1
+    if generations is None:
+        ends = None
+    else:
+        ends = set(generation_ends(generations, len(history)))
+        ends.add(last)
+
+    for i, point in enumerate(history):
+        if len(point) == 3:
+            gen, cfg, qos = point
+        else:
+            cfg, qos = point
+        if skip and i in skip:
+            changed = False
+        else:
+            changed = engine.add(tuple(cfg), tuple(qos))
+        if ends is None:
+            if changed or i == last:
+                yield i, list(engine.areas)
+        elif i in ends:
+            yield i, list(engine.areas)
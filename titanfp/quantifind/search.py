@@ -12,6 +12,9 @@ import math
 import re
 
 from .utils import *
+from . import executors
+from . import telemetry as _telemetry
+from . import columnar
 
 
 # general utilities
@@ -399,6 +402,19 @@ class SearchSettings(object):
         return new_settings
 
 
+def partial_indices(state):
+    """History indices of results that successive halving dropped before the final fidelity,
+    for a SearchState, or anything with the same fidelities and final_fidelity (like a columnar export).
+    These are still in the history, so indices (and generations) line up,
+    but their metrics are only from a partial evaluation, so they are not real points.
+    """
+    fidelities = getattr(state, 'fidelities', None)
+    if not fidelities:
+        return set()
+    final_fidelity = getattr(state, 'final_fidelity', None)
+    return {i for i, fidelity in enumerate(fidelities) if fidelity != final_fidelity}
+
+
 class SearchState(object):
     """State container for QuantiFind search."""
 
@@ -411,6 +427,8 @@ class SearchState(object):
 
         # We also keep around a list of every configuration we have ever run, in order,
         self.history = []
+        # along with the fidelity level it was last evaluated at (None for a plain evaluation)
+        self.fidelities = []
         # and an index to look them up by configuration parameters (partly for caching reasons):
         self.cache = {}
 
@@ -459,6 +477,14 @@ class SearchState(object):
         # count of total points explored, and new frontier points found, for each generation
         self.generations = []
 
+        # for multi-fidelity search: the frontier of every result seen at each partial fidelity level,
+        # used to decide which configurations to promote to the next level
+        self.rung_frontiers = {}
+        # and the final fidelity level; results in the history at any other level
+        # were dropped by successive halving, and their metrics only come from a partial evaluation,
+        # so they are not real points (see partial_indices)
+        self.final_fidelity = None
+
         # for the stopping criteria: the count of "initial" configs run and "initial" generations
         #   A generation is initial if it was created while the search was exhausted;
         #   i.e. the previous generation failed to add anything to the Pareto frontier.
@@ -466,6 +492,16 @@ class SearchState(object):
         self.initial_cfgs = 0
         self.initial_gens = 0
 
+        # configurations that were never run, because a bound on their metrics
+        # showed they could not reach the frontier; maps each one to its bound
+        self.pruned = {}
+
+        # configurations whose evaluation was killed by the executor for going over budget,
+        # whose worker died, or that were lost with their workers too many times;
+        # maps each one to a pair (kind, used), i.e. ('time', seconds), ('memory', bytes),
+        # ('died', exit code) or ('lost', attempts)
+        self.exceeded = {}
+
         # additional data specific to this search, e.g. serializable test inputs
         self.additional_data = {}
 
@@ -481,6 +517,8 @@ class SearchState(object):
             f'  frontier log: {len(self.frontier_log)}\n'
             f'  frontier:     {len(self.frontier)}\n'
             f'  running for {len(self.generations)} generations'
+        ) + (f'\n  {len(self.pruned)} configurations pruned' if len(self.pruned) > 0 else ''
+        ) + (f'\n  {len(self.exceeded)} configurations over budget' if len(self.exceeded) > 0 else ''
         ) + (f'\n  {len(self.additional_data)} additional data records' if len(self.additional_data) > 0 else '')
 
     def to_dict(self):
@@ -488,11 +526,16 @@ class SearchState(object):
             'frontier': list(self.frontier),
             'horizon': list(self.horizon),
             'history': list(self.history),
+            'fidelities': list(self.fidelities),
             'cache': list(self.cache.items()),
             'frontier_log': list(self.frontier_log),
             'generations': list(self.generations),
+            'rung_frontiers': list(self.rung_frontiers.items()),
+            'final_fidelity': self.final_fidelity,
             'initial_cfgs': self.initial_cfgs,
             'initial_gens': self.initial_gens,
+            'pruned': list(self.pruned.items()),
+            'exceeded': list(self.exceeded.items()),
             'additional_data': self.additional_data,
         }
         return d
@@ -503,11 +546,17 @@ class SearchState(object):
         new_state.__dict__['frontier'] = [(tuple(a), tuple(b)) for a, b in d['frontier']]
         new_state.__dict__['horizon'] = [(tuple(a), tuple(b)) for a, b in d['horizon']]
         new_state.__dict__['history'] = [(tuple(a), tuple(b)) for a, b in d['history']]
+        new_state.__dict__['fidelities'] = list(d.get('fidelities', [None] * len(d['history'])))
         new_state.__dict__['cache'] = dict((tuple(k), list(v)) for k, v in d['cache'])
         new_state.__dict__['frontier_log'] = [[(tuple(a), tuple(b)), v1, v2] for (a, b), v1, v2 in d['frontier_log']]
         new_state.__dict__['generations'] = [tuple(a) for a in d['generations']]
+        new_state.__dict__['rung_frontiers'] = dict((k, [(tuple(a), tuple(b)) for a, b in v])
+                                                    for k, v in d.get('rung_frontiers', []))
+        new_state.__dict__['final_fidelity'] = d.get('final_fidelity', None)
         new_state.__dict__['initial_cfgs'] = d['initial_cfgs']
         new_state.__dict__['initial_gens'] = d['initial_gens']
+        new_state.__dict__['pruned'] = dict((tuple(k), tuple(v)) for k, v in d.get('pruned', []))
+        new_state.__dict__['exceeded'] = dict((tuple(k), tuple(v)) for k, v in d.get('exceeded', []))
         new_state.__dict__['additional_data'] = d['additional_data']
         return new_state
 
@@ -573,8 +622,8 @@ class SearchState(object):
                 if verbose and (fidx is not None or cfg in deduped_frontier_log):
                     print(f'-- CHECK SEARCHSTATE: configuration {repr(cfg)} on the horizon '
                           f'reports fidx={fidx}, last seen at {actual_fidx} --')
-            elif hidx is None:
-                # or, if it isn't on the horizon, and it has no hidx, something is wrong
+            elif hidx is None and cfg not in self.pruned:
+                # or, if it isn't on the horizon, and it has no hidx, and we didn't prune it, something is wrong
                 consistent = False
                 if verbose:
                     print(f'-- CHECK SEARCHSTATE: configuration {repr(cfg)} is not recorded in history or on the horizon --')
@@ -643,7 +692,9 @@ class SearchState(object):
                         for thing in removed:
                             print('--> ', repr(thing))
             else:
-                frontier, removed = reconstruct_frontier(self.history, metric_fns, check=False, verbose=verbose)
+                partial = partial_indices(self)
+                frontier, removed = reconstruct_frontier([result for i, result in enumerate(self.history) if i not in partial],
+                                                         metric_fns, check=False, verbose=verbose)
 
             frontier_cfgs = set(map(operator.itemgetter(0), frontier))
 
@@ -754,6 +805,28 @@ class SearchState(object):
                 self.horizon.append(cfg)
             return repeat_cfgs
 
+    def prune_horizon(self, bound_fn, metric_fns):
+        """Remove configurations from the horizon that can't improve the frontier.
+        bound_fn(cfg) should return the best metric values that cfg could possibly achieve,
+        or None if it doesn't know.
+        Pruned configurations stay in the cache, so they won't be suggested again.
+        Returns the number of configurations removed.
+        """
+        if not self.frontier:
+            return 0
+
+        new_horizon = collections.deque()
+        pruned_cfgs = 0
+        for cfg in self.horizon:
+            bound = bound_fn(cfg)
+            if bound is not None and dominated_by_frontier(bound, self.frontier, metric_fns):
+                self.pruned[cfg] = tuple(bound)
+                pruned_cfgs += 1
+            else:
+                new_horizon.append(cfg)
+        self.horizon = new_horizon
+        return pruned_cfgs
+
     def get_from_horizon(self, n=None):
         """Get n configurations from the horizon to work on next;
         presumably this is a batch to process,
@@ -766,10 +839,15 @@ class SearchState(object):
             # so that we can't break it by mutating the deque
             return list(itertools.islice(self.horizon, n))
 
-    def commit_to_history(self, result, metric_fns, verbose=True):
+    def commit_to_history(self, result, metric_fns, fidelity=None, final=True, verbose=True):
         """Commit an evaluated configuration to the history,
         updating the Pareto frontier in the process.
         Does not update the state's generation info.
+
+        For multi-fidelity search, fidelity records the level the result was evaluated at.
+        If final is False, the result came from a partial evaluation
+        and is recorded in the history without trying to add it to the frontier;
+        anything that rebuilds frontiers from the history should leave it out (see partial_indices).
         """
         cfg, qos = result
         if len(self.horizon) > 0:
@@ -789,8 +867,12 @@ class SearchState(object):
 
         hidx = len(self.history)
         self.history.append(result)
+        self.fidelities.append(fidelity)
         record[0] = hidx
 
+        if not final:
+            return False
+
         keep, new_frontier, removed = update_frontier(self.frontier, result, metric_fns)
         if keep:
             fidx = len(self.frontier_log)
@@ -854,8 +936,8 @@ class Sweep(object):
 
     def __init__(self, eval_fn, init_fns, neighbor_fns, metric_fns,
                  settings=None, state=None, cores=None, batch=None, retry_attempts=1,
-                 threaded_writes=True,
-                 verbosity=3):
+                 threaded_writes=True, executor=None, fidelities=None, halving_rate=3,
+                 bound_fn=None, failure_qos=None, telemetry=None, verbosity=3):
         self.eval_fn = eval_fn
         self.init_fns = init_fns
         self.neighbor_fns = neighbor_fns
@@ -872,6 +954,29 @@ class Sweep(object):
         self.batch = batch
         self.retry_attempts = retry_attempts
         self.threaded_writes = threaded_writes
+        # any object with the executor interface (see executors.py);
+        # if None, evaluate on a local multiprocessing pool
+        self.executor = executor
+        # for multi-fidelity search, an increasing sequence of fidelity levels;
+        # if provided, eval_fn is called with the fidelity level as one more positional argument
+        # after the configuration parameters, i.e. eval_fn(*cfg, fidelity), and must accept it
+        # (ex_dotprod.dotprod_stage does, where the fidelity is the number of trials to run);
+        # each batch is run with a successive halving schedule,
+        # keeping about 1/halving_rate of the configurations at each level
+        if fidelities is None:
+            self.fidelities = None
+        else:
+            self.fidelities = tuple(fidelities)
+        self.halving_rate = halving_rate
+        # optional cheap estimate of the best metrics a configuration could achieve;
+        # bound_fn(*cfg) returns a tuple like the output of eval_fn (or None),
+        # and configurations that are already dominated by the frontier are never evaluated
+        self.bound_fn = bound_fn
+        # metrics to record for an evaluation the executor killed for going over budget;
+        # if None, use the worst possible value for each metric
+        self.failure_qos = failure_qos
+        # optional telemetry.Telemetry object to report throughput and utilization to
+        self.telemetry = telemetry
         self.verbosity = verbosity
 
         # handle this with a context manager
@@ -887,20 +992,31 @@ class Sweep(object):
         self.checkpoint_outdir = 'checkpoints'
         self.snapshot_name = 'frontier' + self.checkpoint_suffix
         self.snapshot_every = 1.0
+        # columnar export of the state, for figures and viz
+        self.export_columns = True
+        self.columns_name = 'columns'
+        self.columns = None
         # currently set in the run method
         self.logdir = None
         # for threaded writes
         self.checkpoint_thread = None
         self.snapshot_thread = None
 
+    def make_executor(self):
+        """Return the executor to evaluate configurations with."""
+        if self.executor is None:
+            return executors.PoolExecutor(self.cores)
+        else:
+            return self.executor
+
     def __enter__(self):
-        self.pool = multiprocessing.Pool(self.cores, initializer=os.nice, initargs=(10,))
+        self.pool = self.make_executor().__enter__()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.pool is not None:
-            self.pool.close()
-            self.pool.join()
+            self.pool.__exit__(exc_type, exc_val, exc_tb)
+            self.pool = None
 
     def __repr__(self):
         return f'<{type(self).__name__} object at {hex(id(self))} with {len(self.state.cache)} configurations>'
@@ -919,10 +1035,18 @@ class Sweep(object):
             lines.append(f'  batch size: {self.batch}')
         if self.retry_attempts > 0:
             lines.append(f'  retries:    {self.retry_attempts}')
+        if self.fidelities is not None:
+            lines.append(f'  fidelities: {repr(self.fidelities)} (halving rate {self.halving_rate})')
+        if self.bound_fn is not None:
+            lines.append(f'  bounds:     {repr(self.bound_fn)}')
+        if self.telemetry is not None:
+            lines.append(f'  telemetry:  {repr(self.telemetry)}')
         if self.verbosity >= 0:
             lines.append(f'  verbosity:  {self.verbosity}')
         if self.pool is not None:
             lines.append(f'  with worker pool {repr(self.pool)}')
+        elif self.executor is not None:
+            lines.append(f'  with executor {repr(self.executor)}')
         return '\n'.join(lines)
 
     def setup_checkpoints(self, checkpoint_dir):
@@ -931,6 +1055,7 @@ class Sweep(object):
             print(f'Saving checkpoints to {checkpoint_dir}.')
 
         self.logdir = checkpoint_dir
+        self.columns = None
 
         if os.path.exists(self.logdir):
             abs_logdir = os.path.abspath(self.logdir.rstrip('/'))
@@ -987,6 +1112,13 @@ class Sweep(object):
             'frontier': list(self.state.frontier),
         }
 
+        if self.export_columns:
+            # only appends what's new, so this is cheap enough to do in the main thread
+            columns_path = os.path.join(logdir, self.columns_name)
+            if self.columns is None or self.columns.path != columns_path:
+                self.columns = columnar.ColumnarWriter(columns_path)
+            self.columns.sync(self.state, settings=data['settings'])
+
         if self.threaded_writes:
             args = (data, fname)
             kwargs = {
@@ -1018,6 +1150,7 @@ class Sweep(object):
 
     def snapshot_frontier(self, logdir):
         """Save a snapshot of the current frontier."""
+        start = time.perf_counter()
         fname = self.snapshot_name
         work_dir = os.path.join(logdir, self.checkpoint_tmpdir)
         target_dir = logdir
@@ -1038,6 +1171,9 @@ class Sweep(object):
         else:
             log_and_copy(data, fname, work_dir=work_dir, target_dir=target_dir)
 
+        if self.telemetry is not None:
+            self.telemetry.record_checkpoint(time.perf_counter() - start, kind='snapshot')
+
 
     # batch generation methods will "poke" the current cache state,
     # but do not create any new entries or add things to the horizon.
@@ -1452,6 +1588,157 @@ class Sweep(object):
             print(f'  Added {len(batch)} exhaustive configurations to the horizon.')
         return len(batch)
 
+    def prune_horizon(self):
+        """Prune configurations from the horizon using the bound function, if there is one.
+        Returns the number of configurations removed.
+        """
+        if self.bound_fn is None:
+            return 0
+        if not self.state.frontier or not self.state.horizon:
+            return 0
+
+        # bounds can take a while (bitcost analysis walks the whole program),
+        # so they are computed on the executor like evaluations
+        if self.pool is None:
+            with self.make_executor() as pool:
+                bounds = self.compute_bounds(pool, list(self.state.horizon))
+        else:
+            bounds = self.compute_bounds(self.pool, list(self.state.horizon))
+
+        pruned_cfgs = self.state.prune_horizon(bounds.get, self.metric_fns)
+
+        if self.verbosity >= 1 and pruned_cfgs > 0:
+            print(f'  Pruned {pruned_cfgs} configurations that cannot reach the frontier.')
+        return pruned_cfgs
+
+    def compute_bounds(self, pool, cfgs):
+        """Compute bound_fn for each configuration on the executor.
+        Returns a dict from configurations to bounds; a bound is None if
+        its computation went over budget, or its worker died or was lost.
+        """
+        async_results = [(cfg, pool.apply_async(self.bound_fn, cfg)) for cfg in cfgs]
+        bounds = {}
+        for cfg, ares in async_results:
+            try:
+                bounds[cfg] = ares.get()
+            except (executors.BudgetExceededError, executors.WorkerDiedError, executors.LostWorkError):
+                bounds[cfg] = None
+        return bounds
+
+    def collect(self, cfg, ares):
+        """Wait for the result of evaluating cfg.
+        If the executor stopped the evaluation for going over its budget,
+        or the worker running it died (or was lost too many times), record that in the state,
+        and return the failure metrics instead.
+        """
+        try:
+            result = ares.get()
+        except (executors.BudgetExceededError, executors.WorkerDiedError, executors.LostWorkError) as e:
+            self.state.exceeded[cfg] = (e.kind, e.used)
+            if self.telemetry is not None:
+                self.telemetry.observe_failure()
+            if self.verbosity >= 2:
+                if isinstance(e, executors.WorkerDiedError):
+                    print(f'-- worker died evaluating configuration {repr(cfg)} --', flush=True)
+                elif isinstance(e, executors.LostWorkError):
+                    print(f'-- configuration {repr(cfg)} was lost after {e.used} attempts --', flush=True)
+                else:
+                    print(f'-- configuration {repr(cfg)} exceeded its {e.kind} budget --', flush=True)
+            if self.failure_qos is None:
+                return worst_qos(self.metric_fns)
+            else:
+                return self.failure_qos
+
+        if self.telemetry is None:
+            return result
+        else:
+            qos, seconds = result
+            self.telemetry.observe_eval(seconds)
+            return qos
+
+    def dispatch(self, pool, args):
+        """Submit eval_fn(*args) to the executor;
+        with telemetry, the call is wrapped to time it on the worker.
+        """
+        if self.telemetry is None:
+            return pool.apply_async(self.eval_fn, args)
+        else:
+            return pool.apply_async(_telemetry.timed_call, (self.eval_fn,) + tuple(args))
+
+    def evaluate_batch(self, pool, cfgs):
+        """Generator to evaluate a list of configurations at full fidelity.
+        Yields triples of (cfg, qos, fidelity) in order as they become available.
+        """
+        async_results = []
+        for cfg in cfgs:
+            async_results.append(self.dispatch(pool, cfg))
+
+        if self.verbosity >= 2:
+            print(f'    dispatched {len(async_results)} evaluations...')
+
+        for cfg, ares in zip(cfgs, async_results):
+            yield cfg, self.collect(cfg, ares), None
+
+    def promote(self, results, fidelity):
+        """Decide which of a list of partial results (cfg, qos) evaluated at fidelity
+        to promote to the next fidelity level.
+
+        Results are ranked into successive Pareto layers.
+        Everything that is not dominated by any result ever seen at this fidelity
+        could still reach the frontier, so it is always promoted;
+        further layers are promoted until about 1/halving_rate of the results have been kept.
+        Also updates the state's record of the frontier at this fidelity.
+        """
+        rung_frontier = self.state.rung_frontiers.get(fidelity, [])
+        target = math.ceil(len(results) / self.halving_rate)
+
+        combined_frontier, _ = reconstruct_frontier(rung_frontier + results, self.metric_fns)
+        self.state.rung_frontiers[fidelity] = combined_frontier
+
+        combined_cfgs = set(map(operator.itemgetter(0), combined_frontier))
+        promoted = [cfg for cfg, qos in results if cfg in combined_cfgs]
+        remaining = [result for result in results if result[0] not in combined_cfgs]
+
+        while remaining and len(promoted) < target:
+            layer, _ = reconstruct_frontier(remaining, self.metric_fns)
+            layer_cfgs = set(map(operator.itemgetter(0), layer))
+            promoted.extend(cfg for cfg, qos in remaining if cfg in layer_cfgs)
+            remaining = [result for result in remaining if result[0] not in layer_cfgs]
+
+        return promoted
+
+    def successive_halving(self, pool, cfgs):
+        """Evaluate a list of configurations with a successive halving schedule.
+        Every configuration is evaluated at the lowest fidelity;
+        only the promising ones are evaluated again at each higher level.
+        Returns a list of triples (cfg, qos, fidelity) in the same order as cfgs,
+        with the result from the highest fidelity each configuration reached.
+        """
+        final_results = {}
+        candidates = list(cfgs)
+        for level, fidelity in enumerate(self.fidelities):
+            async_results = []
+            for cfg in candidates:
+                async_results.append(self.dispatch(pool, cfg + (fidelity,)))
+
+            if self.verbosity >= 2:
+                print(f'    dispatched {len(async_results)} evaluations at fidelity {fidelity!r}...')
+
+            results = []
+            for cfg, ares in zip(candidates, async_results):
+                qos = self.collect(cfg, ares)
+                results.append((cfg, qos))
+                final_results[cfg] = (qos, fidelity)
+
+            if level + 1 < len(self.fidelities):
+                candidates = self.promote(results, fidelity)
+                if self.verbosity >= 2:
+                    print(f'    promoted {len(candidates)} of {len(results)} configurations.')
+                if not candidates:
+                    break
+
+        return [(cfg, *final_results[cfg]) for cfg in cfgs]
+
     def process_batch(self, pool):
         """Run a batch of configurations from the horizon,
         and commit the results to the state.
@@ -1463,21 +1750,23 @@ class Sweep(object):
             else:
                 print(f'    processing the entire horizon...')
 
+        batch_start = time.perf_counter()
         cfgs = self.state.get_from_horizon(self.batch)
-        async_results = []
-        for cfg in cfgs:
-            async_results.append(pool.apply_async(self.eval_fn, cfg))
-
-        if self.verbosity >= 2:
-            print(f'    dispatched {len(async_results)} evaluations...')
+        if self.fidelities is None:
+            results = self.evaluate_batch(pool, cfgs)
+            final_fidelity = None
+        else:
+            results = self.successive_halving(pool, cfgs)
+            final_fidelity = self.fidelities[-1]
+            self.state.final_fidelity = final_fidelity
 
         new_frontier_points = 0
         pending_point = False
         last_snapshot = time.time()
-        for cfg, ares in zip(cfgs, async_results):
-            qos = ares.get()
+        for cfg, qos, fidelity in results:
             result = cfg, qos
-            if self.state.commit_to_history(result, self.metric_fns, verbose=self.verbosity>=3):
+            if self.state.commit_to_history(result, self.metric_fns, fidelity=fidelity, final=(fidelity == final_fidelity),
+                                            verbose=self.verbosity>=3):
                 new_frontier_points += 1
                 pending_point = True
                 if self.verbosity >= 3:
@@ -1502,8 +1791,14 @@ class Sweep(object):
         if self.verbosity >= 3:
             print(flush=True)
 
+        if self.telemetry is not None:
+            self.telemetry.record_batch(len(self.state.generations) - 1,
+                                        time.perf_counter() - batch_start, batch_start, len(cfgs),
+                                        new_frontier_points, len(self.state.horizon), len(self.state.frontier),
+                                        getattr(pool, 'workers', None))
+
         if self.verbosity >= 2:
-            print(f'    processed {len(async_results)} configurations, added {new_frontier_points} to the frontier.')
+            print(f'    processed {len(cfgs)} configurations, added {new_frontier_points} to the frontier.')
         return new_frontier_points
 
     def run_generation(self, pool=None):
@@ -1518,11 +1813,13 @@ class Sweep(object):
         if self.verbosity >= 1:
             print(f'  Evaluating the horizon for generation {gen_idx}...')
 
+        gen_start = time.perf_counter()
+
         if pool is None:
             pool = self.pool
 
         if pool is None:
-            with multiprocessing.Pool(self.cores) as pool:
+            with self.make_executor() as pool:
                 while len(self.state.horizon) > 0:
                     new_frontier_points += self.process_batch(pool)
                     self.state.generations[gen_idx] = (horizon_size, new_frontier_points)
@@ -1534,6 +1831,12 @@ class Sweep(object):
         if self.verbosity >= 1:
             print(f'  Evaluated {horizon_size} configurations for generation {gen_idx}, added {new_frontier_points} to the frontier.')
 
+        if self.telemetry is not None:
+            self.telemetry.record_generation(gen_idx, time.perf_counter() - gen_start, horizon_size, new_frontier_points,
+                                             len(self.state.frontier), len(self.state.cache),
+                                             sum(record[2] for record in self.state.cache.values()),
+                                             len(self.state.pruned))
+
         return new_frontier_points
 
     def cleanup_horizon(self, pool=None):
@@ -1560,7 +1863,7 @@ class Sweep(object):
             pool = self.pool
 
         if pool is None:
-            with multiprocessing.Pool(self.cores) as pool:
+            with self.make_executor() as pool:
                 while len(self.state.horizon) > 0:
                     new_frontier_points += self.process_batch(pool)
                     self.state.generations[gen_idx] = (horizon_size, old_frontier_points + new_frontier_points)
@@ -1577,7 +1880,10 @@ class Sweep(object):
         """used in run_search"""
         if self.verbosity >= 0:
             print(flush=True)
+        start = time.perf_counter()
         self.checkpoint(self.logdir, name='latest')
+        if self.telemetry is not None:
+            self.telemetry.record_checkpoint(time.perf_counter() - start)
         if self.verbosity >= 0:
             print(flush=True)
     def _final_checkpoint(self):
@@ -1601,6 +1907,8 @@ class Sweep(object):
             print('Running QuantiFind sweep...')
 
         self.setup_checkpoints(checkpoint_dir)
+        if self.telemetry is not None:
+            self.telemetry.start(self.logdir)
 
         if self.verbosity >= 2:
             print(self)
@@ -1613,11 +1921,11 @@ class Sweep(object):
                 print(flush=True)
 
             # try to expand the horizon
-            new_cfgs = self.expand_horizon()
+            new_cfgs = self.expand_horizon() - self.prune_horizon()
 
             # no normal way to expand locally; try randomly as a backup
             if new_cfgs <= 0:
-                new_cfgs = self.explore_randomly(self.settings.initial_gen_size)
+                new_cfgs = self.explore_randomly(self.settings.initial_gen_size) - self.prune_horizon()
 
             if new_cfgs <= 0:
                 if self.verbosity >= 0:
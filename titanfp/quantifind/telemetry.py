@@ -0,0 +1,317 @@
+"""Throughput and utilization metrics for the QuantiFind search driver.
+
+A Telemetry object is given to a Sweep, which reports each batch, generation,
+and checkpoint to it. Every report is appended as one JSON record to a log file
+(rotated when it grows past max_bytes), and if a prom_path is given,
+the running totals are also written there in the Prometheus text exposition format,
+for a local scraper (e.g. the node exporter's textfile collector) to pick up.
+
+To see where the time goes:
+  - busy_seconds is time the workers spent inside the evaluation function;
+    compare it with the workers' total available time (busy + idle)
+    to see if the search is keeping the workers fed.
+  - overhead_seconds is time between dispatching a batch and collecting its results
+    that isn't accounted for by the evaluations themselves, divided over the workers:
+    pickling, IPC, and waiting on stragglers.
+  - driver_seconds is time the search spent in the main process outside of batches,
+    expanding the horizon and updating the frontier.
+  - checkpoint_seconds is time the search was blocked saving checkpoints and snapshots.
+"""
+
+import os
+import time
+import json
+
+
+# default latency buckets, in seconds: roughly logarithmic from 1ms to about an hour
+default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0, 500.0, 1000.0, 2500.0)
+
+
+def timed_call(fn, *args):
+    """Call fn(*args), and return the result along with how long it took.
+    The Sweep dispatches this to the workers in place of the evaluation function
+    when it has telemetry to report to.
+    """
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+class Histogram(object):
+    """Cumulative histogram with fixed bucket boundaries, like a Prometheus histogram."""
+
+    def __init__(self, buckets=default_buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, x):
+        for i, bound in enumerate(self.buckets):
+            if x <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += x
+        self.n += 1
+
+    def cumulative(self):
+        """List of (upper_bound, count) pairs, ending with math.inf, as Prometheus wants them."""
+        pairs = []
+        running = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            running += count
+            pairs.append((bound, running))
+        return pairs
+
+    def quantile(self, q):
+        """Estimate the q quantile as the upper bound of the bucket it falls in."""
+        if self.n == 0:
+            return None
+        target = q * self.n
+        for bound, running in self.cumulative():
+            if running >= target:
+                return bound
+        return float('inf')
+
+    def to_dict(self):
+        return {
+            'buckets': list(self.buckets),
+            'counts': list(self.counts),
+            'sum': self.total,
+            'count': self.n,
+        }
+
+
+class Telemetry(object):
+    """Collects metrics from a Sweep and writes them out.
+
+    If path is None, the log is written to telemetry.jsonl in the Sweep's checkpoint directory.
+    """
+
+    def __init__(self, path=None, prom_path=None, max_bytes=16 << 20, backups=3,
+                 buckets=default_buckets, prefix='quantifind'):
+        self.path = path
+        self.prom_path = prom_path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.prefix = prefix
+
+        self.latency = Histogram(buckets)
+
+        # running totals
+        self.evaluations = 0
+        self.budget_failures = 0
+        self.batches = 0
+        self.generations = 0
+        self.busy_seconds = 0.0
+        self.idle_seconds = 0.0
+        self.overhead_seconds = 0.0
+        self.driver_seconds = 0.0
+        self.checkpoint_seconds = 0.0
+        self.checkpoints = 0
+        self.snapshots = 0
+        self.frontier_points = 0
+
+        # gauges, from the most recent report
+        self.workers = None
+        self.queue_depth = 0
+        self.frontier_size = 0
+        self.cache_size = 0
+        self.cache_hit_rate = None
+        self.configs_per_second = 0.0
+
+        # in-progress batch
+        self._batch_busy = 0.0
+        self._batch_evals = 0
+        self._last_batch_end = None
+        self.start_time = None
+
+    def __repr__(self):
+        return f'<{type(self).__name__} object at {hex(id(self))} logging to {repr(self.path)}>'
+
+    def start(self, logdir=None):
+        """Called by the Sweep when the search starts."""
+        if self.path is None:
+            if logdir is None:
+                self.path = 'telemetry.jsonl'
+            else:
+                self.path = os.path.join(logdir, 'telemetry.jsonl')
+        log_dir = os.path.dirname(self.path)
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+        self.start_time = time.time()
+        self._last_batch_end = time.perf_counter()
+        self.write('start')
+
+    # observations from the sweep
+
+    def observe_eval(self, seconds):
+        self.latency.observe(seconds)
+        self.evaluations += 1
+        self._batch_evals += 1
+        self._batch_busy += seconds
+
+    def observe_failure(self):
+        self.budget_failures += 1
+        self.evaluations += 1
+        self._batch_evals += 1
+
+    def record_batch(self, gen_idx, seconds, start, batch_size, new_frontier_points, queue_depth, frontier_size, workers):
+        """Report a finished batch that took seconds (of wall clock time)
+        and began at start (as measured by time.perf_counter).
+        """
+        self.batches += 1
+        self.frontier_points += new_frontier_points
+        self.queue_depth = queue_depth
+        self.frontier_size = frontier_size
+        self.workers = workers
+
+        if self._last_batch_end is not None:
+            self.driver_seconds += max(start - self._last_batch_end, 0.0)
+        self._last_batch_end = start + seconds
+
+        busy = self._batch_busy
+        if workers:
+            available = workers * seconds
+            idle = max(available - busy, 0.0)
+            overhead = max(seconds - (busy / workers), 0.0)
+        else:
+            idle = None
+            overhead = None
+        if idle is not None:
+            self.idle_seconds += idle
+            self.overhead_seconds += overhead
+        self.busy_seconds += busy
+
+        if seconds > 0:
+            self.configs_per_second = batch_size / seconds
+        else:
+            self.configs_per_second = 0.0
+
+        self.write('batch',
+                   generation=gen_idx,
+                   size=batch_size,
+                   seconds=seconds,
+                   configs_per_second=self.configs_per_second,
+                   busy_seconds=busy,
+                   idle_seconds=idle,
+                   overhead_seconds=overhead,
+                   workers=workers,
+                   queue_depth=queue_depth,
+                   frontier_size=frontier_size,
+                   new_frontier_points=new_frontier_points,
+                   latency_p50=self.latency.quantile(0.5),
+                   latency_p99=self.latency.quantile(0.99))
+
+        self._batch_busy = 0.0
+        self._batch_evals = 0
+
+    def record_generation(self, gen_idx, seconds, horizon_size, new_frontier_points, frontier_size,
+                          cache_size, cache_hits, pruned):
+        """Report a finished generation.
+        cache_hits is the total number of times any configuration was proposed,
+        so the fraction of proposals that were already known is 1 - cache_size / cache_hits.
+        """
+        self.generations += 1
+        self.frontier_size = frontier_size
+        self.cache_size = cache_size
+        if cache_hits > 0:
+            self.cache_hit_rate = 1.0 - cache_size / cache_hits
+        else:
+            self.cache_hit_rate = None
+
+        self.write('generation',
+                   generation=gen_idx,
+                   seconds=seconds,
+                   horizon_size=horizon_size,
+                   configs_per_second=(horizon_size / seconds if seconds > 0 else 0.0),
+                   new_frontier_points=new_frontier_points,
+                   frontier_size=frontier_size,
+                   cache_size=cache_size,
+                   cache_hit_rate=self.cache_hit_rate,
+                   pruned=pruned,
+                   latency=self.latency.to_dict())
+
+    def record_checkpoint(self, seconds, kind='checkpoint'):
+        """Report time the search was blocked writing a checkpoint or snapshot."""
+        self.checkpoint_seconds += seconds
+        if kind == 'snapshot':
+            self.snapshots += 1
+        else:
+            self.checkpoints += 1
+            # checkpoints happen between batches; don't count them as driver time
+            if self._last_batch_end is not None:
+                self._last_batch_end += seconds
+        self.write(kind, seconds=seconds)
+
+    # output
+
+    def rotate(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < self.max_bytes:
+            return
+        if self.backups <= 0:
+            os.remove(self.path)
+            return
+        for i in range(self.backups - 1, 0, -1):
+            older = f'{self.path}.{i:d}'
+            if os.path.exists(older):
+                os.replace(older, f'{self.path}.{i+1:d}')
+        os.replace(self.path, self.path + '.1')
+
+    def write(self, event, **fields):
+        record = {'event': event, 'time': time.time()}
+        record.update(fields)
+        self.rotate()
+        with open(self.path, 'at') as f:
+            f.write(json.dumps(record))
+            f.write('\n')
+        if self.prom_path is not None:
+            self.write_prom()
+
+    def write_prom(self):
+        p = self.prefix
+        lines = []
+
+        def metric(name, kind, doc, value):
+            if value is None:
+                return
+            lines.append(f'# HELP {p}_{name} {doc}')
+            lines.append(f'# TYPE {p}_{name} {kind}')
+            lines.append(f'{p}_{name} {value!r}')
+
+        metric('evaluations_total', 'counter', 'Configurations evaluated.', self.evaluations)
+        metric('budget_failures_total', 'counter', 'Evaluations killed for exceeding their budget.', self.budget_failures)
+        metric('batches_total', 'counter', 'Batches processed.', self.batches)
+        metric('generations_total', 'counter', 'Generations completed.', self.generations)
+        metric('worker_busy_seconds_total', 'counter', 'Worker time spent evaluating.', self.busy_seconds)
+        metric('worker_idle_seconds_total', 'counter', 'Worker time spent waiting for work.', self.idle_seconds)
+        metric('dispatch_overhead_seconds_total', 'counter', 'Batch time not explained by evaluation.', self.overhead_seconds)
+        metric('driver_seconds_total', 'counter', 'Time spent in the search driver between batches.', self.driver_seconds)
+        metric('checkpoint_seconds_total', 'counter', 'Time spent blocked on checkpoints and snapshots.', self.checkpoint_seconds)
+        metric('checkpoints_total', 'counter', 'Checkpoints written.', self.checkpoints)
+        metric('frontier_points_total', 'counter', 'Points added to the frontier.', self.frontier_points)
+        metric('configs_per_second', 'gauge', 'Throughput of the last batch.', self.configs_per_second)
+        metric('workers', 'gauge', 'Workers available to the executor.', self.workers)
+        metric('queue_depth', 'gauge', 'Configurations left on the horizon.', self.queue_depth)
+        metric('frontier_size', 'gauge', 'Points on the current frontier.', self.frontier_size)
+        metric('cache_size', 'gauge', 'Distinct configurations seen.', self.cache_size)
+        metric('cache_hit_rate', 'gauge', 'Fraction of proposed configurations that were already known.', self.cache_hit_rate)
+
+        name = f'{p}_eval_seconds'
+        lines.append(f'# HELP {name} Evaluation latency.')
+        lines.append(f'# TYPE {name} histogram')
+        for bound, count in self.latency.cumulative():
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{{le="{le}"}} {count:d}')
+        lines.append(f'{name}_sum {self.latency.total!r}')
+        lines.append(f'{name}_count {self.latency.n:d}')
+
+        # write atomically, so the scraper never sees a partial file
+        tmp_path = self.prom_path + '.tmp'
+        with open(tmp_path, 'wt') as f:
+            f.write('\n'.join(lines))
+            f.write('\n')
+        os.replace(tmp_path, self.prom_path)
@@ -5,6 +5,7 @@ import sys
 import random
 import math
 import json
+import operator
 
 from ..fpbench import fpcparser
 from ..arithmetic import ieee754, posit, evalctx
@@ -225,6 +226,36 @@ def filter_frontier(frontier, pred_fns, cfg_pred_fns=None):
             new_frontier.append(result)
     return new_frontier
 
+def dominated_by_frontier(qos, frontier, metric_fns):
+    """Check if some point on the frontier is at least as good as qos in every metric.
+    If qos has a None value for a metric that is not ignored,
+    nothing can be said about it, so return False.
+    """
+    if any(x is None for x, f in zip(qos, metric_fns) if f is not None):
+        return False
+    for frontier_cfg, frontier_qos in frontier:
+        comparison = compare_with_metrics(qos, frontier_qos, metric_fns, distinguish_incomparable=True)
+        if comparison is not None and comparison >= 0:
+            return True
+    return False
+
+def worst_qos(metric_fns):
+    """The worst possible metric values, to record for evaluations that failed.
+    Only understands the comparison functions from the operator module;
+    ignored metrics (None) get a value of None.
+    """
+    qos = []
+    for cmp_lt in metric_fns:
+        if cmp_lt is None:
+            qos.append(None)
+        elif cmp_lt is operator.lt or cmp_lt is operator.le:
+            qos.append(math.inf)
+        elif cmp_lt is operator.gt or cmp_lt is operator.ge:
+            qos.append(-math.inf)
+        else:
+            raise ValueError(f'no worst value for metric {repr(cmp_lt)}')
+    return tuple(qos)
+
 def check_frontier(frontier, metric_fns, verbose=True):
     """Quadratically check the frontier for well-formedness,
     explaining any discrepancies and returning a count;
@@ -9,6 +9,8 @@ import matplotlib.animation as animation
 
 from .utils import *
 from . import search
+from . import columnar
+from . import progress
 
 
 class SearchData(object):
@@ -18,6 +20,7 @@ class SearchData(object):
     final_name = 'final.json'
     snapshot_name = 'frontier.json'
     checkpoint_dirname = 'checkpoints'
+    columns_dirname = 'columns'
     checkpoint_re = re.compile('gen([0-9]+)' + re.escape('.json'))
     checkpoint_key = lambda s: int(checkpoint_re.fullmatch(s).group(1))
 
@@ -27,9 +30,11 @@ class SearchData(object):
         self.checkpoint_path = os.path.join(self.search_dir, self.checkpoint_name)
         self.final_path = os.path.join(self.search_dir, self.final_name)
         self.snapshot_path = os.path.join(self.search_dir, self.snapshot_name)
+        self.columns_path = os.path.join(self.search_dir, self.columns_dirname)
 
         self.settings = None
         self.state = None
+        self.columns = None
         self.frontier = None
         self.is_final = False
         self._load_files()
@@ -40,6 +45,10 @@ class SearchData(object):
         return data
 
     def _load_files(self):
+        if columnar.ColumnarData.is_export(self.columns_path):
+            self._load_columns()
+            return
+
         data = {}
         if os.path.exists(self.final_path):
             self.is_final = True
@@ -60,6 +69,34 @@ class SearchData(object):
         elif self.state is not None:
             self.frontier = self.state.frontier
 
+    def _load_columns(self):
+        # the columns have everything we need, without reading the full json checkpoint
+        if self.columns is None:
+            self.columns = columnar.ColumnarData(self.columns_path)
+        else:
+            self.columns.refresh()
+        self.state = self.columns
+
+        self.is_final = os.path.exists(self.final_path)
+        data = {}
+        if self.columns.settings is None:
+            # exports written before settings were kept in meta.json
+            for fpath in (self.final_path, self.checkpoint_path):
+                if os.path.exists(fpath):
+                    data.update(self._load_json(fpath))
+                    break
+        if not self.is_final and os.path.exists(self.snapshot_path):
+            data.update(self._load_json(self.snapshot_path))
+
+        if self.columns.settings is not None:
+            self.settings = search.SearchSettings.from_dict(self.columns.settings)
+        elif 'settings' in data:
+            self.settings = search.SearchSettings.from_dict(data['settings'])
+        if 'frontier' in data:
+            self.frontier = [(tuple(a), tuple(b)) for a, b in data['frontier']]
+        else:
+            self.frontier = self.columns.frontier
+
     def latest_checkpoint(self):
         """get the generation number of the most recently saved full checkpoint"""
         final = os.path.exists(self.final_path)
@@ -89,6 +126,25 @@ class SearchData(object):
                     print('refreshed frontier')
                     self.frontier = [(tuple(a), tuple(b)) for a, b in data['frontier']]
 
+    def progress(self, metric_fns, ceiling=None, per_generation=True):
+        """Frontier coverage over the course of the search, as a list of (history index, ratio),
+        measured against the current frontier the same way as figures.plot_progress.
+        """
+        if self.state is None or not self.state.history:
+            return []
+        reference = [(cfg, tuple(q for q, m in zip(qos, metric_fns) if m is not None))
+                     for cfg, qos in self.frontier]
+        x_left, x_right, y_floor, ref_area = progress.integrate_frontier(reference, y_ceil=ceiling)
+        if not ref_area > 0:
+            return []
+        if per_generation:
+            generations = self.state.generations
+        else:
+            generations = None
+        return [(i, areas[0] / ref_area) for i, areas in
+                progress.progress_series(self.state.history, metric_fns, [(x_right, y_floor, ceiling)],
+                                         generations=generations, skip=search.partial_indices(self.state))]
+
     def __repr__(self):
          if self.settings is not None:
              settings_str = 'settings'
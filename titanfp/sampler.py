@@ -0,0 +1,501 @@
+"""Bulk generation of random inputs for FPCores, filtered by their preconditions.
+
+Drawing one input at a time and running interpret_pre on it wastes most of the
+samples for cores with narrow preconditions, and builds a whole argument context
+for each of them. An InputSampler works on batches instead.
+
+Every value of an IEEE 754 or posit format (up to 64 bits) has an ordinal:
+an integer, in the same order as the values, with consecutive values having
+consecutive ordinals. Inputs are generated as numpy arrays of ordinals, either
+uniformly over the encodings of the format, or uniformly over the reals in a range
+(rounded to the format), and converted to bit patterns or to MPMF values at the end.
+
+Before sampling, the precondition is split into its conjuncts, and the ones that
+only compare inputs to constants (like (<= 0 x 1) or (< y 1e-3)) narrow the range
+of ordinals each input is drawn from, and those bounds are carried across comparisons
+between inputs, so (and (< y x) (<= x 2)) bounds y as well. Comparisons between inputs, and isnan, isinf
+and isfinite, are then checked on the whole batch at once, directly on the ordinals.
+Anything else in the precondition is checked the usual way, with interpret_pre,
+but only for the samples that survived everything else.
+"""
+
+import numpy as np
+
+from .fpbench import fpcast as ast
+from .titanic import digital
+from .arithmetic import evalctx
+from .arithmetic import ieee754
+from .arithmetic import posit
+from .arithmetic import mpmf
+from .titanic.ops import RM
+
+
+ctx_pre = evalctx.IEEECtx(es=20, nbits=532)
+
+# numpy types that round exactly like these IEEE 754 formats
+np_float_types = {
+    (5, 16): (np.float16, np.uint16),
+    (8, 32): (np.float32, np.uint32),
+    (11, 64): (np.float64, np.uint64),
+}
+
+
+class OrdinalFormat(object):
+    """The ordinals of an IEEE 754 or posit format.
+
+    IEEE 754 ordinals are the sign-magnitude bit patterns as signed integers
+    (so both zeros have ordinal 0), and posit ordinals are the two's complement
+    bit patterns as signed integers. NaN (or NaR) has no ordinal.
+    lo and hi are the smallest and largest ordinals of non-NaN values,
+    which include the infinities for IEEE 754 formats unless finite is set.
+    """
+
+    def __init__(self, ctx, finite=True):
+        if ctx.nbits > 64:
+            raise ValueError(f'can only sample formats of up to 64 bits, not {ctx!r}')
+        self.ctx = ctx
+        self.nbits = ctx.nbits
+        self.mask = (1 << ctx.nbits) - 1
+        if isinstance(ctx, evalctx.IEEECtx):
+            self.is_ieee = True
+            self.inf_ord = ((1 << ctx.es) - 1) << (ctx.p - 1)
+            self.hi = self.inf_ord - 1 if finite else self.inf_ord
+        elif isinstance(ctx, evalctx.PositCtx):
+            self.is_ieee = False
+            self.hi = (1 << (ctx.nbits - 1)) - 1
+        else:
+            raise ValueError(f'can only sample IEEE 754 or posit formats, not {ctx!r}')
+        self.lo = -self.hi
+
+    def to_bits(self, ords):
+        ords = np.asarray(ords, dtype=np.int64)
+        if self.is_ieee:
+            sign = np.uint64(1 << (self.nbits - 1))
+            return np.abs(ords).astype(np.uint64) | np.where(ords < 0, sign, np.uint64(0))
+        else:
+            return ords.astype(np.uint64) & np.uint64(self.mask)
+
+    def from_bits(self, bits):
+        """Ordinals of an array of bit patterns, and a mask of which ones are NaN."""
+        bits = np.asarray(bits, dtype=np.uint64)
+        if self.is_ieee:
+            mag = (bits & np.uint64(self.mask >> 1)).astype(np.int64)
+            negative = (bits >> np.uint64(self.nbits - 1)) != 0
+            return np.where(negative, -mag, mag), mag > self.inf_ord
+        else:
+            shift = np.uint64(64 - self.nbits)
+            ords = (bits << shift).view(np.int64) >> np.int64(64 - self.nbits)
+            return ords, ords == -(1 << (self.nbits - 1))
+
+    def ord_to_bits(self, o):
+        if self.is_ieee:
+            return -o | (1 << (self.nbits - 1)) if o < 0 else o
+        else:
+            return o & self.mask
+
+    def value(self, o):
+        """The value with ordinal o, as an MPMF."""
+        return self.bits_value(self.ord_to_bits(int(o)))
+
+    def bits_value(self, i):
+        if self.is_ieee:
+            x = ieee754.bits_to_digital(i, self.ctx)
+        else:
+            x = posit.bits_to_digital(i, self.ctx)
+        return mpmf.MPMF(x, ctx=self.ctx)
+
+    def ceil_ord(self, c):
+        """Smallest ordinal whose value is >= c, or hi + 1 if there isn't one."""
+        lo, hi = self.lo, self.hi + 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.value(mid) >= c:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def floor_ord(self, c):
+        """Largest ordinal whose value is <= c, or lo - 1 if there isn't one."""
+        lo, hi = self.lo - 1, self.hi
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self.value(mid) <= c:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+
+    def round_floats(self, xs):
+        """Ordinals of an array of float64s, rounded to the format."""
+        key = (self.ctx.es, self.nbits)
+        if self.is_ieee and key in np_float_types and self.ctx.rm == RM.RNE:
+            ftype, utype = np_float_types[key]
+            ords, _ = self.from_bits(xs.astype(ftype).view(utype))
+            return ords
+        ords = np.empty(len(xs), dtype=np.int64)
+        for i, x in enumerate(xs.tolist()):
+            rounded = mpmf.MPMF(x, ctx=self.ctx).as_ctx()
+            if self.is_ieee:
+                bits = ieee754.digital_to_bits(rounded, self.ctx)
+            else:
+                bits = posit.digital_to_bits(rounded, self.ctx)
+            ords[i] = self.from_bits([bits])[0][0]
+        return ords
+
+
+def conjuncts(e):
+    """The clauses of a precondition, with nested ands flattened."""
+    if isinstance(e, ast.And):
+        clauses = []
+        for child in e.children:
+            clauses.extend(conjuncts(child))
+        return clauses
+    else:
+        return [e]
+
+def free_vars(e):
+    if isinstance(e, ast.Var):
+        return {e.value}
+    elif isinstance(e, ast.ValueExpr):
+        return set()
+    vs = set()
+    for exprs in e.subexprs():
+        for child in exprs:
+            vs |= free_vars(child)
+    return vs
+
+
+comparisons = {
+    ast.LT: (lambda a, b: a < b),
+    ast.GT: (lambda a, b: a > b),
+    ast.LEQ: (lambda a, b: a <= b),
+    ast.GEQ: (lambda a, b: a >= b),
+    ast.EQ: (lambda a, b: a == b),
+}
+
+# x op c is the same as c flip[op] x
+flipped = {ast.LT: ast.GT, ast.GT: ast.LT, ast.LEQ: ast.GEQ, ast.GEQ: ast.LEQ, ast.EQ: ast.EQ}
+
+
+class InputSampler(object):
+    """Random arguments for core, in ctx, that satisfy its precondition.
+
+    dist is 'encodings' to draw every value of the format with the same probability,
+    or 'reals' to draw reals uniformly (then round them to the format), which needs
+    the range of every input to be bounded, either by the precondition or by ranges,
+    a dict from input names to (lo, hi) pairs of numbers (inclusive).
+    NaNs are never generated, and neither are infinities if finite is set.
+    Parts of the precondition that can't be checked on a batch are evaluated
+    in pre_ctx.
+    """
+
+    def __init__(self, core, ctx, dist='encodings', ranges=None, finite=True,
+                 batch_size=4096, max_batches=256, seed=None, pre_ctx=ctx_pre):
+        if dist not in ('encodings', 'reals'):
+            raise ValueError(f'unknown input distribution {dist!r}')
+        for name, props, shape in core.inputs:
+            if shape:
+                raise ValueError(f'can only sample scalar inputs, not {name!s} in fpcore:\n{core!s}')
+
+        self.core = core
+        self.ctx = ctx
+        self.dist = dist
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.pre_ctx = pre_ctx
+        self.rng = np.random.default_rng(seed)
+        self.fmt = OrdinalFormat(ctx, finite=finite)
+        self.names = [name for name, props, shape in core.inputs]
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.evaltor = mpmf.Interpreter()
+
+        self.lo = [self.fmt.lo] * len(self.names)
+        self.hi = [self.fmt.hi] * len(self.names)
+        if ranges:
+            for name, (lo, hi) in ranges.items():
+                i = self.index[name]
+                self.lo[i] = max(self.lo[i], self.fmt.ceil_ord(self.const(lo)))
+                self.hi[i] = min(self.hi[i], self.fmt.floor_ord(self.const(hi)))
+
+        self.checks = []
+        relations = []
+        residual = []
+        if core.pre is not None:
+            for clause in conjuncts(core.pre):
+                check = self.compile(clause)
+                if check is None:
+                    residual.append(clause)
+                else:
+                    self.narrow(clause, relations)
+                    self.checks.append(check)
+            self.propagate(relations)
+        if residual:
+            pre = residual[0] if len(residual) == 1 else ast.And(*residual)
+            self.residual = ast.FPCore(core.inputs, core.e, props=core.props, ident=core.ident, name=core.name, pre=pre)
+        else:
+            self.residual = None
+
+        if dist == 'reals':
+            self.bounds = []
+            for lo, hi in zip(self.lo, self.hi):
+                if lo <= hi:
+                    flo, fhi = float(self.fmt.value(lo)), float(self.fmt.value(hi))
+                    if not (np.isfinite(flo) and np.isfinite(fhi)):
+                        raise ValueError(f'uniform sampling over the reals needs bounded ranges for fpcore:\n{core!s}')
+                    self.bounds.append((flo, fhi))
+                else:
+                    self.bounds.append(None)
+
+        self.drawn = 0
+        self.accepted = 0
+        self.buffer = []
+
+    # analyzing the precondition
+
+    def const(self, x):
+        """The value of a constant (an expression with no inputs, or a number)."""
+        if isinstance(x, ast.Expr):
+            return self.evaltor.interpret(ast.FPCore([], x), [], ctx=self.pre_ctx)
+        elif isinstance(x, digital.Digital):
+            return x
+        else:
+            return mpmf.MPMF(x, ctx=self.pre_ctx)
+
+    def operand(self, e):
+        """('var', index) for an input, ('const', value) for a constant, or None."""
+        if isinstance(e, ast.Var):
+            if e.value in self.index:
+                return ('var', self.index[e.value])
+            return None
+        elif not free_vars(e):
+            try:
+                value = self.const(e)
+            except Exception:
+                return None
+            if isinstance(value, digital.Digital):
+                return ('const', value)
+        return None
+
+    def compile_cmp(self, op, a, b):
+        """A check for (op a b) on a batch of ordinals, or None."""
+        fmt = self.fmt
+        if a[0] == 'var' and b[0] == 'var':
+            cmp = comparisons[op]
+            i, j = a[1], b[1]
+            return lambda ords, nans: cmp(ords[:, i], ords[:, j]) & ~nans[:, i] & ~nans[:, j]
+        elif a[0] == 'const' and b[0] == 'const':
+            result = bool(comparisons[op](a[1], b[1]))
+            return lambda ords, nans: np.full(len(ords), result)
+        elif a[0] == 'const':
+            op, a, b = flipped[op], b, a
+
+        i, c = a[1], b[1]
+        if c.isnan:
+            return lambda ords, nans: np.zeros(len(ords), dtype=bool)
+        if op is ast.LT:
+            bound = fmt.ceil_ord(c)
+            return lambda ords, nans: (ords[:, i] < bound) & ~nans[:, i]
+        elif op is ast.LEQ:
+            bound = fmt.floor_ord(c)
+            return lambda ords, nans: (ords[:, i] <= bound) & ~nans[:, i]
+        elif op is ast.GT:
+            bound = fmt.floor_ord(c)
+            return lambda ords, nans: (ords[:, i] > bound) & ~nans[:, i]
+        elif op is ast.GEQ:
+            bound = fmt.ceil_ord(c)
+            return lambda ords, nans: (ords[:, i] >= bound) & ~nans[:, i]
+        else: # ast.EQ
+            lo, hi = fmt.ceil_ord(c), fmt.floor_ord(c)
+            return lambda ords, nans: (ords[:, i] >= lo) & (ords[:, i] <= hi) & ~nans[:, i]
+
+    def compile(self, e):
+        """A function from (ordinals, nan mask) to a boolean mask that checks e
+        on a whole batch, or None if e can't be checked that way.
+        """
+        if isinstance(e, (ast.And, ast.Or)):
+            checks = [self.compile(child) for child in e.children]
+            if any(check is None for check in checks):
+                return None
+            combine = np.logical_and if isinstance(e, ast.And) else np.logical_or
+            def check(ords, nans):
+                result = np.full(len(ords), isinstance(e, ast.And))
+                for child in checks:
+                    result = combine(result, child(ords, nans))
+                return result
+            return check
+        elif isinstance(e, ast.Not):
+            inner = self.compile(e.children[0])
+            if inner is None:
+                return None
+            return lambda ords, nans: ~inner(ords, nans)
+        elif isinstance(e, (ast.Isnan, ast.Isinf, ast.Isfinite)):
+            arg = self.operand(e.children[0])
+            if arg is None or arg[0] != 'var':
+                return None
+            i, inf = arg[1], self.fmt.inf_ord if self.fmt.is_ieee else None
+            if isinstance(e, ast.Isnan):
+                return lambda ords, nans: nans[:, i].copy()
+            elif isinstance(e, ast.Isinf):
+                return lambda ords, nans: (np.abs(ords[:, i]) == inf) & ~nans[:, i]
+            else:
+                return lambda ords, nans: (np.abs(ords[:, i]) != inf) & ~nans[:, i]
+        elif type(e) in comparisons or isinstance(e, ast.NEQ):
+            operands = [self.operand(child) for child in e.children]
+            if any(operand is None for operand in operands):
+                return None
+            if isinstance(e, ast.NEQ):
+                # every pair has to be different
+                pairs = [(a, b) for k, a in enumerate(operands) for b in operands[k+1:]]
+                checks = [self.compile_cmp(ast.EQ, a, b) for a, b in pairs]
+                def check(ords, nans):
+                    result = np.ones(len(ords), dtype=bool)
+                    for eq in checks:
+                        result &= ~eq(ords, nans)
+                    return result
+                return check
+            checks = [self.compile_cmp(type(e), a, b) for a, b in zip(operands, operands[1:])]
+            def check(ords, nans):
+                result = np.ones(len(ords), dtype=bool)
+                for cmp in checks:
+                    result &= cmp(ords, nans)
+                return result
+            return check
+        else:
+            return None
+
+    def narrow(self, clause, relations):
+        """Shrink the ranges of the inputs that clause compares to constants,
+        and add (i, strict, j) to relations for each x_i < x_j (or <=) it requires.
+        """
+        if type(clause) not in comparisons:
+            return
+        fmt = self.fmt
+        operands = [self.operand(child) for child in clause.children]
+        for a, b in zip(operands, operands[1:]):
+            op = type(clause)
+            if a[0] == 'var' and b[0] == 'var':
+                if op in (ast.GT, ast.GEQ):
+                    a, b = b, a
+                relations.append((a[1], op in (ast.LT, ast.GT), b[1]))
+                if op is ast.EQ:
+                    relations.append((b[1], False, a[1]))
+                continue
+            if a[0] == 'const' and b[0] == 'var':
+                op, a, b = flipped[op], b, a
+            if a[0] != 'var' or b[0] != 'const':
+                continue
+            i, c = a[1], b[1]
+            if c.isnan:
+                self.lo[i], self.hi[i] = fmt.hi, fmt.lo
+            elif op is ast.LT:
+                self.hi[i] = min(self.hi[i], fmt.ceil_ord(c) - 1)
+            elif op is ast.LEQ:
+                self.hi[i] = min(self.hi[i], fmt.floor_ord(c))
+            elif op is ast.GT:
+                self.lo[i] = max(self.lo[i], fmt.floor_ord(c) + 1)
+            elif op is ast.GEQ:
+                self.lo[i] = max(self.lo[i], fmt.ceil_ord(c))
+            else: # ast.EQ
+                self.lo[i] = max(self.lo[i], fmt.ceil_ord(c))
+                self.hi[i] = min(self.hi[i], fmt.floor_ord(c))
+
+    def propagate(self, relations):
+        """Carry bounds across comparisons between inputs: if x < y and y <= 2, then x < 2.
+        Ordinals are in the same order as the values, so this works on them directly.
+        """
+        for _ in range(len(self.names) + 1):
+            changed = False
+            for i, strict, j in relations:
+                hi = self.hi[j] - 1 if strict else self.hi[j]
+                lo = self.lo[i] + 1 if strict else self.lo[i]
+                if hi < self.hi[i]:
+                    self.hi[i] = hi
+                    changed = True
+                if lo > self.lo[j]:
+                    self.lo[j] = lo
+                    changed = True
+            if not changed:
+                break
+
+    # sampling
+
+    def candidates(self, n):
+        """A batch of n candidate ordinals for each input, in the narrowed ranges."""
+        ords = np.empty((n, len(self.names)), dtype=np.int64)
+        for i, (lo, hi) in enumerate(zip(self.lo, self.hi)):
+            if self.dist == 'encodings':
+                ords[:, i] = self.rng.integers(lo, hi, size=n, endpoint=True, dtype=np.int64)
+            else:
+                flo, fhi = self.bounds[i]
+                ords[:, i] = np.clip(self.fmt.round_floats(self.rng.uniform(flo, fhi, size=n)), lo, hi)
+        return ords
+
+    def check(self, ords, nans, bits):
+        """Mask of the rows that satisfy the precondition."""
+        mask = np.ones(len(ords), dtype=bool)
+        for check in self.checks:
+            mask &= check(ords, nans)
+        if self.residual is not None:
+            for k in np.flatnonzero(mask).tolist():
+                args = [self.fmt.bits_value(i) for i in bits[k].tolist()]
+                mask[k] = self.evaltor.interpret_pre(self.residual, args, ctx=self.pre_ctx)
+        return mask
+
+    def filter(self, ords):
+        """The rows of ords that satisfy the precondition."""
+        return ords[self.check(ords, np.zeros(ords.shape, dtype=bool), self.fmt.to_bits(ords))]
+
+    def accepts(self, bits):
+        """Mask of the rows of an (n, number of inputs) array of bit patterns
+        that satisfy the whole precondition.
+        """
+        bits = np.asarray(bits, dtype=np.uint64)
+        ords, nans = self.fmt.from_bits(bits)
+        return self.check(ords, nans, bits)
+
+    def values(self, row):
+        return [self.fmt.value(o) for o in row]
+
+    def sample_ordinals(self, n, partial=False):
+        """An (n, number of inputs) array of the ordinals of n accepted arguments.
+        If partial is set, stops after the first batch that had anything accepted,
+        and returns up to n rows.
+        """
+        if any(lo > hi for lo, hi in zip(self.lo, self.hi)):
+            raise ValueError(f'precondition of fpcore is unsatisfiable in {self.ctx!r}:\n{self.core!s}')
+        batches = []
+        found = 0
+        for _ in range(self.max_batches):
+            if found >= n or (partial and found > 0):
+                break
+            ords = self.filter(self.candidates(self.batch_size))
+            self.drawn += self.batch_size
+            self.accepted += len(ords)
+            batches.append(ords)
+            found += len(ords)
+        if found == 0 or (found < n and not partial):
+            raise ValueError(f'failed to meet precondition of fpcore ({self.accepted:d} of {self.drawn:d} samples accepted):\n{self.core!s}')
+        return np.concatenate(batches)[:n]
+
+    def sample_bits(self, n):
+        """An (n, number of inputs) array of the bit patterns of n accepted arguments."""
+        return self.fmt.to_bits(self.sample_ordinals(n))
+
+    def sample(self, n):
+        """A list of n lists of arguments, as MPMF values in ctx."""
+        return [self.values(row) for row in self.sample_ordinals(n).tolist()]
+
+    def draw(self):
+        """One list of arguments, from a buffer that is refilled a batch at a time."""
+        if not self.buffer:
+            self.buffer = self.sample_ordinals(self.batch_size, partial=True).tolist()
+            self.buffer.reverse()
+        return self.values(self.buffer.pop())
+
+    @property
+    def acceptance(self):
+        """Fraction of the candidates drawn (in the narrowed ranges) that were accepted."""
+        if self.drawn == 0:
+            return None
+        return self.accepted / self.drawn
@@ -0,0 +1,461 @@
+# aioserver: asyncio front end for the webdemo, with a worker pool that can kill runaway evaluations
+
+import sys
+import html
+import json
+import http
+import urllib
+import asyncio
+import traceback
+import tempfile
+import multiprocessing
+import concurrent.futures
+from email.utils import formatdate
+
+from . import fserver
+from . import aserver
+from . import webdemo
+from . import imgstore
+
+
+class WorkerError(Exception):
+    """The function raised an exception in the worker process."""
+
+class PoolBusyError(Exception):
+    """Too many requests are already waiting for a worker."""
+
+
+def worker_main(conn):
+    # run (fn, args) jobs until the connection is closed or we get None
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+        fn, args = job
+        try:
+            reply = (True, fn(*args))
+        except Exception:
+            reply = (False, traceback.format_exc())
+        try:
+            conn.send(reply)
+        except (EOFError, OSError):
+            break
+    conn.close()
+
+
+# Workers are started by a fork server, so they don't inherit the sockets of open
+# connections (which would keep those connections from closing until the worker exits).
+def worker_context():
+    mp_ctx = multiprocessing.get_context('forkserver')
+    mp_ctx.set_forkserver_preload([webdemo.__name__])
+    return mp_ctx
+
+class Worker(object):
+    """A worker process, and our end of the pipe to it."""
+
+    def __init__(self, mp_ctx):
+        self.conn, child_conn = mp_ctx.Pipe()
+        self.process = mp_ctx.Process(target=worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    # blocking; runs in a thread
+    def call(self, fn, args):
+        self.conn.send((fn, args))
+        return self.conn.recv()
+
+    def kill(self):
+        self.process.terminate()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (EOFError, OSError):
+            pass
+        self.conn.close()
+
+
+class WorkerPool(object):
+    """At most n worker processes, each running one job at a time.
+
+    Unlike a multiprocessing.Pool, a job can be abandoned: if it times out or
+    the task awaiting it is cancelled, the process running it is terminated
+    and replaced by a fresh one. If max_pending jobs are already running or
+    waiting for a worker, new ones are refused with PoolBusyError.
+
+    Starting a process can take a while (the first one also starts the fork
+    server), so processes are started on the executor, never on the event loop;
+    call start to have all n running before the first job arrives.
+    """
+
+    def __init__(self, n, max_pending=None, mp_ctx=None):
+        self.n = n
+        self.mp_ctx = mp_ctx if mp_ctx is not None else worker_context()
+        self.max_pending = max_pending
+        self.pending = 0
+        self.idle = []
+        self.slots = asyncio.Semaphore(n)
+        # killed workers can leave a thread finishing up, so allow some extra
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=2 * n)
+        self.killed = 0
+        self.closed = False
+
+    async def _spawn(self):
+        loop = asyncio.get_running_loop()
+        started = loop.run_in_executor(self.executor, Worker, self.mp_ctx)
+        try:
+            return await asyncio.shield(started)
+        except asyncio.CancelledError:
+            # the process still starts; stop it when it does
+            started.add_done_callback(lambda f: f.exception() is None and f.result().stop())
+            raise
+
+    async def start(self):
+        workers = await asyncio.gather(*(self._spawn() for i in range(self.n - len(self.idle))))
+        self.idle.extend(workers)
+
+    async def apply(self, fn, args, timeout=None):
+        if self.max_pending is not None and self.pending >= self.max_pending:
+            raise PoolBusyError('{:d} requests already waiting'.format(self.pending))
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        try:
+            async with self.slots:
+                worker = self.idle.pop() if self.idle else await self._spawn()
+                done = False
+                try:
+                    ok, value = await asyncio.wait_for(loop.run_in_executor(self.executor, worker.call, fn, args), timeout)
+                    done = True
+                finally:
+                    if done:
+                        self.idle.append(worker)
+                    else:
+                        # timed out, cancelled, or the worker died
+                        worker.kill()
+                        self.killed += 1
+                        if not self.closed:
+                            loop.run_in_executor(self.executor, worker.process.join)
+        finally:
+            self.pending -= 1
+
+        if ok:
+            return value
+        else:
+            raise WorkerError(value)
+
+    def close(self):
+        self.closed = True
+        for worker in self.idle:
+            worker.stop()
+        self.idle = []
+        self.executor.shutdown(wait=False)
+
+
+def json_error(message):
+    return json.dumps({'success': 0, 'message': message}).encode('utf-8')
+
+def html_page(title, body):
+    return bytes(
+        fserver.WEBPAGE_MESSAGE.format(title=html.escape(title, quote=False),
+                                       body=html.escape(body, quote=False)),
+        encoding='ascii')
+
+
+class TitanicApp(object):
+    """The same routes as webdemo.TitanicHTTPRequestHandler: static content, /eval,
+    which is run in the worker pool (through the response cache, if there is one)
+    with a deadline of timeout seconds, and result images from image_root,
+    rendered in render_pool.
+    """
+
+    def __init__(self, pool, content=None, cache=None, timeout=None, image_root=None, render_pool=None):
+        self.pool = pool
+        self.content = content if content is not None else {}
+        self.cache = cache
+        self.timeout = timeout
+        self.image_root = image_root
+        self.render_pool = render_pool if render_pool is not None else pool
+
+    def log(self, msg):
+        print(msg, file=sys.stderr, flush=True)
+
+    async def respond(self, method, target, data, headers=None):
+        """Returns (status, headers, body) for a request."""
+        path = urllib.parse.urlparse(target).path
+        if headers is None:
+            headers = {}
+
+        for alias in webdemo.path_aliases(path):
+            if alias in self.content:
+                (ctype, enc), cont = self.content[alias]
+                return http.HTTPStatus.OK, [('Content-Type', ctype)], cont
+
+        img_key = imgstore.img_key(path)
+        if img_key is not None and self.image_root is not None:
+            png = await self.image(img_key, headers.get('if-none-match'))
+            if png is not None:
+                status = http.HTTPStatus.NOT_MODIFIED if png is True else http.HTTPStatus.OK
+                return status, imgstore.img_headers(img_key), b'' if png is True else png
+
+        if path.lstrip('/') == 'eval':
+            if method != 'POST':
+                return http.HTTPStatus.METHOD_NOT_ALLOWED, [('Allow', 'POST')], b''
+            return http.HTTPStatus.OK, [('Content-Type', 'application/json')], await self.eval(data)
+
+        return (http.HTTPStatus.NOT_FOUND, [('Content-Type', fserver.WEBPAGE_CONTENT_TYPE)],
+                html_page('404 Not Found', 'Nothing to see here.'))
+
+    async def image(self, key, if_none_match):
+        """The PNG for key, True if the client already has it, or None if there isn't one."""
+        if imgstore.not_modified(key, if_none_match):
+            return True
+        try:
+            return await self.render_pool.apply(imgstore.render_image, (self.image_root, key), timeout=self.timeout)
+        except (asyncio.TimeoutError, PoolBusyError, WorkerError, EOFError, OSError) as e:
+            self.log('Unable to render image {}: {}'.format(key, repr(e)))
+            return None
+
+    async def eval(self, data):
+        key = webdemo.eval_cache_key(data) if data else None
+        if self.cache is not None and key is not None:
+            try:
+                result = self.cache.lookup(key)
+            except KeyError:
+                result = None
+            # responses link to images in the store, which may have been cleaned up since
+            if result is not None and (self.image_root is None or imgstore.keep_images(self.image_root, result)):
+                self.log('eval cache hit, {}'.format(self.cache.stats()))
+                return result
+
+        try:
+            result = await self.pool.apply(webdemo.run_eval, (data, self.image_root), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            return json_error('evaluation timed out after {} seconds'.format(self.timeout))
+        except PoolBusyError:
+            return json_error('server is busy, try again later')
+        except WorkerError as e:
+            self.log('Exception in evaluation worker:\n{}'.format(e))
+            return json_error('internal evaluator error')
+        except (EOFError, OSError) as e:
+            self.log('Evaluation worker died: {}'.format(repr(e)))
+            return json_error('internal evaluator error')
+
+        if self.cache is not None and key is not None:
+            if webdemo.eval_succeeded(result):
+                self.cache.update(key, result)
+            self.log('eval cache miss, {}'.format(self.cache.stats()))
+        return result
+
+
+class HTTPConnection(asyncio.Protocol):
+    """One client connection: HTTP/1.1 with keep-alive, one request at a time.
+    If the client goes away while a request is being handled, the handler is cancelled
+    (which kills its worker, if it has one).
+    """
+
+    server_version = 'aioserver/0.1'
+    max_header_bytes = 1 << 16
+    max_body_bytes = 1 << 28
+    keepalive_timeout = 30.0
+
+    def __init__(self, app):
+        self.app = app
+        self.transport = None
+        self.peer = '-'
+        self.buf = bytearray()
+        self.task = None
+        self.idle_timer = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        peer = transport.get_extra_info('peername')
+        if peer:
+            self.peer = str(peer[0])
+        self.reset_idle_timer()
+
+    def connection_lost(self, exc):
+        self.transport = None
+        if self.idle_timer is not None:
+            self.idle_timer.cancel()
+        if self.task is not None:
+            self.task.cancel()
+
+    def reset_idle_timer(self):
+        if self.idle_timer is not None:
+            self.idle_timer.cancel()
+        loop = asyncio.get_running_loop()
+        self.idle_timer = loop.call_later(self.keepalive_timeout, self.close)
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+    def data_received(self, data):
+        self.buf += data
+        if self.task is None:
+            self.next_request()
+
+    def next_request(self):
+        """Start handling the next request in the buffer, if it has all arrived."""
+        end = self.buf.find(b'\r\n\r\n')
+        if end < 0:
+            if len(self.buf) > self.max_header_bytes:
+                self.send_simple(http.HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+            return
+
+        try:
+            lines = self.buf[:end].decode('latin-1').split('\r\n')
+            method, target, version = lines[0].split()
+            headers = {}
+            for line in lines[1:]:
+                k, v = line.split(':', 1)
+                headers[k.strip().lower()] = v.strip()
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            self.send_simple(http.HTTPStatus.BAD_REQUEST)
+            return
+
+        if 'transfer-encoding' in headers:
+            self.send_simple(http.HTTPStatus.LENGTH_REQUIRED)
+            return
+        if length > self.max_body_bytes:
+            self.send_simple(http.HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            return
+        if len(self.buf) < end + 4 + length:
+            # wait for the rest of the body
+            return
+
+        data = bytes(self.buf[end + 4:end + 4 + length])
+        del self.buf[:end + 4 + length]
+
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.1':
+            keep_alive = connection != 'close'
+        else:
+            keep_alive = connection == 'keep-alive'
+
+        if self.idle_timer is not None:
+            self.idle_timer.cancel()
+            self.idle_timer = None
+        self.task = asyncio.ensure_future(self.handle(method, target, version, headers, data, keep_alive))
+
+    async def handle(self, method, target, version, request_headers, data, keep_alive):
+        requestline = '{} {} {}'.format(method, target, version)
+        try:
+            status, headers, body = await self.app.respond(method, target, data if method == 'POST' else None, request_headers)
+        except asyncio.CancelledError:
+            self.app.log('{} [{}] {} cancelled, client went away'.format(self.peer, formatdate(usegmt=True), repr(requestline)))
+            raise
+        except Exception:
+            self.app.log('Caught exception while preparing content.\n\n{}'.format(traceback.format_exc()))
+            status, headers, body = http.HTTPStatus.INTERNAL_SERVER_ERROR, [], b''
+
+        self.app.log('{} [{}] {} {:d}'.format(self.peer, formatdate(usegmt=True), repr(requestline), status.value))
+        self.send(status, headers, body, keep_alive, head=(method == 'HEAD'))
+        self.task = None
+
+        if self.transport is None:
+            return
+        if keep_alive:
+            self.reset_idle_timer()
+            self.next_request()
+        else:
+            self.close()
+
+    def send(self, status, headers, body, keep_alive, head=False):
+        if self.transport is None:
+            return
+        lines = ['HTTP/1.1 {:d} {}'.format(status.value, status.phrase),
+                 'Server: ' + self.server_version,
+                 'Date: ' + formatdate(usegmt=True),
+                 'Content-Length: {:d}'.format(len(body)),
+                 'Connection: ' + ('keep-alive' if keep_alive else 'close')]
+        lines += ['{}: {}'.format(k, v) for k, v in headers]
+        self.transport.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if not head:
+            self.transport.write(body)
+
+    def send_simple(self, status):
+        self.send(status, [], b'', False)
+        self.close()
+
+
+async def clean_images(store, max_bytes, max_age):
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, store.cleanup, max_bytes, max_age)
+        except Exception:
+            traceback.print_exc()
+        await asyncio.sleep(imgstore.cleanup_interval)
+
+
+async def serve(args):
+    loop = asyncio.get_running_loop()
+
+    if args.cache > 0 and args.cache_bytes > 0:
+        cache = aserver.AsyncCache(args.cache, max_bytes=args.cache_bytes)
+        print('Caching up to {:d} eval responses, {:d} bytes.'.format(args.cache, args.cache_bytes))
+    else:
+        cache = None
+
+    content = fserver.serve_flat_directory(args.serve) if args.serve else None
+    pool = WorkerPool(args.workers, max_pending=args.max_pending)
+    render_pool = WorkerPool(args.render_workers, max_pending=args.max_pending)
+    await asyncio.gather(pool.start(), render_pool.start())
+    image_root = args.images or tempfile.mkdtemp(prefix='titanic-img-')
+    print('Keeping up to {:d} bytes of images in {}.'.format(args.image_bytes, image_root))
+    cleaner = asyncio.ensure_future(clean_images(imgstore.ImageStore(image_root), args.image_bytes, args.image_age))
+    app = TitanicApp(pool, content=content, cache=cache, timeout=args.timeout if args.timeout > 0 else None,
+                     image_root=image_root, render_pool=render_pool)
+
+    print('{:d} worker processes, {} second timeout.'.format(args.workers, args.timeout))
+
+    server = await loop.create_server(lambda: HTTPConnection(app), args.host, args.port, reuse_address=True)
+    async with server:
+        print('Titanic webdemo on {}:{:d}.'.format(args.host, args.port))
+        print('Close stdin to stop.')
+        await loop.run_in_executor(None, sys.stdin.read)
+        print('Closed stdin, stopping...')
+
+    cleaner.cancel()
+    pool.close()
+    render_pool.close()
+    print('Goodbye!')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='localhost',
+                        help='server host')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='server port')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='number of worker processes to run in parallel')
+    parser.add_argument('--max-pending', type=int, default=64,
+                        help='number of requests that can wait for a worker before the server refuses more')
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help='seconds an evaluation can run before it is killed (0 for no limit)')
+    parser.add_argument('--serve', type=str, default='',
+                        help='serve a directory')
+    parser.add_argument('--cache', type=int, default=1024,
+                        help='number of eval responses to cache')
+    parser.add_argument('--cache-bytes', type=int, default=64 << 20,
+                        help='total size of cached eval responses, in bytes (0 to disable caching)')
+    parser.add_argument('--images', type=str, default='',
+                        help='directory to keep rendered images in (default: a temporary directory)')
+    parser.add_argument('--render-workers', type=int, default=1,
+                        help='number of worker processes to render images')
+    parser.add_argument('--image-bytes', type=int, default=256 << 20,
+                        help='total size of kept images, in bytes; the least recently used are deleted first')
+    parser.add_argument('--image-age', type=float, default=3600.0,
+                        help='seconds to keep data for images that are never looked at')
+    args = parser.parse_args()
+
+    asyncio.run(serve(args))
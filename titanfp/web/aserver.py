@@ -15,11 +15,15 @@ from socketserver import ThreadingMixIn, TCPServer
 _PREV, _NEXT, _KEY = 0, 1, 2
 
 # simple threadsafe key-value store with LRU
+# if max_bytes is given, the total sizeof() all the values is kept under it too,
+# and values bigger than that on their own aren't stored at all
 class AsyncCache(object):
 
-    def __init__(self, n = 1024):
+    def __init__(self, n = 1024, max_bytes = None, sizeof = len):
         self.n = int(n)
         assert self.n > 0
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
         self.lock = threading.Lock()
         self.reset()
 
@@ -39,30 +43,52 @@ class AsyncCache(object):
             last[_NEXT] = link
             link[_PREV] = last
 
+    # not threadsafe - only call if you have the lock!
+    def _remove(self, link):
+        link_prev, link_next, link_k = link
+        link_prev[_NEXT] = link_next
+        link_next[_PREV] = link_prev
+        v, link, size = self.cache.pop(link_k)
+        self.nbytes -= size
+
     # user-facing cache interface
 
     def reset(self):
         with self.lock:
-            # key : (value, link)
+            # key : (value, link, size)
             self.cache = {}
             # ordering for LRU, stored in circular doubly-linked listed
             self.root = []
             self.root[:] = (self.root, self.root, None,)
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
 
     def lookup(self, k):
         with self.lock:
             record = self.cache.get(k, None)
             if record is None:
                 # cache doesn't have it
+                self.misses += 1
                 raise KeyError(k)
             else:
-                v, link = record
+                v, link, size = record
                 self._move_to_front(link)
+                self.hits += 1
                 return v
 
     def update(self, k, v):
+        if self.max_bytes is None:
+            size = 0
+        else:
+            size = self.sizeof(v)
         with self.lock:
             record = self.cache.get(k, None)
+            if self.max_bytes is not None and size > self.max_bytes:
+                # too big to keep, and the old value is stale
+                if record is not None:
+                    self._remove(record[1])
+                return
             if record is None:
                 # insert a new element
                 if len(self.cache) < self.n:
@@ -70,7 +96,7 @@ class AsyncCache(object):
                     link = [last, self.root, k]
                     last[_NEXT] = link
                     self.root[_PREV] = link
-                    self.cache[k] = (v, link,)
+                    self.cache[k] = (v, link, size,)
                 # at capacity - move root to reclaim an existing slot in the DLL
                 else:
                     # root becomes new link
@@ -81,14 +107,26 @@ class AsyncCache(object):
                     old_k = self.root[_KEY]
                     self.root[_KEY] = None
                     # update cache
-                    del self.cache[old_k]
-                    self.cache[k] = (v, link,)
+                    self.nbytes -= self.cache.pop(old_k)[2]
+                    self.cache[k] = (v, link, size,)
             else:
-                old_v, link = record
+                old_v, link, old_size = record
                 # the key stays the same, move the existing one to the front
                 self._move_to_front(link)
                 # but we need to update the value in the cache
-                self.cache[k] = (v, link,)
+                self.cache[k] = (v, link, size,)
+                self.nbytes -= old_size
+            self.nbytes += size
+            # evict the least recently used values until everything fits
+            while self.max_bytes is not None and self.nbytes > self.max_bytes:
+                self._remove(self.root[_NEXT])
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            rate = self.hits / lookups if lookups > 0 else 0.0
+            return ('{:d} hits in {:d} lookups ({:.1%}), {:d} entries, {:d} bytes'
+                    .format(self.hits, lookups, rate, len(self.cache), self.nbytes))
 
     # serialization with json
 
@@ -101,7 +139,7 @@ class AsyncCache(object):
                 _, link_next, k = link
                 record = self.cache.get(k, None)
                 if record is not None:
-                    v, link = record
+                    v, link, size = record
                     jl.append((k, v,))
                 link = link_next
             return json.dumps(jl)
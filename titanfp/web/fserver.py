@@ -77,16 +77,37 @@ class AsyncHTTPRequestHandler(BaseHTTPRequestHandler):
     traceback_log = True
     traceback_send = True
 
+    # subclass and override to use caching (with an aserver.AsyncCache)
+    the_cache = None
+
     # subclass and override to process requests in parallel
     the_pool = None
 
-    # async calls
+    # async calls and caching
     def apply(self, fn, args):
         if self.the_pool is None:
             return fn(*args)
         else:
             return self.the_pool.apply(fn, args)
 
+    # a key of None is never cached, and results are only stored if keep(result) is true;
+    # a cached result is recomputed if valid(result) is false
+    def apply_cached(self, key, fn, args, keep=None, valid=None):
+        if self.the_cache is None or key is None:
+            return False, self.apply(fn, args)
+        else:
+            try:
+                hit = True
+                result = self.the_cache.lookup(key)
+                if valid is not None and not valid(result):
+                    raise KeyError(key)
+            except KeyError:
+                hit = False
+                result = self.apply(fn, args)
+                if keep is None or keep(result):
+                    self.the_cache.update(key, result)
+            return hit, result
+
     # These do not need to be overridden again; they just call send_head.
     def do_HEAD(self):
         self.send_head()
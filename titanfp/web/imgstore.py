@@ -0,0 +1,232 @@
+# imgstore: content-addressed store of images to render, so rendering happens off the eval path
+
+import os
+import io
+import re
+import json
+import time
+import hashlib
+import tempfile
+
+from PIL import Image
+import numpy as np
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from mpl_toolkits.mplot3d import Axes3D
+
+
+def bitmap_png(bitmap, params):
+    img = Image.fromarray(np.asarray(bitmap))
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue()
+
+def plot3d_png(points, params):
+    fig = plt.figure(figsize=tuple(params['figsize']), dpi=params['dpi'])
+    ax = Axes3D(fig)
+    ax.set_xlabel('x')
+    ax.set_ylabel('y')
+    ax.set_zlabel('z')
+    ax.plot(points[:, 0], points[:, 1], points[:, 2], color=params['color'], lw=1)
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    plt.close(fig)
+    return buf.getvalue()
+
+renderers = {
+    'bitmap': bitmap_png,
+    'plot3d': plot3d_png,
+}
+
+default_params = {
+    'bitmap': {},
+    'plot3d': {'figsize': [8, 6], 'dpi': 80, 'color': 'blue'},
+}
+
+key_re = re.compile(r'[0-9a-f]{40}')
+
+
+def write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class ImageStore(object):
+    """Images are stored by a hash of the data they are drawn from and the parameters
+    used to draw them. Evaluation only saves the data (put), which is cheap and
+    happens at most once for the same result; the PNG is rendered later, by whoever
+    asks for it first (render), and then kept. Everything lives in files under root,
+    so every process with the same root sees the same images.
+
+    Nothing is removed by put or render; the server calls cleanup now and then
+    to keep the store under a size limit.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key, ext):
+        return os.path.join(self.root, key + ext)
+
+    def put(self, kind, data, **params):
+        """Save data to be rendered as an image of the given kind. Returns the key."""
+        data = np.ascontiguousarray(data)
+        allparams = dict(default_params[kind])
+        allparams.update(params)
+        header = json.dumps({'kind': kind, 'params': allparams,
+                             'dtype': data.dtype.str, 'shape': data.shape}, sort_keys=True)
+
+        h = hashlib.sha1()
+        h.update(header.encode('utf-8'))
+        h.update(data.tobytes())
+        key = h.hexdigest()
+
+        if not (os.path.exists(self._path(key, '.png')) or os.path.exists(self._path(key, '.npy'))):
+            buf = io.BytesIO()
+            np.save(buf, data, allow_pickle=False)
+            # the data goes last, so that a job that has data has a header too
+            write_atomic(self._path(key, '.json'), header.encode('utf-8'))
+            write_atomic(self._path(key, '.npy'), buf.getvalue())
+        return key
+
+    def render(self, key):
+        """The PNG for key, rendering it if it hasn't been already. None if there is no such image."""
+        if not key_re.fullmatch(key):
+            return None
+        png_path = self._path(key, '.png')
+        try:
+            with open(png_path, 'rb') as f:
+                png = f.read()
+            # the modification time records when the image was last used, for cleanup
+            try:
+                os.utime(png_path)
+            except FileNotFoundError:
+                pass
+            return png
+        except FileNotFoundError:
+            pass
+
+        try:
+            with open(self._path(key, '.json'), 'rt') as f:
+                header = json.load(f)
+            data = np.load(self._path(key, '.npy'), allow_pickle=False)
+        except FileNotFoundError:
+            # someone else might have just rendered it
+            try:
+                with open(png_path, 'rb') as f:
+                    return f.read()
+            except FileNotFoundError:
+                return None
+
+        png = renderers[header['kind']](data, header['params'])
+        write_atomic(png_path, png)
+        for ext in ('.npy', '.json'):
+            try:
+                os.unlink(self._path(key, ext))
+            except FileNotFoundError:
+                pass
+        return png
+
+    def touch(self, key):
+        """Mark the image for key as just used, so cleanup keeps it for longer.
+        False if it isn't in the store (any more).
+        """
+        for ext in ('.png', '.npy'):
+            try:
+                os.utime(self._path(key, ext))
+                return True
+            except FileNotFoundError:
+                pass
+        return False
+
+    def cleanup(self, max_bytes, max_age=None):
+        """Delete the least recently used images until the store takes up at most max_bytes,
+        and delete data that has waited more than max_age seconds without being rendered,
+        since most results are never looked at. Returns the number of images deleted.
+        """
+        now = time.time()
+        entries = {}
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            key, ext = os.path.splitext(name)
+            if not key_re.fullmatch(key) or ext not in ('.png', '.npy', '.json'):
+                # leftover temporary file from a write_atomic that was killed
+                if now - st.st_mtime > 3600:
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                continue
+            size, used, paths = entries.get(key, (0, 0, []))
+            paths.append(path)
+            entries[key] = (size + st.st_size, max(used, st.st_mtime), paths)
+
+        total = sum(size for size, used, paths in entries.values())
+        deleted = 0
+        for key, (size, used, paths) in sorted(entries.items(), key=lambda kv: kv[1][1]):
+            unrendered = not any(path.endswith('.png') for path in paths)
+            if total <= max_bytes and not (unrendered and max_age is not None and now - used > max_age):
+                continue
+            for path in paths:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            deleted += 1
+        return deleted
+
+
+# for worker pools
+def render_image(root, key):
+    return ImageStore(root).render(key)
+
+# how often the servers call cleanup, in seconds
+cleanup_interval = 60
+
+
+img_route = 'img/'
+img_url_re = re.compile(('/' + img_route + r'([0-9a-f]{40})\.png').encode('ascii'))
+
+def img_url(key):
+    return '/' + img_route + key + '.png'
+
+def img_key(path):
+    """The key for a path like /img/<key>.png, or None if it isn't one."""
+    path = path.lstrip('/')
+    if path.startswith(img_route) and path.endswith('.png'):
+        key = path[len(img_route):-len('.png')]
+        if key_re.fullmatch(key):
+            return key
+    return None
+
+def keep_images(root, response):
+    """Touch every image linked from a cached response (as bytes), so they outlive it in the store.
+    False if any of them has already been deleted, in which case the response should be recomputed.
+    """
+    store = ImageStore(root)
+    return all([store.touch(m.group(1).decode('ascii')) for m in img_url_re.finditer(response)])
+
+def img_headers(key):
+    # the content for a key never changes
+    return [
+        ('Content-Type', 'image/png'),
+        ('Cache-Control', 'public, max-age=31536000, immutable'),
+        ('ETag', '"' + key + '"'),
+    ]
+
+def not_modified(key, if_none_match):
+    return if_none_match is not None and ('"' + key + '"' in if_none_match or if_none_match.strip() == '*')
@@ -211,7 +211,11 @@ function eval_result(result, id_name, link_url) {
             }
             body += '</table>';
         }
-        if ('result_img' in result) {
+        if ('result_img_url' in result) {
+            body += '<div class="output-row">';
+            body += '<img src="' + result.result_img_url + '" alt="computed image" />';
+            body += '</div>';
+        } else if ('result_img' in result) {
             body += '<div class="output-row">';
             body += '<img src="data:image/png;base64, ' + result.result_img + '" alt="computed image" />';
             body += '</div>';
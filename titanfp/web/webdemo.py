@@ -1,6 +1,7 @@
 import sys
 import os
 import io
+import time
 import threading
 import traceback
 import html
@@ -8,12 +9,16 @@ import json
 import base64
 import http
 import multiprocessing
+import tempfile
+import hashlib
 
 from PIL import Image
 import numpy as np
 
 # from .fserver import AsyncTCPServer, AsyncHTTPRequestHandler
 from . import fserver
+from . import aserver
+from . import imgstore
 
 from ..titanic.utils import *
 
@@ -24,6 +29,8 @@ from ..arithmetic import ieee754, posit
 #from ..arithmetic import softfloat, softposit
 from ..arithmetic import sinking, sinkingposit
 from ..arithmetic import mpmf
+from ..arithmetic import tiling
+from ..quantifind import imgkernel
 
 here = os.path.dirname(os.path.realpath(__file__))
 dist = os.path.join(here, 'dist')
@@ -59,6 +66,10 @@ webdemo_mpmf_backends = {
     'mpmf'
 }
 
+# images with more pixels than this are evaluated tile by tile, if the core allows it
+webdemo_tile_pixels = 1 << 18
+webdemo_tile_shape = (128, 128)
+
 class WebtoolError(Exception):
     """Unable to run webtool; malformed data or bad options."""
 
@@ -69,6 +80,51 @@ class WebtoolArgumentError(WebtoolError):
     """Unable to decipher FPCore arguments."""
 
 
+# Binary /eval requests are this magic string, the length of a JSON request as a 4-byte
+# little-endian integer, the JSON request, and then an NPY file (as written by numpy.save)
+# with an array to pass as the first argument. That saves encoding big arrays and images
+# as text (or even as base64, which is also accepted, in the JSON request as usr_array).
+webdemo_binary_magic = b'\x93TITANIC'
+
+def split_eval_request(data):
+    """The JSON part of an /eval request, and the NPY part (or None)."""
+    if data.startswith(webdemo_binary_magic):
+        start = len(webdemo_binary_magic) + 4
+        length = int.from_bytes(data[len(webdemo_binary_magic):start], 'little')
+        if start + length > len(data):
+            raise WebtoolError('truncated binary request')
+        return data[start:start + length], data[start + length:]
+    else:
+        return data, None
+
+def decode_npy(buf):
+    try:
+        return np.load(io.BytesIO(buf), allow_pickle=False)
+    except Exception as e:
+        raise WebtoolArgumentError('unable to read NPY array: ' + str(e))
+
+def is_image_array(a):
+    return a.dtype == np.uint8 and len(a.shape) == 3 and a.shape[2] in [3,4]
+
+
+# parsed FPCores, by source text; each pool worker has its own.
+# The text is only stripped: collapsing whitespace would change the meaning
+# of comments and string literals, and FPy syntax is whitespace sensitive anyway.
+webdemo_core_cache = aserver.AsyncCache(256)
+
+def compile_cores(buf):
+    buf = buf.strip()
+    try:
+        cores = webdemo_core_cache.lookup(buf)
+    except KeyError:
+        if buf.startswith('FPCore'):
+            cores = fpyparser.compile(buf)
+        else:
+            cores = fpcparser.compile(buf)
+        webdemo_core_cache.update(buf, cores)
+    return cores
+
+
 class WebtoolState(object):
 
     def _read_int(self, x, name, minimum=None, maximum=None):
@@ -106,23 +162,23 @@ class WebtoolState(object):
     nbits = 64
     posit_override = False
     img = None
+    img_array = None
     img_tensor = None
+    array = None
     enable_analysis = None
     heatmap = None
 
     def __init__(self, data):
+        data, npy = split_eval_request(data)
         try:
             payload = json.loads(data.decode('utf-8'))
         except json.decoder.JSONDecodeError:
             raise WebtoolError('malformed json request data')
 
         if 'core' in payload:
-            buf = str(payload['core']).strip()
+            buf = str(payload['core'])
             try:
-                if buf.startswith('FPCore'):
-                    self.cores = fpyparser.compile(buf)
-                else:
-                    self.cores = fpcparser.compile(buf)
+                self.cores = compile_cores(buf)
             except fpcparser.FPCoreParserError as e:
                 raise WebtoolParseError(str(e))
             except Exception:
@@ -161,12 +217,29 @@ class WebtoolState(object):
             try:
                 decoded = base64.decodebytes(bytes(imgdata, 'ascii'))
                 self.img = Image.open(io.BytesIO(decoded))
-                self.img_tensor = np_array_to_ndarray(np.array(self.img))
+                # the tensor is only built if the image isn't evaluated in tiles
+                self.img_array = np.array(self.img)
             except Exception:
                 print('Exception decoding user image:', file=sys.stderr, flush=True)
                 traceback.print_exc()
                 print('', file=sys.stderr, flush=True)
 
+        if 'usr_array' in payload:
+            try:
+                npy = base64.b64decode(str(payload['usr_array']))
+            except ValueError:
+                raise WebtoolArgumentError('usr_array must be a base64 encoded NPY file')
+
+        if npy is not None:
+            if self.img_array is not None:
+                raise WebtoolArgumentError('can only provide one image or array')
+            a = decode_npy(npy)
+            # arrays that look like images are treated like uploaded images
+            if is_image_array(a):
+                self.img_array = a
+            else:
+                self.array = a
+
         if 'enable_analysis' in payload:
             self.enable_analysis = self._read_bool(payload['enable_analysis'], 'enable_analysis')
 
@@ -196,58 +269,136 @@ class WebtoolState(object):
             return None
 
 
-def np_array_to_sexp(a):
+def write_np_array_sexp(a, f):
+    """Write an array to the file f as nested s-expressions,
+    without building the whole string in memory.
+    """
     if isinstance(a, np.ndarray):
-        return '(' + ' '.join((np_array_to_sexp(elt) for elt in a)) + ')'
+        f.write('(')
+        for i, elt in enumerate(a):
+            if i > 0:
+                f.write(' ')
+            write_np_array_sexp(elt, f)
+        f.write(')')
+    elif isinstance(a, np.generic):
+        f.write(repr(a.item()))
     else:
-        return repr(a)
+        f.write(repr(a))
 
-def img_to_sexp(img):
-    a = np.array(img)
-    return np_array_to_sexp(a)
+def np_array_to_sexp(a):
+    buf = io.StringIO()
+    write_np_array_sexp(a, buf)
+    return buf.getvalue()
+
+def img_to_sexp(img, f=None):
+    a = np.asarray(img)
+    if f is None:
+        return np_array_to_sexp(a)
+    else:
+        write_np_array_sexp(a, f)
 
-# convert everything into integers, should be fine for images
+# build a tensor straight from the buffer, with python ints or floats as the elements;
+# the interpreter rounds each distinct one into the context just once
 def np_array_to_ndarray(a):
-    data, shape = ndarray.reshape(a)
-    return ndarray.NDArray(data=map(int, data), shape=shape)
+    a = np.asarray(a)
+    if len(a.shape) < 1 or a.size < 1:
+        raise WebtoolArgumentError('array argument must have at least one dimension and one element')
+    if a.dtype.kind == 'b':
+        a = a.astype(np.int64)
+    elif a.dtype.kind not in 'iuf':
+        raise WebtoolArgumentError('unsupported array element type ' + str(a.dtype))
+    return ndarray.NDArray(data=a.ravel().tolist(), shape=a.shape)
 
 def pixel(x):
     return max(0, min(int(x), 255))
 
-def b64_encode_image(e):
+class ImageTiles(tiling.InterpreterTiles):
+    """Only image results can be put back together from tiles and shown;
+    anything else is found out on the first tile, and evaluated the usual way.
+    """
+
+    def __call__(self, tile):
+        result, evals = super().__call__(tile)
+        if len(result.shape) != 3 or result.shape[2] not in [3,4]:
+            raise tiling.TilingError('result of shape {} is not an image'.format(repr(result.shape)))
+        return result, evals
+
+def image_bitmap(e):
     bitmap_tensor = ndarray.NDArray(shape=e.shape, data=map(pixel, e.data))
-    bitmap = np.array(bitmap_tensor, dtype=np.uint8)
-    img = Image.fromarray(bitmap)
-    buf = io.BytesIO()
-    img.save(buf, format='PNG')
-    data = str(base64.encodebytes(buf.getvalue()), 'ascii')
-    buf.close()
-    return data
+    return np.array(bitmap_tensor, dtype=np.uint8)
+
+def b64_encode_image(e):
+    return b64_encode_bitmap(image_bitmap(e))
 
+def b64_encode_bitmap(bitmap):
+    return str(base64.encodebytes(imgstore.bitmap_png(bitmap, imgstore.default_params['bitmap'])), 'ascii')
 
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
+def plot_points(result_array):
+    return np.array([[float(str(x)), float(str(y)), float(str(z))] for x,y,z in result_array], dtype=np.float64)
 
 def mkplot_b64(result_array):
-    results = [[], [], []]
-    for x,y,z in result_array:
-        r_x, r_y, r_z = results
-        r_x.append(float(str(x)))
-        r_y.append(float(str(y)))
-        r_z.append(float(str(z)))
-
-    fig = plt.figure(figsize=(8,6), dpi=80)
-    ax = Axes3D(fig)
-    ax.set_xlabel('x')
-    ax.set_ylabel('y')
-    ax.set_zlabel('z')
-    ax.plot(results[0], results[1], results[2], color='blue', lw=1)
-    buf = io.BytesIO()
-    fig.savefig(buf, format='png')
-    data = str(base64.encodebytes(buf.getvalue()), 'ascii')
-    plt.close(fig)
-    buf.close()
-    return data
+    png = imgstore.plot3d_png(plot_points(result_array), imgstore.default_params['plot3d'])
+    return str(base64.encodebytes(png), 'ascii')
+
+def add_result_img(result, store, kind, data):
+    """With an image store, the image is only saved to be rendered later, and the result links to it;
+    otherwise it is rendered now, and inlined in the result.
+    """
+    if store is not None:
+        result['result_img_url'] = imgstore.img_url(store.put(kind, data))
+    elif kind == 'plot3d':
+        result['result_img'] = str(base64.encodebytes(imgstore.plot3d_png(data, imgstore.default_params[kind])), 'ascii')
+    else:
+        result['result_img'] = b64_encode_bitmap(data)
+
+
+def eval_cache_key(data):
+    """Key for the response to an /eval request: everything in the request that affects the result,
+    with the source stripped and the image hashed. None if the request can't be read.
+    """
+    try:
+        data, npy = split_eval_request(data)
+        payload = json.loads(data.decode('utf-8'))
+    except Exception:
+        return None
+    if not isinstance(payload, dict):
+        return None
+
+    backend = str(payload.get('backend', '')).strip()
+    if backend in webdemo_float_backends:
+        precision = ('float', str(payload.get('w', WebtoolState.w)), str(payload.get('p', WebtoolState.p)))
+        override = str(payload.get('float_override', WebtoolState.float_override))
+    elif backend in webdemo_posit_backends:
+        precision = ('posit', str(payload.get('es', WebtoolState.es)), str(payload.get('nbits', WebtoolState.nbits)))
+        override = str(payload.get('posit_override', WebtoolState.posit_override))
+    else:
+        precision = None
+        override = None
+
+    if npy is not None or 'usr_img' in payload or 'usr_array' in payload:
+        h = hashlib.sha1()
+        for k in ('usr_img', 'usr_array'):
+            h.update(k.encode('ascii') + str(payload.get(k)).encode('utf-8'))
+        if npy is not None:
+            h.update(npy)
+        img = h.hexdigest()
+    else:
+        img = None
+
+    return (
+        str(payload.get('core', '')).strip(),
+        backend,
+        precision,
+        override,
+        ' '.join(str(payload.get('args', '')).split()),
+        str(payload.get('enable_analysis')).lower(),
+        str(payload.get('heatmap')).lower(),
+        img,
+    )
+
+def eval_succeeded(result):
+    # only successful evaluations are cached; run_eval always puts success first
+    return result.startswith(b'{"success": 1')
 
 
 def create_analysis_report(interpreter):
@@ -256,11 +407,12 @@ def create_analysis_report(interpreter):
     return report + '\n\n'.join(reports)
 
 
-def run_eval(data):
+def run_eval(data, image_root=None):
     #print('Eval yo!')
     #print(repr(data))
 
     try:
+        store = imgstore.ImageStore(image_root) if image_root else None
 
         state = WebtoolState(data)
         if state.backend in webdemo_eval_backends:
@@ -283,9 +435,9 @@ def run_eval(data):
 
         nargs = len(state.args)
         extra_arg_msg = ''
-        if state.img is not None:
+        if state.img_array is not None or state.array is not None:
             nargs += 1
-            extra_arg_msg = '\n  If an image is provided, it will be passed in a tensor as the first argument to the core'
+            extra_arg_msg = '\n  If an image or array is provided, it will be passed in a tensor as the first argument to the core'
         if nargs != len(core.inputs):
             raise WebtoolArgumentError('expected {:d} arguments for FPCore, got {:d}:\n  {}{}'
                                        .format(len(core.inputs), len(state.args), ', '.join(map(str, state.args)), extra_arg_msg))
@@ -302,8 +454,27 @@ def run_eval(data):
         if state.backend in webdemo_mpmf_backends:
             ctx = None # use context from the FPCore
 
-        if state.img is not None:
-            args_with_image = [state.img_tensor] + state.args
+        # large images are evaluated tile by tile, if the core is a stencil over them
+        # and has no precondition (which would need the whole image);
+        # this is serial, as we're already running in a pool worker
+        tile_halo = None
+        if state.img_array is not None:
+            rows, cols = state.img_array.shape[:2]
+            if rows * cols > webdemo_tile_pixels and not state.enable_analysis and core.pre is None:
+                try:
+                    tile_halo = tiling.stencil_halo(core)
+                except tiling.TilingError as e:
+                    print(f'not tiling {rows}x{cols} image: {e!s}')
+
+            if tile_halo is None:
+                state.img_tensor = np_array_to_ndarray(state.img_array)
+                img_arg = state.img_tensor
+            else:
+                # a single pixel stands in for the image when binding arguments
+                img_arg = np_array_to_ndarray(state.img_array[:1, :1])
+            args_with_image = [img_arg] + state.args
+        elif state.array is not None:
+            args_with_image = [np_array_to_ndarray(state.array)] + state.args
         else:
             args_with_image = state.args
 
@@ -314,12 +485,12 @@ def run_eval(data):
                           for k, props, shape in core.inputs]
 
             # yuck
-            if state.img is not None:
-                rows, cols, channels = state.img_tensor.shape
+            if state.img_array is not None:
+                rows, cols = state.img_array.shape[:2]
                 named_args[0][1] = '[{}x{} image]'.format(rows, cols)
 
-            # reset the interpreter to avoid counting evals from arguments
-            backend_interpreter = backend()
+            # reset the eval count to avoid counting evals from arguments
+            backend_interpreter.evals = 0
 
             if state.enable_analysis:
                 #backend_interpreter.max_evals = 1000000
@@ -329,15 +500,31 @@ def run_eval(data):
                 pass
                 #backend_interpreter.max_evals = 5000000
 
-            for core in state.cores:
-                backend_interpreter.register_function(core)
-
-            try:
-                pre_val = backend_interpreter.interpret_pre(core, args_with_image, ctx=ctx, override=state.override)
-            except interpreter.EvaluatorError as e:
-                pre_val = str(e)
+            e_bitmap = None
+            if tile_halo is not None:
+                evaluate = ImageTiles(backend, state.cores, core, state.args, ctx=ctx, override=state.override)
+                try:
+                    with tempfile.TemporaryDirectory() as tmpdir:
+                        tiled, eval_count = tiling.run_tiled(evaluate, state.img_array, os.path.join(tmpdir, 'result.npy'),
+                                                             tile_halo, tile_shape=webdemo_tile_shape)
+                        e_bitmap = imgkernel.to_pixels(tiled)
+                        del tiled
+                    e_val = 'image'
+                    pre_val = True
+                except tiling.TilingError as e:
+                    print(f'not tiling {rows}x{cols} image: {e!s}')
+                    tile_halo = None
+                    state.img_tensor = np_array_to_ndarray(state.img_array)
+                    args_with_image = [state.img_tensor] + state.args
+
+            if tile_halo is None:
+                try:
+                    pre_val = backend_interpreter.interpret_pre(core, args_with_image, ctx=ctx, override=state.override)
+                except interpreter.EvaluatorError as e:
+                    pre_val = str(e)
 
-            e_val = backend_interpreter.interpret(core, args_with_image, ctx=ctx, override=state.override)
+                e_val = backend_interpreter.interpret(core, args_with_image, ctx=ctx, override=state.override)
+                eval_count = backend_interpreter.evals
 
             if state.enable_analysis:
                 analysis_report = create_analysis_report(backend_interpreter)
@@ -356,7 +543,7 @@ def run_eval(data):
             'args': named_args,
             'e_val': str(e_val),
             'pre_val': str(pre_val),
-            'eval_count': str(backend_interpreter.evals),
+            'eval_count': str(eval_count),
         }
 
         if analysis_report:
@@ -364,21 +551,23 @@ def run_eval(data):
 
         made_plot = False
 
-        if state.img is not None:
+        if e_bitmap is not None:
+            add_result_img(result, store, 'bitmap', e_bitmap)
+        elif state.img_array is not None:
             if isinstance(e_val, ndarray.NDArray) and len(e_val.shape) == 3 and e_val.shape[2] in [3,4]:
                 e_img = e_val
                 # if state.heatmap:
                 #     e_img = ndarray.NDArray(shape=e_img.shape, data=[
                 #         (max(0, d.ctx.p - d.p) / d.ctx.p) * 255 for d in e_img.data
                 #     ])
-                result['result_img'] = b64_encode_image(e_img)
+                add_result_img(result, store, 'bitmap', image_bitmap(e_img))
                 result['e_val'] = 'image'
         elif state.heatmap:
             print('hm')
             if isinstance(e_val, ndarray.NDArray) and len(e_val.shape) == 2 and e_val.shape[1] == 3:
                 print('  plotting')
                 try:
-                    result['result_img'] = mkplot_b64(e_val)
+                    add_result_img(result, store, 'plot3d', plot_points(e_val))
                     result['e_val'] = '3d plot (disable plot option to print array)'
                     made_plot = True
                 except Exception:
@@ -422,6 +611,10 @@ class TitanicHTTPRequestHandler(fserver.AsyncHTTPRequestHandler):
     # create a subclass and override this to serve static content
     the_content = {}
 
+    # and these to store result images in a directory, and render them in a separate pool
+    the_image_root = None
+    the_render_pool = None
+
     def construct_content(self, data):
         pr = self.translate_path()
 
@@ -441,9 +634,29 @@ class TitanicHTTPRequestHandler(fserver.AsyncHTTPRequestHandler):
 
         stripped_path = pr.path.lstrip('/')
 
+        # rendered images
+        img_key = imgstore.img_key(pr.path)
+        if img_key is not None and self.the_image_root is not None:
+            if imgstore.not_modified(img_key, self.headers.get('If-None-Match')):
+                return http.server.HTTPStatus.NOT_MODIFIED, None, imgstore.img_headers(img_key), b''
+            if self.the_render_pool is None:
+                png = imgstore.render_image(self.the_image_root, img_key)
+            else:
+                png = self.the_render_pool.apply(imgstore.render_image, (self.the_image_root, img_key))
+            if png is not None:
+                return http.server.HTTPStatus.OK, None, imgstore.img_headers(img_key), png
+
         # dynamic content
         if stripped_path == 'eval':
-            result = self.apply(run_eval, (data,))
+            key = eval_cache_key(data) if data else None
+            if self.the_image_root is None:
+                valid = None
+            else:
+                # responses link to images in the store, which may have been cleaned up since
+                valid = lambda result: imgstore.keep_images(self.the_image_root, result)
+            hit, result = self.apply_cached(key, run_eval, (data, self.the_image_root), keep=eval_succeeded, valid=valid)
+            if self.the_cache is not None:
+                self.log_message('eval cache %s, %s', 'hit' if hit else 'miss', self.the_cache.stats())
 
             response = http.server.HTTPStatus.OK
             msg = None
@@ -480,20 +693,60 @@ if __name__ == '__main__':
                         help='number of worker processes to run in parallel')
     parser.add_argument('--serve', type=str, default='',
                         help='serve a directory')
+    parser.add_argument('--cache', type=int, default=1024,
+                        help='number of eval responses to cache')
+    parser.add_argument('--cache-bytes', type=int, default=64 << 20,
+                        help='total size of cached eval responses, in bytes (0 to disable caching)')
+    parser.add_argument('--images', type=str, default='',
+                        help='directory to keep rendered images in (default: a temporary directory)')
+    parser.add_argument('--render-workers', type=int, default=1,
+                        help='number of worker processes to render images')
+    parser.add_argument('--image-bytes', type=int, default=256 << 20,
+                        help='total size of kept images, in bytes; the least recently used are deleted first')
+    parser.add_argument('--image-age', type=float, default=3600.0,
+                        help='seconds to keep data for images that are never looked at')
     args = parser.parse_args()
 
-    with multiprocessing.Pool(args.workers) as pool:
+    if args.cache > 0 and args.cache_bytes > 0:
+        cache = aserver.AsyncCache(args.cache, max_bytes=args.cache_bytes)
+        print('Caching up to {:d} eval responses, {:d} bytes.'.format(args.cache, args.cache_bytes))
+    else:
+        cache = None
+
+    image_root = args.images or tempfile.mkdtemp(prefix='titanic-img-')
+    print('Keeping up to {:d} bytes of images in {}.'.format(args.image_bytes, image_root))
+
+    def clean_images():
+        store = imgstore.ImageStore(image_root)
+        while True:
+            try:
+                store.cleanup(args.image_bytes, max_age=args.image_age)
+            except Exception:
+                traceback.print_exc()
+            time.sleep(imgstore.cleanup_interval)
+
+    cleanup_thread = threading.Thread(target=clean_images)
+    cleanup_thread.daemon = True
+    cleanup_thread.start()
+
+    with multiprocessing.Pool(args.workers) as pool, multiprocessing.Pool(args.render_workers) as render_pool:
 
-        print('{:d} worker processes.'.format(args.workers))
+        print('{:d} worker processes, {:d} render processes.'.format(args.workers, args.render_workers))
 
         if args.serve:
             class CustomHTTPRequestHandler(TitanicHTTPRequestHandler):
                 the_pool = pool
+                the_cache = cache
+                the_image_root = image_root
+                the_render_pool = render_pool
                 the_content = fserver.serve_flat_directory(args.serve)
 
         else:
             class CustomHTTPRequestHandler(TitanicHTTPRequestHandler):
                 the_pool = pool
+                the_cache = cache
+                the_image_root = image_root
+                the_render_pool = render_pool
 
         with fserver.AsyncTCPServer((args.host, args.port,), CustomHTTPRequestHandler) as server:
             server_thread = threading.Thread(target=server.serve_forever)